@@ -1,10 +1,53 @@
-from flask import Flask
+import logging
+import time
+from flask import Flask, g, request
 from api.endpoints import setup_routes
+from db.metrics import histogram, log_event, LOG_SAMPLE_RATE
 
-app = Flask(__name__)
+SLOW_REQUEST_SECONDS = 1.0
+
+REQUEST_LATENCY = histogram('http_request_duration_seconds', "Request latency by route and status",
+                            ('method', 'route', 'status'))
+
+logger = logging.getLogger('api.requests')
+
+
+def install_request_metrics(app):
+    """Records the latency of every request per route template (not raw path) and status."""
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        duration = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_LATENCY.observe(duration, method=request.method, route=route, status=response.status_code)
+        slow = duration >= SLOW_REQUEST_SECONDS or response.status_code >= 500
+        log_event(logger, 'request', logging.WARNING if slow else logging.INFO, 1.0 if slow else LOG_SAMPLE_RATE,
+                  method=request.method, route=route, status=response.status_code,
+                  duration_ms=round(duration * 1000, 1))
+        return response
+
+
+def create_app(test_config=None):
+    """
+    Builds a new Flask application. Nothing here touches the database: the connection pool
+    is created lazily by the first request in each worker process, so the app can be
+    imported or pre-loaded by a forking server (e.g. `gunicorn 'api.app:create_app()'`).
+    """
+    app = Flask(__name__)
+    if test_config:
+        app.config.update(test_config)
+
+    install_request_metrics(app)
+    # Setup routes
+    setup_routes(app)
+    return app
 
-# Setup routes
-setup_routes(app)
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
@@ -1,9 +1,79 @@
-from flask import request, jsonify
-from db.queries import add_user, get_user, update_user, delete_user
+import datetime
+import hmac
+import json
+import os
+from flask import request, jsonify, Response, stream_with_context
+from db.queries import add_user, get_user, get_users, get_profile, update_user, delete_user
 from db.question_queries import add_questionnaire, delete_questionnaire, get_questionnaire
-from db.validators import validate_age
+from db.bulk_queries import bulk_add_users, bulk_add_questionnaires, purge_users
+from db.export_queries import export_ndjson
+from db.workout_queries import add_workout, list_workouts
+from db.workout_stats import get_progress
+from db.recommendation_queries import add_routine, get_routines, recommend_routines
+from db.search_queries import search_questionnaires
+from db.sleep_queries import add_sleep_record, get_sleep_stats
+from db.calendar_queries import (add_calendar_event, delete_calendar_event, get_events_in_window,
+                                 get_next_events, find_conflicts)
+from db.validators import validate_age, validate_questionnaire_fields
+from db.pool import PoolTimeoutError
+from db.hashing import HashingBusyError
+from db.metrics import render as render_metrics
+
+BULK_MAX_RECORDS = 100000
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # required (as a Bearer token) by admin-only routes; unset disables them
+
+def is_admin_request():
+    supplied = request.headers.get('Authorization', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied.encode(), f"Bearer {ADMIN_TOKEN}".encode())
+
+def parse_bulk_records():
+    """
+    Reads a bulk payload that is either a JSON array or NDJSON (one object per line).
+    Returns (records, error_message); unparseable NDJSON lines become None records so
+    that they are reported at their own index.
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        records = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(None)
+    else:
+        records = request.get_json(silent=True)
+        if not isinstance(records, list):
+            return None, "Body must be a JSON array or NDJSON"
+    if len(records) > BULK_MAX_RECORDS:
+        return None, f"At most {BULK_MAX_RECORDS} records are accepted per request"
+    return records, None
+
+def bulk_response(results):
+    failed = sum(1 for result in results if result['status'] != 'success')
+    return jsonify({
+        "status": "success" if not failed else "partial",
+        "total": len(results),
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "results": results
+    }), 200
 
 def setup_routes(app):
+    @app.errorhandler(PoolTimeoutError)
+    def pool_timeout_handler(e):
+        # Every connection is busy and the wait timed out; ask the client to retry later.
+        return jsonify({"status": "error", "message": "Service busy, please retry"}), 503
+
+    @app.errorhandler(HashingBusyError)
+    def hashing_busy_handler(e):
+        # Password hashing is saturated (e.g. a signup burst); shed load instead of queueing forever.
+        return jsonify({"status": "error", "message": "Service busy, please retry"}), 503, {"Retry-After": "1"}
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
     @app.route('/add_user', methods=['POST'])
     def add_user_endpoint():
         data = request.get_json()
@@ -31,6 +101,43 @@ def setup_routes(app):
             response = {"status": "error", "message": "User not found"}
         return jsonify(response)
 
+    @app.route('/users', methods=['GET'])
+    def get_users_endpoint():
+        try:
+            user_ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            return jsonify({"status": "error", "message": "ids must be a comma separated list of user ids"}), 400
+        if not user_ids:
+            return jsonify({"status": "error", "message": "ids is required"}), 400
+        try:
+            users, missing = get_users(user_ids)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        return jsonify({"status": "success", "users": users, "missing": missing}), 200
+
+    @app.route('/profile/<int:user_id>', methods=['GET'])
+    def get_profile_endpoint(user_id):
+        profile = get_profile(user_id)
+        if profile is None:
+            return jsonify({"status": "error", "message": "User not found"}), 404
+        return jsonify({"status": "success", "user_data": profile['user'], "questionnaire": profile['questionnaire']}), 200
+
+    def ndjson_stream(chunks, filename):
+        return Response(stream_with_context(chunks), mimetype='application/x-ndjson',
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+    @app.route('/export/<int:user_id>', methods=['GET'])
+    def export_user_endpoint(user_id):
+        if get_user(user_id) is None:
+            return jsonify({"status": "error", "message": "User not found"}), 404
+        return ndjson_stream(export_ndjson(user_id), f"user-{user_id}.ndjson")
+
+    @app.route('/export', methods=['GET'])
+    def export_all_endpoint():
+        if not is_admin_request():
+            return jsonify({"status": "error", "message": "Forbidden"}), 403
+        return ndjson_stream(export_ndjson(), "all-users.ndjson")
+
     @app.route('/update_user/<int:user_id>', methods=['PUT'])
     def update_user_endpoint(user_id):
         data = request.get_json()
@@ -68,25 +175,8 @@ def setup_routes(app):
     def submit_questionnaire():
         data = request.json
 
-    # List of required fields
-        required_fields = ['user_id', 'description', 'goals', 'challenges', 'expectations']
-        # Initialize a list to keep track of any missing or improperly formatted fields
-        missing_fields = []
-        invalid_fields = []
-
     # Check for missing or improperly formatted fields
-        for field in required_fields:
-            if field not in data or data[field] is None:
-                invalid_fields.append(f"{field} is missing")
-            elif isinstance(data[field], str) and not data[field].strip():
-                invalid_fields.append(f"{field} is empty or contains only whitespace")
-            elif field == 'user_id':
-                try:
-                    data['user_id'] = int(data['user_id'])
-                    if data['user_id'] <= 0:
-                        invalid_fields.append("user_id (invalid value: must be greater than 0)")
-                except ValueError:
-                    invalid_fields.append("user_id (not an integer)")
+        invalid_fields = validate_questionnaire_fields(data)
 
     # Construct an error message if there are issues with the input data
         if invalid_fields:
@@ -104,7 +194,7 @@ def setup_routes(app):
             return jsonify({'status': 'success', 'questionnaire_id': questionnaire_id, 'message': 'Questionnaire added successfully'}), 201
         except Exception as e:
             # Log the exception and return a server error
-            app.logger.error(f"Unexpected error when adding questionnaire: {e}")
+            app.logger.exception("Unexpected error when adding questionnaire")
             return jsonify({'error': 'Unexpected error', 'message': str(e)}), 500
         
         
@@ -131,3 +221,180 @@ def setup_routes(app):
             return jsonify({'status': 'error', 'message': str(e)}), 404
         except Exception as e:
             return jsonify({'status': 'error', 'message': 'Failed to delete questionnaire'}), 500
+
+    @app.route('/search/questionnaires', methods=['GET'])
+    def search_questionnaires_endpoint():
+        # Searches every user's answers, so it is limited to admins (coaches) like /export.
+        if not is_admin_request():
+            return jsonify({"status": "error", "message": "Forbidden"}), 403
+        try:
+            page = search_questionnaires(request.args.get('q'), request.args.get('field'),
+                                         request.args.get('limit', 20, type=int), request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        return jsonify({"status": "success", "results": page['results'], "next_cursor": page['next_cursor']}), 200
+
+    @app.route('/bulk/add_users', methods=['POST'])
+    def bulk_add_users_endpoint():
+        records, error = parse_bulk_records()
+        if error:
+            return jsonify({"status": "error", "message": error}), 400
+        return bulk_response(bulk_add_users(records))
+
+    @app.route('/bulk/add_questionnaires', methods=['POST'])
+    def bulk_add_questionnaires_endpoint():
+        records, error = parse_bulk_records()
+        if error:
+            return jsonify({"status": "error", "message": error}), 400
+        return bulk_response(bulk_add_questionnaires(records))
+
+    @app.route('/bulk/delete_users', methods=['POST'])
+    def bulk_delete_users_endpoint():
+        if not is_admin_request():
+            return jsonify({"status": "error", "message": "Forbidden"}), 403
+        data = request.get_json(silent=True)
+        user_ids = data.get('user_ids') if isinstance(data, dict) else data
+        if not isinstance(user_ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in user_ids):
+            return jsonify({"status": "error", "message": "Body must be a list of user ids or {\"user_ids\": [...]}"}), 400
+        if len(user_ids) > BULK_MAX_RECORDS:
+            return jsonify({"status": "error", "message": f"At most {BULK_MAX_RECORDS} users can be deleted per request"}), 400
+        result = purge_users(user_ids)
+        return jsonify({"status": "success", "deleted": result['deleted'], "missing": result['missing']}), 200
+
+    @app.route('/add_workout', methods=['POST'])
+    def add_workout_endpoint():
+        data = request.get_json(silent=True) or {}
+        missing_fields = [field for field in ['user_id', 'date'] if not data.get(field)]
+        if missing_fields:
+            return jsonify({"status": "error", "message": "Required fields are missing: " + ", ".join(missing_fields)}), 400
+        if not isinstance(data.get('exercises', []), list):
+            return jsonify({"status": "error", "message": "exercises must be a list"}), 400
+
+        try:
+            workout_id = add_workout(data['user_id'], data['date'], data.get('duration'), data.get('intensity'),
+                                     data.get('notes'), data.get('exercises', []))
+            return jsonify({"status": "success", "message": "Workout added", "workout_id": workout_id}), 201
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        except RuntimeError as e:
+            return jsonify({"status": "error", "message": "Internal server error: " + str(e)}), 500
+
+    @app.route('/get_workouts/<int:user_id>', methods=['GET'])
+    def get_workouts_endpoint(user_id):
+        try:
+            page = list_workouts(user_id, request.args.get('limit', 20, type=int), request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        return jsonify({"status": "success", "workouts": page['workouts'], "next_cursor": page['next_cursor']}), 200
+
+    @app.route('/add_routine', methods=['POST'])
+    def add_routine_endpoint():
+        data = request.get_json(silent=True) or {}
+        missing_fields = [field for field in ['user_id', 'name'] if not data.get(field)]
+        if missing_fields:
+            return jsonify({"status": "error", "message": "Required fields are missing: " + ", ".join(missing_fields)}), 400
+
+        try:
+            routine_id = add_routine(data['user_id'], data['name'], data.get('description'))
+            return jsonify({"status": "success", "message": "Routine added", "routine_id": routine_id}), 201
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        except RuntimeError as e:
+            return jsonify({"status": "error", "message": "Internal server error: " + str(e)}), 500
+
+    @app.route('/get_routines/<int:user_id>', methods=['GET'])
+    def get_routines_endpoint(user_id):
+        return jsonify({"status": "success", "routines": get_routines([user_id])}), 200
+
+    @app.route('/recommendations/<int:user_id>', methods=['GET'])
+    def recommendations_endpoint(user_id):
+        try:
+            recommendations = recommend_routines(user_id, request.args.get('k', 5, type=int))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 404
+        except RuntimeError as e:
+            return jsonify({"status": "error", "message": str(e)}), 503
+        return jsonify({"status": "success", **recommendations}), 200
+
+    @app.route('/get_progress/<int:user_id>', methods=['GET'])
+    def get_progress_endpoint(user_id):
+        weeks = request.args.get('weeks', 8, type=int)
+        if not 1 <= weeks <= 52:
+            return jsonify({"status": "error", "message": "weeks must be between 1 and 52"}), 400
+        return jsonify({"status": "success", "progress": get_progress(user_id, weeks)}), 200
+
+    @app.route('/add_sleep_record', methods=['POST'])
+    def add_sleep_record_endpoint():
+        data = request.get_json(silent=True) or {}
+        missing_fields = [field for field in ['user_id', 'sleep_start', 'sleep_end'] if not data.get(field)]
+        if missing_fields:
+            return jsonify({"status": "error", "message": "Required fields are missing: " + ", ".join(missing_fields)}), 400
+
+        try:
+            sleep_id = add_sleep_record(data['user_id'], data['sleep_start'], data['sleep_end'],
+                                        data.get('quality'), data.get('notes'))
+            return jsonify({"status": "success", "message": "Sleep record added", "sleep_id": sleep_id}), 201
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        except RuntimeError as e:
+            return jsonify({"status": "error", "message": "Internal server error: " + str(e)}), 500
+
+    @app.route('/get_sleep_stats/<int:user_id>', methods=['GET'])
+    def get_sleep_stats_endpoint(user_id):
+        try:
+            end = datetime.date.fromisoformat(request.args['end']) if 'end' in request.args else datetime.date.today()
+            start = (datetime.date.fromisoformat(request.args['start']) if 'start' in request.args
+                     else end - datetime.timedelta(days=29))
+            stats = get_sleep_stats(user_id, start, end, request.args.get('bucket', 'day'))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        return jsonify({"status": "success", "sleep_stats": stats}), 200
+
+    @app.route('/add_calendar_event', methods=['POST'])
+    def add_calendar_event_endpoint():
+        data = request.get_json(silent=True) or {}
+        missing_fields = [field for field in ['user_id', 'title', 'start_time'] if not data.get(field)]
+        if missing_fields:
+            return jsonify({"status": "error", "message": "Required fields are missing: " + ", ".join(missing_fields)}), 400
+
+        try:
+            event_id = add_calendar_event(data['user_id'], data['title'], data['start_time'], data.get('end_time'),
+                                          data.get('description'), data.get('location'), data.get('event_type'))
+            return jsonify({"status": "success", "message": "Event added", "event_id": event_id}), 201
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        except RuntimeError as e:
+            return jsonify({"status": "error", "message": "Internal server error: " + str(e)}), 500
+
+    @app.route('/delete_calendar_event/<int:event_id>', methods=['DELETE'])
+    def delete_calendar_event_endpoint(event_id):
+        try:
+            delete_calendar_event(event_id)
+            return jsonify({"status": "success", "message": "Event deleted successfully"}), 200
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 404
+
+    @app.route('/get_events/<int:user_id>', methods=['GET'])
+    def get_events_endpoint(user_id):
+        try:
+            events = get_events_in_window(user_id, request.args.get('start'), request.args.get('end'))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        return jsonify({"status": "success", "events": events}), 200
+
+    @app.route('/get_next_events/<int:user_id>', methods=['GET'])
+    def get_next_events_endpoint(user_id):
+        try:
+            events = get_next_events(user_id, request.args.get('n', 5, type=int), request.args.get('after'))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        return jsonify({"status": "success", "events": events}), 200
+
+    @app.route('/get_conflicts/<int:user_id>', methods=['GET'])
+    def get_conflicts_endpoint(user_id):
+        try:
+            conflicts = find_conflicts(user_id, request.args.get('start'), request.args.get('end'),
+                                       request.args.get('exclude_event_id', type=int))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        return jsonify({"status": "success", "has_conflicts": bool(conflicts), "conflicts": conflicts}), 200
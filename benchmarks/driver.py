@@ -0,0 +1,83 @@
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from benchmarks.report import summarize
+
+
+class InProcessClient:
+    """Calls the Flask app directly through its test client: no sockets, same code path."""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self._client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPClient:
+    """Keep-alive HTTP/1.1 client for a running server (e.g. gunicorn)."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self._connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+        self._prefix = parts.path.rstrip('/')
+
+    def request(self, method, path, body=None):
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self._connection.request(method, self._prefix + path, payload, headers)
+            response = self._connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            self._connection.close()  # reconnects on the next request
+            raise
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+def run_load(make_client, scenario, context, requests, concurrency, warmup=0):
+    """
+    Issues `requests` calls of `scenario` from `concurrency` threads, each with its own
+    client, and returns the latency summary. Calls that raise or return a status other than
+    the scenario's expected one count as errors (their latency is still recorded).
+    """
+    local = threading.local()
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = make_client()
+        return local.client
+
+    def call(i, record=True):
+        method, path, body = scenario.request(context, i)
+        start = time.perf_counter()
+        try:
+            status, _ = client().request(method, path, body)
+            failed = status != scenario.expect
+        except Exception:
+            failed = True
+        elapsed = time.perf_counter() - start
+        if record:
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += failed
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda i: call(i, record=False), range(requests, requests + warmup)))
+        started = time.perf_counter()
+        list(executor.map(call, range(requests)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, errors[0], elapsed)
@@ -0,0 +1,50 @@
+"""Micro-benchmarks of single db-layer calls, run sequentially in this process."""
+import time
+from benchmarks.report import summarize
+from benchmarks.scenarios import FIXTURE_PASSWORD, fixture_email
+
+
+def _measure(fn, iterations, warmup):
+    for i in range(warmup):
+        fn(-1 - i)
+    latencies = []
+    errors = 0
+    for i in range(iterations):
+        start = time.perf_counter()
+        try:
+            fn(i)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, errors)
+
+
+def run_micro(context, iterations=200, warmup=5, names=None):
+    from db.cache import make_cache
+    from db.hashing import hash_password
+    from db.queries import add_user, get_user
+    from db.search_queries import search_questionnaires
+    from db.validators import validate_email
+
+    user_cache = make_cache('user')
+    users = context['users']
+
+    def get_user_uncached(i):
+        user_cache.invalidate(users[i % len(users)])
+        get_user(users[i % len(users)])
+
+    benchmarks = {
+        'micro.validate_email': (lambda i: validate_email(f"someone.{i}@example.com"), iterations * 50),
+        'micro.hash_password': (lambda i: hash_password(FIXTURE_PASSWORD), max(iterations // 10, 10)),
+        'micro.add_user': (lambda i: add_user('Bench', 'Micro', fixture_email(context, 'micro', i),
+                                              FIXTURE_PASSWORD), max(iterations // 10, 10)),
+        'micro.get_user': (lambda i: get_user(users[i % len(users)]), iterations * 10),
+        'micro.get_user_uncached': (get_user_uncached, iterations),
+        'micro.search_questionnaires': (lambda i: search_questionnaires(
+            ['marathon', 'muscle', 'weight', 'sleep', 'flexibility'][i % 5], 'goals'), iterations),
+    }
+    results = {}
+    for name, (fn, count) in benchmarks.items():
+        if names is None or name.split('.', 1)[1] in names:
+            results[name] = _measure(fn, count, warmup)
+    return results
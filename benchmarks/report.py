@@ -0,0 +1,78 @@
+import json
+import math
+
+LATENCY_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+def percentile(sorted_values, q):
+    """Linear-interpolated percentile (0-100) of an already sorted list."""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q / 100.0
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    if lower == upper:
+        return sorted_values[lower]
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(latencies, errors=0, elapsed=None):
+    """
+    Summary of one benchmark: latencies are in seconds, `elapsed` is the wall time of the whole
+    run (defaults to the sum of latencies, i.e. a sequential run).
+    """
+    values = sorted(latencies)
+    elapsed = elapsed if elapsed is not None else sum(values)
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'throughput_rps': round(len(values) / elapsed, 2) if elapsed else None,
+        'mean_ms': ms(sum(values) / len(values)) if values else None,
+        'p50_ms': ms(percentile(values, 50)),
+        'p95_ms': ms(percentile(values, 95)),
+        'p99_ms': ms(percentile(values, 99)),
+        'max_ms': ms(values[-1]) if values else None
+    }
+
+
+def compare(baseline, current, threshold=0.15):
+    """
+    Benchmarks present in both result files whose latency percentiles grew, or whose
+    throughput fell, by more than `threshold` (a fraction). Returns a list of
+    (benchmark, metric, baseline value, current value).
+    """
+    regressions = []
+    for name, result in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if not before:
+            continue
+        for metric in LATENCY_METRICS:
+            if before.get(metric) and result.get(metric) and result[metric] > before[metric] * (1 + threshold):
+                regressions.append((name, metric, before[metric], result[metric]))
+        if before.get('throughput_rps') and result.get('throughput_rps') is not None \
+                and result['throughput_rps'] < before['throughput_rps'] * (1 - threshold):
+            regressions.append((name, 'throughput_rps', before['throughput_rps'], result['throughput_rps']))
+    return regressions
+
+
+def format_table(results):
+    lines = [f"{'benchmark':32s} {'reqs':>6s} {'err':>4s} {'rps':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}"]
+    for name, r in sorted(results.items()):
+        cells = [r['throughput_rps'], r['p50_ms'], r['p95_ms'], r['p99_ms']]
+        lines.append(f"{name:32s} {r['requests']:6d} {r['errors']:4d} " +
+                     " ".join(f"{c:9.2f}" if c is not None else f"{'-':>9s}" for c in cells))
+    return "\n".join(lines)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_results(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,110 @@
+"""
+Load and micro benchmarks.
+
+    python -m benchmarks.run                                # every route, in-process
+    python -m benchmarks.run --url http://127.0.0.1:8000    # against a running server
+    python -m benchmarks.run --routes get_user,get_workouts --concurrency 32 --requests 2000
+    python -m benchmarks.run --output new.json --compare baseline.json
+
+Both targets use the Postgres configured by DB_USERNAME / DB_PASSWORD: fixtures are created
+through the API and removed directly from the database afterwards. With --compare the run
+exits with status 1 if any shared benchmark regressed by more than --threshold.
+"""
+import argparse
+import datetime
+import platform
+import subprocess
+import sys
+import uuid
+from benchmarks.driver import HTTPClient, InProcessClient, run_load
+from benchmarks.micro import run_micro
+from benchmarks.report import compare, format_table, load_results, write_results
+from benchmarks.scenarios import SCENARIOS, create_fixtures
+
+
+def cleanup(run):
+    """Deletes every user created by the run (they share the run's email prefix) and their data."""
+    from db.bulk_queries import purge_users
+    from db.connection import get_db_cursor
+
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT user_id FROM users WHERE email LIKE %s", (f"bench-{run}-%",))
+        user_ids = [row[0] for row in cursor.fetchall()]
+    return purge_users(user_ids)['deleted']
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the API routes and db layer.")
+    parser.add_argument('--url', help="benchmark a running server instead of the app in-process")
+    parser.add_argument('--routes', help="comma separated scenario names (default: all)")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help="requests per route")
+    parser.add_argument('--warmup', type=int, default=10, help="unrecorded requests per route")
+    parser.add_argument('--users', type=int, default=50, help="fixture users")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--micro', choices=['yes', 'no', 'only'], default='yes', help="run the micro-benchmarks")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="earlier results file to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.15, help="allowed slowdown, as a fraction")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        def make_client():
+            return HTTPClient(args.url)
+    else:
+        from api.app import create_app
+        app = create_app({'TESTING': True})
+
+        def make_client():
+            return InProcessClient(app)
+
+    names = set(args.routes.split(',')) if args.routes else None
+    scenarios = [s for s in SCENARIOS if names is None or s.name in names]
+    context = {'run': uuid.uuid4().hex[:8]}
+    results = {}
+    try:
+        client = make_client()
+        create_fixtures(client, context, users=args.users, seed=args.seed)
+        if args.micro != 'only':
+            for scenario in scenarios:
+                if scenario.setup is not None:
+                    scenario.setup(client, context, args.requests + args.warmup)
+                results['api.' + scenario.name] = run_load(make_client, scenario, context, args.requests,
+                                                           args.concurrency, args.warmup)
+                print(f"api.{scenario.name}: p50 {results['api.' + scenario.name]['p50_ms']} ms", file=sys.stderr)
+        if args.micro != 'no':
+            results.update(run_micro(context, names=names))
+    finally:
+        cleanup(context['run'])
+
+    output = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'target': args.url or 'in-process',
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'python': platform.python_version(),
+        'results': results
+    }
+    write_results(args.output, output)
+    print(format_table(results))
+
+    if args.compare:
+        regressions = compare(load_results(args.compare), output, args.threshold)
+        for name, metric, before, after in regressions:
+            print(f"REGRESSION {name} {metric}: {before} -> {after}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+One scenario per route in api/endpoints.py. Scenarios read from (and a few write to) a set
+of fixture users created through the API itself, so the same scenarios run in-process or
+against a server. Payloads depend only on the request index and the run's seed, so two runs
+issue the same requests.
+"""
+import datetime
+import random
+from collections import namedtuple
+
+FIXTURE_PASSWORD = 'BenchPassword123'
+EPOCH = datetime.datetime(2030, 1, 7, 8, 0)  # fixture calendar starts on a Monday in the future
+
+# request(context, i) -> (method, path, json body or None); setup(client, context, count)
+# creates whatever `count` requests will consume (e.g. rows to delete).
+Scenario = namedtuple('Scenario', ['name', 'request', 'expect', 'setup'])
+
+
+def fixture_email(context, kind, i):
+    return f"bench-{context['run']}-{kind}-{i}@example.com"
+
+
+def _user(context, i):
+    return context['users'][i % len(context['users'])]
+
+
+def _day(context, i):
+    return EPOCH + datetime.timedelta(days=context['rng_offsets'][i % len(context['rng_offsets'])])
+
+
+def create_fixtures(client, context, users=50, per_user=20, seed=0):
+    """Creates `users` users with a questionnaire, a routine and `per_user` workouts, nights and events each."""
+    rng = random.Random(seed)
+    context['rng_offsets'] = [rng.randrange(0, 28) for _ in range(1000)]
+    records = [{'first_name': 'Bench', 'last_name': str(i), 'email': fixture_email(context, 'user', i),
+                'password': FIXTURE_PASSWORD, 'age': 20 + i % 40} for i in range(users)]
+    status, body = client.request('POST', '/bulk/add_users', records)
+    if status != 200 or body['failed']:
+        raise RuntimeError(f"Could not create fixture users: {status} {body}")
+    context['users'] = [result['user_id'] for result in body['results']]
+
+    goals = ['Run a marathon', 'Build muscle', 'Lose weight', 'Sleep better', 'Improve flexibility']
+    client.request('POST', '/bulk/add_questionnaires', [
+        {'user_id': user_id, 'description': 'Benchmark user', 'goals': goals[i % len(goals)],
+         'challenges': 'Time', 'expectations': 'Consistency'} for i, user_id in enumerate(context['users'])])
+
+    for user_id in context['users']:
+        for j in range(per_user):
+            day = EPOCH - datetime.timedelta(days=j)
+            client.request('POST', '/add_workout', {
+                'user_id': user_id, 'date': day.date().isoformat(), 'duration': 30 + j % 60,
+                'exercises': [{'name': 'Squat', 'reps': 10, 'sets': 3, 'weight': 60 + j}]})
+            client.request('POST', '/add_sleep_record', {
+                'user_id': user_id, 'sleep_start': (day - datetime.timedelta(hours=9)).isoformat(),
+                'sleep_end': (day - datetime.timedelta(hours=1, minutes=rng.randrange(60))).isoformat(),
+                'quality': str(rng.randint(1, 5))})
+            start = EPOCH + datetime.timedelta(days=j, hours=rng.randrange(10))
+            client.request('POST', '/add_calendar_event', {
+                'user_id': user_id, 'title': 'Training', 'start_time': start.isoformat(),
+                'end_time': (start + datetime.timedelta(hours=1)).isoformat()})
+        client.request('POST', '/add_routine', {'user_id': user_id, 'name': 'Benchmark routine',
+                                                'description': 'Three sessions a week'})
+
+
+def _create_users(kind):
+    def setup(client, context, count):
+        records = [{'first_name': 'Bench', 'last_name': kind, 'email': fixture_email(context, kind, i),
+                    'password': FIXTURE_PASSWORD} for i in range(count)]
+        status, body = client.request('POST', '/bulk/add_users', records)
+        context[kind] = [result['user_id'] for result in body['results']]
+        if kind == 'delete_questionnaire':
+            client.request('POST', '/bulk/add_questionnaires', [
+                {'user_id': user_id, 'description': 'd', 'goals': 'g', 'challenges': 'c', 'expectations': 'e'}
+                for user_id in context[kind]])
+    return setup
+
+
+def _create_events(client, context, count):
+    context['delete_calendar_event'] = []
+    for i in range(count):
+        start = EPOCH + datetime.timedelta(days=60, minutes=i)
+        _, body = client.request('POST', '/add_calendar_event', {
+            'user_id': _user(context, i), 'title': 'To delete', 'start_time': start.isoformat()})
+        context['delete_calendar_event'].append(body['event_id'])
+
+
+def _window(context, i):
+    start = _day(context, i)
+    return f"start={start.isoformat()}&end={(start + datetime.timedelta(days=7)).isoformat()}"
+
+
+SCENARIOS = [
+    Scenario('metrics', lambda c, i: ('GET', '/metrics', None), 200, None),
+    Scenario('add_user', lambda c, i: ('POST', '/add_user', {
+        'first_name': 'Bench', 'last_name': 'New', 'email': fixture_email(c, 'add', i),
+        'password': FIXTURE_PASSWORD, 'age': 30}), 200, None),
+    Scenario('get_user', lambda c, i: ('GET', f"/get_user/{_user(c, i)}", None), 200, None),
+    Scenario('get_users', lambda c, i: ('GET', '/users?ids=' + ','.join(
+        str(_user(c, i * 10 + j)) for j in range(10)), None), 200, None),
+    Scenario('get_profile', lambda c, i: ('GET', f"/profile/{_user(c, i)}", None), 200, None),
+    Scenario('export_user', lambda c, i: ('GET', f"/export/{_user(c, i)}", None), 200, None),
+    Scenario('update_user', lambda c, i: ('PUT', f"/update_user/{_user(c, i)}", {
+        'email': fixture_email(c, 'user', i % len(c['users']))}), 200, None),
+    Scenario('delete_user', lambda c, i: ('DELETE', f"/delete_user/{c['delete_user'][i]}", None), 200,
+             _create_users('delete_user')),
+    Scenario('add_questionnaire', lambda c, i: ('POST', '/add_questionnaire', {
+        'user_id': _user(c, i), 'description': 'More', 'goals': 'Strength', 'challenges': 'Sleep',
+        'expectations': 'Progress'}), 201, None),
+    Scenario('get_questionnaire', lambda c, i: ('GET', f"/get_questionnaire/{_user(c, i)}", None), 200, None),
+    Scenario('delete_questionnaire',
+             lambda c, i: ('DELETE', f"/delete_questionnaire/{c['delete_questionnaire'][i]}", None), 200,
+             _create_users('delete_questionnaire')),
+    Scenario('bulk_add_users', lambda c, i: ('POST', '/bulk/add_users', [
+        {'first_name': 'Bench', 'last_name': 'Bulk', 'email': fixture_email(c, f'bulk{i}', j),
+         'password': FIXTURE_PASSWORD} for j in range(10)]), 200, None),
+    Scenario('bulk_add_questionnaires', lambda c, i: ('POST', '/bulk/add_questionnaires', [
+        {'user_id': _user(c, i * 10 + j), 'description': 'd', 'goals': 'g', 'challenges': 'c',
+         'expectations': 'e'} for j in range(10)]), 200, None),
+    Scenario('add_workout', lambda c, i: ('POST', '/add_workout', {
+        'user_id': _user(c, i), 'date': _day(c, i).date().isoformat(), 'duration': 45,
+        'exercises': [{'name': 'Bench press', 'reps': 8, 'sets': 4, 'weight': 70},
+                      {'name': 'Row', 'reps': 10, 'sets': 3, 'weight': 50}]}), 201, None),
+    Scenario('get_workouts', lambda c, i: ('GET', f"/get_workouts/{_user(c, i)}?limit=20", None), 200, None),
+    Scenario('add_routine', lambda c, i: ('POST', '/add_routine', {
+        'user_id': _user(c, i), 'name': f"Routine {i}"}), 201, None),
+    Scenario('get_recommendations', lambda c, i: ('GET', f"/recommendations/{_user(c, i)}?k=5", None), 200, None),
+    Scenario('get_progress', lambda c, i: ('GET', f"/get_progress/{_user(c, i)}", None), 200, None),
+    Scenario('add_sleep_record', lambda c, i: ('POST', '/add_sleep_record', {
+        'user_id': _user(c, i),
+        'sleep_start': (_day(c, i) + datetime.timedelta(days=40, hours=15)).isoformat(),
+        'sleep_end': (_day(c, i) + datetime.timedelta(days=40, hours=22)).isoformat(),
+        'quality': 'good'}), 201, None),
+    Scenario('get_sleep_stats', lambda c, i: ('GET', f"/get_sleep_stats/{_user(c, i)}?start="
+                                              f"{(EPOCH - datetime.timedelta(days=30)).date()}&end={EPOCH.date()}"
+                                              f"&bucket=week", None), 200, None),
+    Scenario('add_calendar_event', lambda c, i: ('POST', '/add_calendar_event', {
+        'user_id': _user(c, i), 'title': 'Yoga',
+        'start_time': (_day(c, i) + datetime.timedelta(days=30, hours=i % 10)).isoformat()}), 201, None),
+    Scenario('delete_calendar_event',
+             lambda c, i: ('DELETE', f"/delete_calendar_event/{c['delete_calendar_event'][i]}", None), 200,
+             _create_events),
+    Scenario('get_events', lambda c, i: ('GET', f"/get_events/{_user(c, i)}?{_window(c, i)}", None), 200, None),
+    Scenario('get_next_events', lambda c, i: ('GET', f"/get_next_events/{_user(c, i)}?n=5&after="
+                                              f"{_day(c, i).isoformat()}", None), 200, None),
+    Scenario('get_conflicts', lambda c, i: ('GET', f"/get_conflicts/{_user(c, i)}?{_window(c, i)}", None), 200, None),
+]
@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import datetime
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from aiohttp import web
+from bot.dispatcher import Dispatcher
+from bot.sender import SendScheduler, INTERACTIVE
+
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")  # point at a fake server in tests
+WEBHOOK_URL = os.getenv("BOT_WEBHOOK_URL")  # set to receive updates by webhook instead of long polling
+WEBHOOK_SECRET = os.getenv("BOT_WEBHOOK_SECRET")
+WEBHOOK_PORT = int(os.getenv("BOT_WEBHOOK_PORT", "8443"))
+POLL_TIMEOUT = int(os.getenv("BOT_POLL_TIMEOUT", "30"))  # seconds a getUpdates long poll may hang
+MAX_CONCURRENT_UPDATES = int(os.getenv("BOT_MAX_CONCURRENT_UPDATES", "1000"))
+DB_THREADS = int(os.getenv("BOT_DB_THREADS", os.getenv("DB_POOL_MAX_SIZE", "20")))  # no point exceeding the DB pool
+REMINDERS_ENABLED = os.getenv("BOT_REMINDERS", "1") != "0"
+SLEEP_SUMMARIES_ENABLED = os.getenv("BOT_SLEEP_SUMMARIES", "1") != "0"
+SLEEP_SUMMARY_TIME = datetime.time.fromisoformat(os.getenv("BOT_SLEEP_SUMMARY_TIME", "09:00"))  # local time, Mondays
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramError(Exception):
+    def __init__(self, description, error_code=None, retry_after=None):
+        super().__init__(description)
+        self.error_code = error_code
+        self.retry_after = retry_after
+
+
+class TelegramAPI:
+    """Minimal asynchronous Telegram Bot API client."""
+
+    def __init__(self, token, base_url=TELEGRAM_API_URL, session=None):
+        self._url = f"{base_url.rstrip('/')}/bot{token}/"
+        self._session = session
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def call(self, method, request_timeout=None, **params):
+        session = await self._get_session()
+        params = dict((key, value) for key, value in params.items() if value is not None)
+        client_timeout = aiohttp.ClientTimeout(total=request_timeout) if request_timeout else None
+        async with session.post(self._url + method, json=params, timeout=client_timeout) as response:
+            data = await response.json(content_type=None)
+        if not data.get('ok'):
+            retry_after = (data.get('parameters') or {}).get('retry_after')
+            raise TelegramError(data.get('description', 'Telegram request failed'),
+                                data.get('error_code'), retry_after)
+        return data['result']
+
+    async def get_updates(self, offset=None, timeout=POLL_TIMEOUT):
+        return await self.call('getUpdates', request_timeout=timeout + 10, offset=offset, timeout=timeout)
+
+    async def send_message(self, chat_id, text, **params):
+        return await self.call('sendMessage', chat_id=chat_id, text=text, **params)
+
+    async def edit_message_text(self, chat_id, text, message_id, **params):
+        return await self.call('editMessageText', chat_id=chat_id, message_id=message_id, text=text, **params)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+_db_executor = None
+
+
+def run_db(fn, *args, **kwargs):
+    """
+    Runs a blocking db-layer call on the bot's thread pool so it never blocks the event loop.
+    Returns an awaitable.
+    """
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='bot-db')
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(_db_executor, functools.partial(fn, *args, **kwargs))
+
+
+def chat_key(update):
+    """The ordering key of an update: its chat, or the update itself if it has none."""
+    for field in ('message', 'edited_message', 'channel_post'):
+        if field in update:
+            return update[field]['chat']['id']
+    if 'callback_query' in update and 'message' in update['callback_query']:
+        return update['callback_query']['message']['chat']['id']
+    return ('update', update.get('update_id'))
+
+
+class Bot:
+    def __init__(self, api, handler, max_concurrency=MAX_CONCURRENT_UPDATES):
+        self.api = api
+        self._handler = handler
+        self.dispatcher = Dispatcher(self._handle, max_concurrency=max_concurrency)
+        self.sender = SendScheduler(api)
+        self._stopping = asyncio.Event()
+
+    async def _handle(self, update):
+        await self._handler(self, update)
+
+    async def send(self, chat_id, text, priority=INTERACTIVE, **params):
+        """Sends a message through the rate-limited outbound queue and waits until it is delivered."""
+        return await self.sender.send(chat_id, text, priority, **params)
+
+    async def edit(self, chat_id, message_id, text, priority=INTERACTIVE, **params):
+        return await self.sender.edit(chat_id, message_id, text, priority, **params)
+
+    async def feed_update(self, update):
+        await self.dispatcher.submit(chat_key(update), update)
+
+    async def run_polling(self, poll_timeout=POLL_TIMEOUT):
+        offset = None
+        backoff = 1
+        while not self._stopping.is_set():
+            try:
+                updates = await self.api.get_updates(offset=offset, timeout=poll_timeout)
+                backoff = 1
+            except TelegramError as e:
+                await asyncio.sleep(e.retry_after or backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning("getUpdates failed: %s", e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            for update in updates:
+                offset = update['update_id'] + 1
+                await self.feed_update(update)
+
+    def webhook_app(self, path='/webhook', secret_token=WEBHOOK_SECRET):
+        async def receive(request):
+            if secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret_token:
+                return web.Response(status=403)
+            await self.feed_update(await request.json())
+            # Acknowledge immediately; the update is processed in the background.
+            return web.Response(text='ok')
+
+        app = web.Application()
+        app.router.add_post(path, receive)
+        return app
+
+    def stop(self):
+        self._stopping.set()
+
+    async def shutdown(self):
+        self.stop()
+        await self.dispatcher.join()
+        await self.sender.stop()
+        await self.api.close()
+
+
+async def _run(use_webhook):
+    from bot.commands import handle_update, conversations, plans
+
+    if not TELEGRAM_TOKEN:
+        raise EnvironmentError("TELEGRAM_TOKEN environment variable is not set.")
+    api = TelegramAPI(TELEGRAM_TOKEN)
+    bot = Bot(api, handle_update)
+    conversations.load()
+    tasks = [asyncio.create_task(conversations.run_snapshots())]
+    reminders = None
+    if REMINDERS_ENABLED:
+        reminders = _reminder_scheduler(bot)
+        tasks.append(asyncio.create_task(reminders.run()))
+        tasks.append(asyncio.create_task(_listen_for_event_changes(reminders)))
+    if SLEEP_SUMMARIES_ENABLED:
+        tasks.append(asyncio.create_task(_run_weekly_sleep_summaries(bot)))
+    try:
+        if use_webhook:
+            await api.call('setWebhook', url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+            runner = web.AppRunner(bot.webhook_app())
+            await runner.setup()
+            await web.TCPSite(runner, port=WEBHOOK_PORT).start()
+            logger.info("Receiving updates by webhook on port %s", WEBHOOK_PORT)
+            await asyncio.Event().wait()
+        else:
+            await api.call('deleteWebhook')
+            logger.info("Receiving updates by long polling")
+            await bot.run_polling()
+    finally:
+        if reminders is not None:
+            reminders.stop()
+        for task in tasks:
+            task.cancel()
+        await plans.close()
+        await bot.shutdown()
+        conversations.snapshot()
+        await _close_write_buffer()
+
+
+async def _close_write_buffer():
+    # Commit whatever the logging commands still have queued before exiting.
+    from db.write_buffer import close_write_buffer
+
+    await asyncio.get_running_loop().run_in_executor(None, close_write_buffer)
+
+
+def _reminder_scheduler(bot):
+    from bot.reminders import ReminderScheduler
+    from db.reminder_queries import load_upcoming_reminders, claim_reminders
+
+    return ReminderScheduler(bot.sender,
+                             load=lambda after, until, limit: run_db(load_upcoming_reminders, after, until, limit),
+                             claim=lambda reminders, now: run_db(claim_reminders, reminders, now))
+
+
+async def _listen_for_event_changes(reminders):
+    from bot.reminders import listen
+    from db.connection import open_dedicated_connection
+    from db.reminder_queries import NOTIFY_CHANNEL
+
+    await listen(reminders, open_dedicated_connection, NOTIFY_CHANNEL)
+
+
+def next_weekly_run(now, at=SLEEP_SUMMARY_TIME):
+    """The first Monday at `at` strictly after `now`."""
+    run_at = datetime.datetime.combine(now.date() - datetime.timedelta(days=now.weekday()), at)
+    while run_at <= now:
+        run_at += datetime.timedelta(days=7)
+    return run_at
+
+
+async def _run_weekly_sleep_summaries(bot):
+    # Every Monday, last week's summary to every linked user. A restart skips a missed run
+    # rather than sending it twice.
+    from bot.commands import send_weekly_sleep_summaries
+
+    while True:
+        now = datetime.datetime.now()
+        run_at = next_weekly_run(now)
+        await asyncio.sleep((run_at - now).total_seconds())
+        try:
+            sent = await send_weekly_sleep_summaries(bot, run_at.date() - datetime.timedelta(days=7))
+            logger.info("Queued %d weekly sleep summaries", sent)
+        except Exception:
+            logger.exception("Weekly sleep summaries failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Telegram bot.")
+    parser.add_argument('--webhook', action='store_true', default=bool(WEBHOOK_URL),
+                        help="receive updates by webhook (default when BOT_WEBHOOK_URL is set)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run(args.webhook))
+
+
+if __name__ == '__main__':
+    main()
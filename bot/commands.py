@@ -0,0 +1,556 @@
+import asyncio
+import datetime
+import json
+import logging
+import math
+import os
+import time
+from bot.bot import run_db, TelegramError
+from bot.plans import PlanService, load_backend
+from bot.sender import BROADCAST
+from db.queries import get_chat_ids, get_profile, get_user_id_for_chat, link_telegram_chat
+from db.plan_queries import get_stored_plan, store_plan
+from db.question_queries import add_questionnaire, get_questionnaire
+from db.sleep_queries import get_sleep_stats
+from db.calendar_queries import find_free_slots
+from db.sleep_summaries import weekly_sleep_summaries
+from db.workout_stats import get_progress
+from db.write_buffer import get_write_buffer, WriteBufferFullError
+
+CONVERSATION_STATE_PATH = os.getenv("BOT_CONVERSATION_STATE_PATH", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'bot_conversations.json'))
+CONVERSATION_SNAPSHOT_INTERVAL = float(os.getenv("BOT_CONVERSATION_SNAPSHOT_INTERVAL", "5"))  # seconds
+CONVERSATION_TTL = float(os.getenv("BOT_CONVERSATION_TTL", str(7 * 24 * 3600)))  # abandon flows idle this long
+PLAN_EDIT_INTERVAL = float(os.getenv("BOT_PLAN_EDIT_INTERVAL", "1.5"))  # seconds between progressive edits
+MAX_MESSAGE_LENGTH = 4096  # Telegram's limit
+
+logger = logging.getLogger(__name__)
+
+COMMANDS = {}
+
+HELP_TEXT = (
+    "Available commands:\n"
+    "/link <email> <password> - connect this chat to your account\n"
+    "/profile - show your profile\n"
+    "/questionnaire - tell me about your goals\n"
+    "/sleep - your sleep over the last 7 days\n"
+    "/log_sleep <bedtime> <wake time> [quality] - log last night, e.g. /log_sleep 23:30 07:00 good\n"
+    "/log_set <exercise> <sets>x<reps> [weight] - log a set to today's workout\n"
+    "/progress - your training volume and personal records\n"
+    "/plan - a training plan based on your questionnaire\n"
+    "/workout_time [minutes] - find a free slot for a workout\n"
+    "/cancel - stop the current conversation\n"
+    "/help - show this message"
+)
+
+
+def command(name):
+    """Registers a coroutine `handler(bot, message, args)` for /name."""
+    def register(handler):
+        COMMANDS[name] = handler
+        return handler
+    return register
+
+
+async def reply(bot, message, text):
+    await bot.send(message['chat']['id'], text)
+
+
+class Conversation:
+    """Where a chat is in a multi-step flow and the answers collected so far."""
+    __slots__ = ('flow', 'step', 'user_id', 'answers', 'updated_at')
+
+    def __init__(self, flow, user_id, step=0, answers=(), updated_at=None):
+        self.flow = flow
+        self.step = step
+        self.user_id = user_id
+        self.answers = tuple(answers)
+        self.updated_at = updated_at or time.time()
+
+
+class ConversationStore:
+    """
+    In-memory conversation state keyed by chat id, snapshotted to a JSON file so a restart
+    resumes every open flow. Only the snapshot touches disk (and only when something
+    changed); the database is written once, when a flow completes.
+    """
+
+    def __init__(self, path=CONVERSATION_STATE_PATH, ttl=CONVERSATION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._conversations = {}
+        self._dirty = False
+
+    def get(self, chat_id):
+        return self._conversations.get(chat_id)
+
+    def set(self, chat_id, conversation):
+        conversation.updated_at = time.time()
+        self._conversations[chat_id] = conversation
+        self._dirty = True
+
+    def discard(self, chat_id):
+        if self._conversations.pop(chat_id, None) is not None:
+            self._dirty = True
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for chat_id in [c for c, conv in self._conversations.items() if conv.updated_at < cutoff]:
+            self.discard(chat_id)
+
+    def dump(self):
+        """Returns a serialisable copy of the state and marks it clean."""
+        self._expire()
+        self._dirty = False
+        return [[chat_id, c.flow, c.step, c.user_id, list(c.answers), c.updated_at]
+                for chat_id, c in self._conversations.items()]
+
+    def write(self, rows):
+        # Write then rename so a crash mid-write never leaves a truncated snapshot behind.
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(rows, f)
+        os.replace(tmp_path, self.path)
+
+    def snapshot(self):
+        if self._dirty:
+            self.write(self.dump())
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                rows = json.load(f)
+        except FileNotFoundError:
+            return
+        for chat_id, flow, step, user_id, answers, updated_at in rows:
+            if flow in FLOWS:
+                self._conversations[chat_id] = Conversation(flow, user_id, step, answers, updated_at)
+        self._expire()
+
+    async def run_snapshots(self, interval=CONVERSATION_SNAPSHOT_INTERVAL):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            if self._dirty:
+                try:
+                    await loop.run_in_executor(None, self.write, self.dump())
+                except OSError as e:
+                    self._dirty = True
+                    logger.error("Failed to snapshot conversations: %s", e)
+
+
+class Flow:
+    """A fixed sequence of questions; on_complete(bot, message, user_id, answers) runs at the end."""
+
+    def __init__(self, name, steps, on_complete):
+        self.name = name
+        self.steps = steps
+        self.on_complete = on_complete
+
+
+FLOWS = {}
+conversations = ConversationStore()
+
+
+def flow(name, steps):
+    def register(on_complete):
+        FLOWS[name] = Flow(name, steps, on_complete)
+        return on_complete
+    return register
+
+
+async def start_flow(bot, message, name, user_id):
+    conversations.set(message['chat']['id'], Conversation(name, user_id))
+    await reply(bot, message, FLOWS[name].steps[0][1])
+
+
+async def continue_flow(bot, message, conversation):
+    chat_id = message['chat']['id']
+    current = FLOWS[conversation.flow]
+    answer = message['text'].strip()
+    if not answer:
+        await reply(bot, message, current.steps[conversation.step][1])
+        return
+
+    answers = conversation.answers + (answer,)
+    if conversation.step + 1 < len(current.steps):
+        conversation.answers = answers
+        conversation.step += 1
+        conversations.set(chat_id, conversation)
+        await reply(bot, message, current.steps[conversation.step][1])
+        return
+
+    # The flow stays open on its last question until on_complete succeeds, so a failed
+    # save loses nothing: sending the last answer again retries it.
+    await current.on_complete(bot, message, conversation.user_id, answers)
+    conversations.discard(chat_id)
+
+
+async def handle_update(bot, update):
+    message = update.get('message')
+    if not message or 'text' not in message:
+        return
+
+    text = message['text'].strip()
+    if text.startswith('/'):
+        name, _, args = text.partition(' ')
+        name = name[1:].split('@')[0].lower()  # "/help@SomeBot" in group chats
+        handler = COMMANDS.get(name)
+        if handler is not None:
+            await handler(bot, message, args.strip())
+            return
+    else:
+        conversation = conversations.get(message['chat']['id'])
+        if conversation is not None:
+            await continue_flow(bot, message, conversation)
+            return
+    await reply(bot, message, "Sorry, I didn't understand that. Try /help.")
+
+
+async def current_user_id(bot, message):
+    """Returns the user_id linked to the message's chat, replying with instructions if there is none."""
+    user_id = await run_db(get_user_id_for_chat, message['chat']['id'])
+    if user_id is None:
+        await reply(bot, message, "This chat is not linked to an account yet. Use /link <email> <password>.")
+    return user_id
+
+
+@command('start')
+async def start_command(bot, message, args):
+    await reply(bot, message, "Hi! I'm your fitness assistant.\n\n" + HELP_TEXT)
+
+
+@command('help')
+async def help_command(bot, message, args):
+    await reply(bot, message, HELP_TEXT)
+
+
+@command('link')
+async def link_command(bot, message, args):
+    parts = args.split()
+    if len(parts) != 2:
+        await reply(bot, message, "Usage: /link <email> <password>")
+        return
+
+    # The message contains a password; remove it from the chat history whatever happens next.
+    try:
+        await bot.api.call('deleteMessage', chat_id=message['chat']['id'], message_id=message['message_id'])
+    except TelegramError as e:
+        logger.info("Could not delete /link message: %s", e)
+
+    try:
+        await run_db(link_telegram_chat, parts[0], parts[1], message['chat']['id'])
+    except ValueError as e:
+        await reply(bot, message, str(e))
+        return
+    await reply(bot, message, "Your account is now linked to this chat.")
+
+
+@command('profile')
+async def profile_command(bot, message, args):
+    user_id = await current_user_id(bot, message)
+    if user_id is None:
+        return
+    profile = await run_db(get_profile, user_id)
+    if profile is None:
+        await reply(bot, message, "Your account could not be found.")
+        return
+    user, questionnaire = profile['user'], profile['questionnaire']
+
+    lines = [f"{user['first_name']} {user['last_name']} ({user['email']})"]
+    if user.get('age'):
+        lines.append(f"Age: {user['age']}")
+    if questionnaire:
+        lines.append(f"Goals: {questionnaire['goals']}")
+        lines.append(f"Challenges: {questionnaire['challenges']}")
+    await reply(bot, message, "\n".join(lines))
+
+
+@flow('questionnaire', [
+    ('description', "Let's set up your profile. Tell me a bit about yourself and your current routine."),
+    ('goals', "What are your fitness goals?"),
+    ('challenges', "What challenges usually get in your way?"),
+    ('expectations', "What do you expect to achieve with my help?"),
+])
+async def questionnaire_completed(bot, message, user_id, answers):
+    try:
+        await run_db(add_questionnaire, user_id, *answers)
+    except (ValueError, RuntimeError) as e:
+        logger.error("Failed to save questionnaire for user %s: %s", user_id, e)
+        await reply(bot, message, "Sorry, I couldn't save your answers. Please try /questionnaire again later.")
+        return
+    await reply(bot, message, "Thanks! Your answers have been saved.")
+
+
+@command('questionnaire')
+async def questionnaire_command(bot, message, args):
+    user_id = await current_user_id(bot, message)
+    if user_id is None:
+        return
+    await start_flow(bot, message, 'questionnaire', user_id)
+
+
+@command('cancel')
+async def cancel_command(bot, message, args):
+    if conversations.get(message['chat']['id']) is None:
+        await reply(bot, message, "There is nothing to cancel.")
+        return
+    conversations.discard(message['chat']['id'])
+    await reply(bot, message, "Cancelled.")
+
+
+def format_sleep_summary(summary):
+    hours, minutes = divmod(int(summary['avg_duration_minutes'] or 0), 60)
+    lines = [f"Nights logged: {summary['nights']}", f"Average sleep: {hours}h {minutes:02d}m"]
+    if summary.get('duration_stddev_minutes') is not None:
+        lines.append(f"Duration varies by about {int(summary['duration_stddev_minutes'])} min")
+    if summary.get('bedtime_stddev_minutes') is not None:
+        lines.append(f"Bedtime varies by about {int(summary['bedtime_stddev_minutes'])} min")
+    if summary.get('avg_quality') is not None:
+        lines.append(f"Average quality: {summary['avg_quality']}/5")
+    return "\n".join(lines)
+
+
+@command('sleep')
+async def sleep_command(bot, message, args):
+    user_id = await current_user_id(bot, message)
+    if user_id is None:
+        return
+    today = datetime.date.today()
+    stats = await run_db(get_sleep_stats, user_id, today - datetime.timedelta(days=6), today)
+    if not stats['nights']:
+        await reply(bot, message, "No sleep logged in the last 7 days.")
+        return
+    await reply(bot, message, "Your last 7 days:\n" + format_sleep_summary(stats))
+
+
+async def send_weekly_sleep_summaries(bot, week_start):
+    """Sends every linked user their sleep summary for the week starting at `week_start`."""
+    summaries = await run_db(weekly_sleep_summaries, week_start)
+    if not summaries:
+        return 0
+    chat_ids = await run_db(get_chat_ids, list(summaries))
+    for user_id, chat_id in chat_ids.items():
+        bot.sender.enqueue(chat_id, "Your sleep this week:\n" + format_sleep_summary(summaries[user_id]), BROADCAST)
+    return len(chat_ids)
+
+
+def format_progress(progress, records=5):
+    lines = [f"Workouts logged: {progress['workouts']} ({progress['minutes'] // 60}h {progress['minutes'] % 60:02d}m)",
+             f"Total volume: {progress['volume']:g}"]
+    weeks = progress['weeks']
+    if weeks:
+        lines.append("Weekly volume: " + ", ".join(f"{week['volume']:g}" for week in weeks))
+        if len(weeks) > 1 and weeks[-2]['volume']:
+            change = (weeks[-1]['volume'] - weeks[-2]['volume']) / weeks[-2]['volume'] * 100
+            lines.append(f"This week vs last: {change:+.0f}%")
+    lifts = [e for e in progress['exercises'] if e['best_e1rm']][:records]
+    if lifts:
+        lines.append("Best lifts (estimated 1RM):")
+        lines += [f"- {e['exercise']}: {e['best_e1rm']:g} on {e['best_e1rm_date']}" for e in lifts]
+    return "\n".join(lines)
+
+
+@command('progress')
+async def progress_command(bot, message, args):
+    user_id = await current_user_id(bot, message)
+    if user_id is None:
+        return
+    progress = await run_db(get_progress, user_id, 4)
+    if not progress['workouts'] and not progress['exercises']:
+        await reply(bot, message, "No workouts logged yet. Try /log_set squat 3x5 100")
+        return
+    await reply(bot, message, "Your progress:\n" + format_progress(progress))
+
+
+WORKOUT_DAY_START = datetime.time(6, 0)
+WORKOUT_DAY_END = datetime.time(21, 0)
+
+
+@command('workout_time')
+async def workout_time_command(bot, message, args):
+    user_id = await current_user_id(bot, message)
+    if user_id is None:
+        return
+    try:
+        minutes = int(args) if args else 60
+    except ValueError:
+        minutes = 0
+    if not 10 <= minutes <= 240:
+        await reply(bot, message, "Usage: /workout_time [minutes between 10 and 240]")
+        return
+
+    # Only suggest slots that do not clash with anything already in the user's calendar.
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+    slots = []
+    for day in (now.date(), now.date() + datetime.timedelta(days=1)):
+        start = max(now, datetime.datetime.combine(day, WORKOUT_DAY_START))
+        end = datetime.datetime.combine(day, WORKOUT_DAY_END)
+        if start < end:
+            slots += await run_db(find_free_slots, user_id, start, end, datetime.timedelta(minutes=minutes), 3 - len(slots))
+        if len(slots) >= 3:
+            break
+
+    if not slots:
+        await reply(bot, message, "Your calendar is full for today and tomorrow.")
+        return
+    lines = [f"- {datetime.datetime.fromisoformat(slot['start_time']):%a %H:%M}" for slot in slots]
+    await reply(bot, message, f"Free {minutes}-minute slots:\n" + "\n".join(lines))
+
+
+# Logging commands go through the write-behind buffer: bursts of messages from many chats
+# share batched transactions, and the reply is only sent once the write has committed.
+todays_workouts = {}  # user_id -> (date, workout_id), so a burst of /log_set lands in one workout
+
+
+def parse_set(args):
+    """Parses "<exercise name> <sets>x<reps> [weight]"; returns an exercise dict or None."""
+    parts = args.split()
+    for i, part in enumerate(parts):
+        sets, x, reps = part.lower().partition('x')
+        if x and sets.isdecimal() and reps.isdecimal() and i > 0:
+            rest = parts[i + 1:]
+            try:
+                weight = float(rest[0].lower().rstrip('kg')) if rest else None
+            except ValueError:
+                return None
+            if len(rest) > 1 or (weight is not None and not math.isfinite(weight)):  # float() accepts "nan" and "inf"
+                return None
+            return {'name': ' '.join(parts[:i]), 'sets': int(sets), 'reps': int(reps), 'weight': weight}
+    return None
+
+
+async def write_through_buffer(bot, message, submit, *args, **kwargs):
+    """Queues a write and waits for its commit. Returns the result, or None after replying with the error."""
+    try:
+        return await asyncio.wrap_future(submit(*args, **kwargs))
+    except WriteBufferFullError:
+        await reply(bot, message, "I'm a bit busy right now, please send that again in a moment.")
+    except (ValueError, RuntimeError) as e:
+        logger.warning("Buffered write failed: %s", e)
+        await reply(bot, message, "Sorry, I couldn't save that.")
+    return None
+
+
+@command('log_set')
+async def log_set_command(bot, message, args):
+    exercise = parse_set(args)
+    if exercise is None:
+        await reply(bot, message, "Usage: /log_set <exercise> <sets>x<reps> [weight], e.g. /log_set squat 3x5 100")
+        return
+    user_id = await current_user_id(bot, message)
+    if user_id is None:
+        return
+
+    buffer = get_write_buffer()
+    today = datetime.date.today()
+    known = todays_workouts.get(user_id)
+    if known is not None and known[0] == today:
+        if await write_through_buffer(bot, message, buffer.add_exercises, known[1], [exercise]) is None:
+            todays_workouts.pop(user_id, None)  # e.g. the workout was deleted; the next set starts a new one
+            return
+    else:
+        workout_id = await write_through_buffer(bot, message, buffer.add_workout, user_id, today, exercises=[exercise])
+        if workout_id is None:
+            return
+        if len(todays_workouts) > 10000:
+            for stale in [u for u, (day, _) in todays_workouts.items() if day != today]:
+                del todays_workouts[stale]
+        todays_workouts[user_id] = (today, workout_id)
+
+    weight = f" @ {exercise['weight']:g}" if exercise['weight'] is not None else ""
+    await reply(bot, message, f"Logged {exercise['name']}: {exercise['sets']}x{exercise['reps']}{weight}")
+
+
+@command('log_sleep')
+async def log_sleep_command(bot, message, args):
+    parts = args.split(maxsplit=2)
+    try:
+        bedtime = datetime.time.fromisoformat(parts[0])
+        wake_time = datetime.time.fromisoformat(parts[1])
+    except (IndexError, ValueError):
+        await reply(bot, message, "Usage: /log_sleep <bedtime> <wake time> [quality], e.g. /log_sleep 23:30 07:00 good")
+        return
+    user_id = await current_user_id(bot, message)
+    if user_id is None:
+        return
+
+    # Last night: woke up today (or yesterday if that time is still ahead), went to bed before that.
+    now = datetime.datetime.now()
+    sleep_end = datetime.datetime.combine(now.date(), wake_time)
+    if sleep_end > now:
+        sleep_end -= datetime.timedelta(days=1)
+    sleep_start = datetime.datetime.combine(sleep_end.date(), bedtime)
+    if sleep_start >= sleep_end:
+        sleep_start -= datetime.timedelta(days=1)
+
+    quality = parts[2] if len(parts) > 2 else None
+    if await write_through_buffer(bot, message, get_write_buffer().add_sleep_record,
+                                  user_id, sleep_start, sleep_end, quality) is None:
+        return
+    hours, minutes = divmod(int((sleep_end - sleep_start).total_seconds() // 60), 60)
+    await reply(bot, message, f"Logged {hours}h {minutes:02d}m of sleep.")
+
+
+plans = PlanService(load_backend(),
+                    load=lambda key: run_db(get_stored_plan, key),
+                    save=lambda key, backend, text: run_db(store_plan, key, backend, text))
+
+
+def split_message(text, limit=MAX_MESSAGE_LENGTH):
+    """Splits text into messages of at most `limit` characters, at line breaks where possible."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit) + 1 or limit
+        parts.append(text[:cut])
+        text = text[cut:]
+    return parts + [text] if text or not parts else parts
+
+
+async def stream_message(bot, chat_id, chunks, placeholder="...", interval=PLAN_EDIT_INTERVAL):
+    """
+    Shows text while it is still being produced: sends `placeholder`, then edits the message
+    with the text so far at most every `interval` seconds, and once more with the final text.
+    Text beyond one message goes out as follow-up messages at the end. Returns the full text.
+    """
+    message = await bot.send(chat_id, placeholder)
+    shown = placeholder
+    text = ""
+    last_edit = time.monotonic()
+    async for chunk in chunks:
+        text += chunk
+        preview = split_message(text.rstrip())[0]
+        if preview and preview != shown and time.monotonic() - last_edit >= interval:
+            try:
+                await bot.edit(chat_id, message['message_id'], preview)
+                shown = preview
+            except TelegramError as e:
+                logger.info("Could not update streamed message: %s", e)  # the final edit still comes
+            last_edit = time.monotonic()
+
+    parts = split_message(text.rstrip())
+    if parts[0] and parts[0] != shown:
+        await bot.edit(chat_id, message['message_id'], parts[0])
+    for part in parts[1:]:
+        await bot.send(chat_id, part)
+    return text
+
+
+@command('plan')
+async def plan_command(bot, message, args):
+    user_id = await current_user_id(bot, message)
+    if user_id is None:
+        return
+    questionnaire = await run_db(get_questionnaire, user_id)
+    if not questionnaire:
+        await reply(bot, message, "I need to know your goals first. Answer a few questions with /questionnaire.")
+        return
+    try:
+        await stream_message(bot, message['chat']['id'], plans.stream(questionnaire), "Writing your plan...")
+    except Exception:
+        logger.exception("Could not generate a plan for user %s", user_id)
+        await reply(bot, message, "Sorry, I couldn't write your plan right now. Please try /plan again later.")
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    """
+    Runs update handlers concurrently across chats while keeping updates of the same chat
+    strictly in order.
+
+    Each chat with pending updates gets one drain task that processes its queue serially;
+    the task exits (and the chat's queue is dropped) as soon as the queue is empty, so memory
+    is proportional to active chats only. `max_concurrency` caps handlers running at once and
+    `max_pending` makes submit() wait when too many updates are queued (backpressure for the
+    poller or webhook).
+    """
+
+    def __init__(self, handler, max_concurrency=1000, max_pending=10000):
+        self._handler = handler
+        self._max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queues = {}
+        self._tasks = set()
+        self._pending = 0
+        self._capacity = asyncio.Condition()
+        self.processed = 0
+        self.failed = 0
+
+    async def submit(self, key, update):
+        async with self._capacity:
+            await self._capacity.wait_for(lambda: self._pending < self._max_pending)
+            self._pending += 1
+
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(update)
+            return
+        self._queues[key] = deque([update])
+        task = asyncio.create_task(self._drain(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key):
+        queue = self._queues[key]
+        try:
+            while queue:
+                update = queue.popleft()
+                try:
+                    async with self._semaphore:
+                        await self._handler(update)
+                    self.processed += 1
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Unhandled error while processing update for chat %s", key)
+                finally:
+                    async with self._capacity:
+                        self._pending -= 1
+                        self._capacity.notify_all()
+        finally:
+            # Also when cancelled: without its queue the chat's next update starts a new task
+            # instead of waiting forever behind one that is gone.
+            del self._queues[key]
+            if queue:
+                logger.warning("Dropped %d pending update(s) for chat %s", len(queue), key)
+                async with self._capacity:
+                    self._pending -= len(queue)
+                    self._capacity.notify_all()
+
+    async def join(self):
+        """Waits until every submitted update has been handled."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self):
+        return {
+            'active_chats': len(self._queues),
+            'pending': self._pending,
+            'processed': self.processed,
+            'failed': self.failed,
+        }
@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import importlib
+import json
+import logging
+import os
+from db.cache import TTLCache
+
+PLAN_BACKEND = os.getenv("BOT_PLAN_BACKEND", "local")  # "local" or "package.module:factory"
+PLAN_CACHE_SIZE = int(os.getenv("BOT_PLAN_CACHE_SIZE", "10000"))
+PLAN_CACHE_TTL = float(os.getenv("BOT_PLAN_CACHE_TTL", str(24 * 3600)))  # seconds a plan stays in memory
+PLAN_PROMPT_VERSION = 1  # bump when the prompt changes so cached plans are not reused
+
+PLAN_FIELDS = ('description', 'goals', 'challenges', 'expectations')
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_questionnaire(questionnaire):
+    """The fields a plan depends on, lower-cased with whitespace collapsed."""
+    return dict((field, " ".join(str(questionnaire.get(field) or '').lower().split())) for field in PLAN_FIELDS)
+
+
+def plan_key(questionnaire, backend_name):
+    """Cache key of a plan: questionnaires that differ only in case or spacing share one."""
+    payload = json.dumps({'version': PLAN_PROMPT_VERSION, 'backend': backend_name,
+                          'questionnaire': normalize_questionnaire(questionnaire)}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def build_prompt(questionnaire):
+    fields = normalize_questionnaire(questionnaire)
+    return (
+        "Write a four-week training plan for this person. Use short lines, one session per line.\n"
+        f"About them: {fields['description']}\n"
+        f"Goals: {fields['goals']}\n"
+        f"Challenges: {fields['challenges']}\n"
+        f"Expectations: {fields['expectations']}\n"
+    )
+
+
+class LocalPlanBackend:
+    """
+    Deterministic stand-in for a model: builds the plan from keywords in the questionnaire,
+    so the same answers always give the same text. Streams it line by line, `delay` seconds
+    apart, like a model would.
+    """
+    name = 'local'
+
+    FOCUSES = [
+        ('endurance', ('marathon', 'run', 'running', 'cardio', 'endurance', 'cycling', 'swim', 'swimming'),
+         ["Easy run or ride, 30-40 min", "Intervals: 6 x 3 min hard, 2 min easy", "Long steady session, 60+ min"]),
+        ('strength', ('muscle', 'strength', 'strong', 'stronger', 'lift', 'lifting', 'bench', 'squat', 'deadlift'),
+         ["Full body strength: squat, press, row, 3 x 8", "Lower body: deadlift, lunges, 4 x 6",
+          "Upper body: bench, pull-ups, 4 x 8"]),
+        ('weight loss', ('weight', 'fat', 'lose', 'slim', 'diet'),
+         ["Brisk walk or cycle, 45 min", "Circuit: 5 exercises x 40 s, 4 rounds", "Active day: 8,000+ steps"]),
+        ('mobility', ('flexibility', 'mobility', 'yoga', 'stretch', 'stretching', 'posture'),
+         ["Yoga flow, 30 min", "Hip and shoulder mobility, 20 min", "Full body stretch, 20 min"]),
+    ]
+    ADJUSTMENTS = [
+        (('knee', 'back', 'injury', 'pain', 'shoulder'), "Keep sessions low impact and stop if anything hurts."),
+        (('time', 'busy', 'work', 'schedule'), "Short on time? Every session works at 20 minutes too."),
+        (('motivation', 'lazy', 'consistency', 'consistent'), "Book the sessions in your calendar like meetings."),
+        (('sleep', 'tired', 'stress'), "Aim for 7-9 hours of sleep; skip the hard day if you slept badly."),
+    ]
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def lines(self, questionnaire):
+        fields = normalize_questionnaire(questionnaire)
+        goal_words = set(fields['goals'].replace(',', ' ').split())
+        other_words = set(" ".join(fields.values()).replace(',', ' ').split())
+        focuses = [focus for focus in self.FOCUSES if goal_words & set(focus[1])] or [self.FOCUSES[0]]
+
+        lines = [f"Your 4-week plan ({', '.join(focus[0] for focus in focuses)})", ""]
+        for week in range(1, 5):
+            lines.append(f"Week {week}:")
+            sessions = [session for focus in focuses for session in focus[2]][:3 + (week > 2)]
+            for day, session in zip(("Mon", "Wed", "Fri", "Sat"), sessions):
+                lines.append(f"- {day}: {session}" + (" (+10%)" if week > 1 and day == "Mon" else ""))
+        notes = [note for words, note in self.ADJUSTMENTS if other_words & set(words)]
+        if notes:
+            lines += ["", "Notes:"] + [f"- {note}" for note in notes]
+        return lines
+
+    async def stream(self, prompt, questionnaire):
+        for line in self.lines(questionnaire):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield line + "\n"
+
+
+def load_backend(spec=PLAN_BACKEND):
+    """The backend named by `spec`: "local", or "package.module:factory" for anything else."""
+    if spec == 'local':
+        return LocalPlanBackend()
+    module, _, factory = spec.partition(':')
+    if not factory:
+        raise ValueError("BOT_PLAN_BACKEND must be 'local' or 'package.module:factory'")
+    return getattr(importlib.import_module(module), factory)()
+
+
+class _Generation:
+    """One in-flight generation: its chunks so far, followed by any number of readers."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+
+    def push(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        position = 0
+        while True:
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class PlanService:
+    """
+    Generates training plans from questionnaires with a pluggable `backend` (anything with a
+    `name` and an async-iterator `stream(prompt, questionnaire)` of text chunks).
+
+    Plans are cached by plan_key(): first in memory, then through `load(key)` / `save(key,
+    backend, text)` (awaitables, e.g. a database table) so restarts do not pay again.
+    Concurrent requests for the same key share one generation: later callers replay the
+    chunks produced so far and then follow it live. A generation runs in its own task, so it
+    finishes (and is cached) even if the caller that started it goes away.
+    """
+
+    def __init__(self, backend, load=None, save=None, cache=None):
+        self.backend = backend
+        self._load = load
+        self._save = save
+        self._cache = cache if cache is not None else TTLCache('plan', maxsize=PLAN_CACHE_SIZE, ttl=PLAN_CACHE_TTL)
+        self._in_flight = {}
+        self._tasks = set()
+        self._cache_hits = 0
+        self._stored_hits = 0
+        self._coalesced = 0
+        self._generated = 0
+        self._failed = 0
+
+    async def stream(self, questionnaire):
+        """Yields the plan for `questionnaire` in chunks as they become available."""
+        key = plan_key(questionnaire, self.backend.name)
+        text = self._cache.get(key)
+        if text is not None:
+            self._cache_hits += 1
+            yield text
+            return
+        generation = self._in_flight.get(key)
+        if generation is None:
+            generation = self._in_flight[key] = _Generation()
+            task = asyncio.create_task(self._generate(key, questionnaire, generation))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self._coalesced += 1
+        async for chunk in generation.follow():
+            yield chunk
+
+    async def generate(self, questionnaire):
+        """The whole plan as one string."""
+        return "".join([chunk async for chunk in self.stream(questionnaire)])
+
+    async def _generate(self, key, questionnaire, generation):
+        try:
+            text = await self._load(key) if self._load is not None else None
+            if text is not None:
+                self._stored_hits += 1
+                generation.push(text)
+            else:
+                async for chunk in self.backend.stream(build_prompt(questionnaire), questionnaire):
+                    generation.push(chunk)
+                text = "".join(generation.chunks)
+                self._generated += 1
+                if self._save is not None:
+                    try:
+                        await self._save(key, self.backend.name, text)
+                    except Exception:
+                        logger.exception("Could not store generated plan")
+            self._cache.set(key, text)
+            generation.finish()
+        except asyncio.CancelledError:
+            generation.finish(RuntimeError("Plan generation was cancelled"))
+            raise
+        except Exception as e:
+            self._failed += 1
+            logger.exception("Plan generation failed")
+            generation.finish(e)
+        finally:
+            del self._in_flight[key]
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            'cache_hits': self._cache_hits,
+            'stored_hits': self._stored_hits,
+            'coalesced': self._coalesced,
+            'generated': self._generated,
+            'failed': self._failed,
+            'in_flight': len(self._in_flight)
+        }
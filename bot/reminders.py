@@ -0,0 +1,247 @@
+import asyncio
+import datetime
+import heapq
+import json
+import logging
+import os
+from bot.sender import BROADCAST
+
+REMINDER_LEAD = datetime.timedelta(minutes=float(os.getenv("BOT_REMINDER_LEAD_MINUTES", "30")))
+REMINDER_HORIZON = datetime.timedelta(hours=float(os.getenv("BOT_REMINDER_HORIZON_HOURS", "6")))
+REMINDER_MAX_PENDING = int(os.getenv("BOT_REMINDER_MAX_PENDING", "1000000"))
+REMINDER_BATCH_SIZE = int(os.getenv("BOT_REMINDER_BATCH_SIZE", "500"))
+REMINDER_REFRESH_INTERVAL = float(os.getenv("BOT_REMINDER_REFRESH_INTERVAL", "300"))  # seconds
+
+# Sorts after every real event_id, so (t, LAST_ID) means "everything starting at or before t".
+LAST_ID = 2 ** 31
+
+logger = logging.getLogger(__name__)
+
+
+def format_reminder(title, start_time, location=None):
+    text = f"Reminder: {title or 'Event'} at {start_time:%H:%M}"
+    if location:
+        text += f" ({location})"
+    return text
+
+
+class ReminderScheduler:
+    """
+    Sends a reminder `lead` before each calendar event starts.
+
+    Only events starting within `horizon` are held in memory, in a heap ordered by fire time
+    (at most `max_pending` of them); the window slides forward every `refresh_interval`, so
+    memory stays bounded however many events exist. Changes arrive through `on_change`
+    (LISTEN/NOTIFY), which adds, moves or cancels entries without reloading; superseded heap
+    entries are skipped when popped.
+
+    Due reminders are claimed in batches with `claim(reminders, now)` before they are queued,
+    and only the ones this call claimed are sent, so a restart (or a second scheduler) never
+    sends a reminder twice.
+
+    `load(after, until, limit)` and `claim(reminders, now)` are async callables; see
+    db.reminder_queries for the SQL behind them.
+    """
+
+    def __init__(self, sender, load, claim, lead=REMINDER_LEAD, horizon=REMINDER_HORIZON,
+                 max_pending=REMINDER_MAX_PENDING, batch_size=REMINDER_BATCH_SIZE,
+                 refresh_interval=REMINDER_REFRESH_INTERVAL, clock=datetime.datetime.now):
+        self.sender = sender
+        self._load = load
+        self._claim = claim
+        self.lead = lead
+        self.horizon = horizon
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._heap = []      # (fire_at, event_id, start_time), possibly superseded
+        self._pending = {}   # event_id -> start_time currently scheduled
+        self._loaded = None  # (start_time, event_id) key up to which every event has been loaded
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._sent = 0
+        self._skipped = 0
+
+    def reset(self):
+        """Forgets everything; the next refill reloads the window (e.g. after missed notifications)."""
+        self._heap.clear()
+        self._pending.clear()
+        self._loaded = None
+        self._wakeup.set()
+
+    def _push(self, event_id, start_time):
+        if self._pending.get(event_id) == start_time:
+            return
+        self._pending[event_id] = start_time
+        heapq.heappush(self._heap, (start_time - self.lead, event_id, start_time))
+        # Drop superseded entries once they make up most of the heap.
+        if len(self._heap) > 2 * len(self._pending) + 1024:
+            self._heap = [entry for entry in self._heap if self._pending.get(entry[1]) == entry[2]]
+            heapq.heapify(self._heap)
+
+    def schedule(self, event_id, start_time):
+        """An event was added or moved."""
+        self._pending.pop(event_id, None)
+        if self._loaded is None or (start_time, event_id) > self._loaded:
+            return  # picked up when the window reaches it
+        if len(self._pending) >= self.max_pending:
+            # No room: shrink the loaded window to just before this event so a later refill
+            # loads it; entries already beyond that point stay and are not loaded twice.
+            self._loaded = (start_time, event_id - 1)
+            return
+        self._push(event_id, start_time)
+        self._wakeup.set()
+
+    def cancel(self, event_id):
+        """An event was deleted."""
+        self._pending.pop(event_id, None)
+
+    def on_change(self, payload):
+        change = json.loads(payload)
+        if change.get('op') == 'DELETE' or not change.get('start_time'):
+            self.cancel(change['event_id'])
+        else:
+            self.schedule(change['event_id'], datetime.datetime.fromisoformat(change['start_time']))
+
+    async def refill(self):
+        """Loads events up to now + horizon, as far as max_pending allows."""
+        now = self._clock()
+        until = now + self.horizon + self.lead
+        while not self._stopping:
+            if self._loaded is None:
+                self._loaded = (now, LAST_ID)  # events that already started get no reminder
+            if self._loaded >= (until, LAST_ID):
+                return
+            capacity = min(self.max_pending - len(self._pending), self.batch_size * 10)
+            if capacity <= 0:
+                return
+            after = self._loaded
+            rows = await self._load(after, until, capacity)
+            if self._loaded != after:
+                continue  # a change notification moved the window while we were loading
+            for event_id, start_time in rows:
+                self._push(event_id, start_time)
+            if len(rows) < capacity:
+                self._loaded = (until, LAST_ID)
+            else:
+                self._loaded = (rows[-1][1], rows[-1][0])
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            _, event_id, start_time = heapq.heappop(self._heap)
+            if self._pending.get(event_id) == start_time:
+                del self._pending[event_id]
+                due.append((event_id, start_time))
+        return due
+
+    async def fire_due(self):
+        """Claims and queues the reminders that are due now. Returns how many were queued."""
+        queued = 0
+        now = self._clock()
+        due = self._pop_due(now)
+        while due:
+            try:
+                claimed = await self._claim(due, now)
+            except Exception:
+                for event_id, start_time in due:
+                    self._push(event_id, start_time)  # retried on the next pass
+                raise
+            for event_id, chat_id, title, start_time, location in claimed:
+                self.sender.enqueue(chat_id, format_reminder(title, start_time, location), BROADCAST)
+            queued += len(claimed)
+            self._skipped += len(due) - len(claimed)
+            due = self._pop_due(now)
+        self._sent += queued
+        return queued
+
+    def _next_fire_in(self):
+        while self._heap and self._pending.get(self._heap[0][1]) != self._heap[0][2]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max((self._heap[0][0] - self._clock()).total_seconds(), 0)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_refill = 0
+        while not self._stopping:
+            try:
+                if loop.time() >= next_refill or self._loaded is None:
+                    await self.refill()
+                    next_refill = loop.time() + self.refresh_interval
+                await self.fire_due()
+            except Exception:
+                logger.exception("Reminder scheduler iteration failed")
+                await asyncio.sleep(5)
+                continue
+
+            self._wakeup.clear()
+            timeout = max(next_refill - loop.time(), 0)
+            fire_in = self._next_fire_in()
+            if fire_in is not None:
+                timeout = min(timeout, fire_in)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'heap_size': len(self._heap),
+            'loaded_until': self._loaded[0].isoformat() if self._loaded else None,
+            'sent': self._sent,
+            'skipped': self._skipped
+        }
+
+
+async def listen(scheduler, connect, channel, retry_delay=5):
+    """
+    Feeds NOTIFY payloads on `channel` into the scheduler. `connect()` returns a new
+    psycopg2 connection that is used for nothing else. Whenever the connection is (re)opened
+    the scheduler is reset, since notifications may have been missed in between.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        conn = None
+        lost = loop.create_future()
+        try:
+            conn = await loop.run_in_executor(None, connect)
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {channel}")
+            scheduler.reset()
+
+            def readable():
+                try:
+                    conn.poll()
+                except Exception as e:
+                    if not lost.done():
+                        lost.set_exception(e)
+                    return
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        scheduler.on_change(notify.payload)
+                    except (ValueError, KeyError) as e:
+                        logger.warning("Ignoring malformed %s notification %r: %s", channel, notify.payload, e)
+
+            loop.add_reader(conn.fileno(), readable)
+            try:
+                await lost
+            finally:
+                loop.remove_reader(conn.fileno())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Reminder listener connection failed: %s", e)
+        finally:
+            if conn is not None:
+                conn.close()
+        await asyncio.sleep(retry_delay)
@@ -0,0 +1,276 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque
+
+GLOBAL_RATE = float(os.getenv("BOT_SEND_GLOBAL_RATE", "30"))  # messages per second across all chats
+CHAT_RATE = float(os.getenv("BOT_SEND_CHAT_RATE", "1"))  # messages per second to one chat
+CHAT_BURST = int(os.getenv("BOT_SEND_CHAT_BURST", "3"))  # short bursts allowed to one chat
+MAX_QUEUED = int(os.getenv("BOT_SEND_MAX_QUEUED", "100000"))
+MAX_IN_FLIGHT = int(os.getenv("BOT_SEND_MAX_IN_FLIGHT", "30"))
+MAX_RETRIES = 5
+
+INTERACTIVE = 0  # replies to a user who is chatting right now
+BROADCAST = 1  # reminders, plans and other bulk traffic
+
+_SEND = 0
+_IDLE = 1
+
+logger = logging.getLogger(__name__)
+
+
+class SendQueueFull(RuntimeError):
+    """Raised when the outbound queue is at capacity."""
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self):
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self._tokens -= 1
+
+    def pause(self, seconds):
+        """Empties the bucket so that the next token is available only after `seconds`."""
+        self._refill()
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+    def time_until_full(self):
+        self._refill()
+        return max(0.0, (self.capacity - self._tokens) / self.rate)
+
+
+class _Chat:
+    __slots__ = ('queues', 'bucket', 'in_flight', 'scheduled', 'ready')
+
+    def __init__(self, bucket):
+        self.queues = (deque(), deque())  # indexed by priority
+        self.bucket = bucket
+        self.in_flight = False
+        self.scheduled = False
+        self.ready = None  # the ready queue whose entry for this chat is current, if any
+
+    def head_priority(self):
+        for priority, queue in enumerate(self.queues):
+            if queue:
+                return priority
+        return None
+
+
+class SendScheduler:
+    """
+    Outbound message queue that respects Telegram's global and per-chat rate limits.
+
+    Messages for one chat are sent one at a time and in order within a priority class;
+    interactive replies always go before broadcast traffic. A 429 response pauses the chat
+    for the advertised retry_after and the message is retried at the head of its queue.
+    """
+
+    def __init__(self, api, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 max_queued=MAX_QUEUED, max_in_flight=MAX_IN_FLIGHT, clock=time.monotonic):
+        self.api = api
+        self._clock = clock
+        self._global = TokenBucket(global_rate, max(1, int(global_rate)), clock)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._max_queued = max_queued
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._chats = {}
+        # Chat ids whose head message can be sent now, per priority. An entry is stale (and
+        # skipped) unless the chat's `ready` names its queue, so moving a chat is O(1).
+        self._ready = (deque(), deque())
+        self._delayed = []  # heap of (due_at, seq, chat_id, kind): SEND waits for the chat bucket, IDLE for cleanup
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._tasks = set()
+        self._queued = [0, 0]
+        self._sent = [0, 0]
+        self._rate_limited = 0
+        self._failed = 0
+        self._latencies = (deque(maxlen=1000), deque(maxlen=1000))
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, drain=True, timeout=30):
+        if drain:
+            deadline = self._clock() + timeout
+            while (sum(self._queued) or self._tasks) and self._clock() < deadline:
+                await asyncio.sleep(0.05)
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        for task in list(self._tasks):
+            task.cancel()
+
+    def enqueue(self, chat_id, text, priority=INTERACTIVE, **params):
+        """Queues a message and returns a future resolved with the sent message (or the error)."""
+        if sum(self._queued) >= self._max_queued:
+            raise SendQueueFull("Outbound message queue is full")
+        future = asyncio.get_running_loop().create_future()
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(TokenBucket(self._chat_rate, self._chat_burst, self._clock))
+        chat.queues[priority].append((self._clock(), 0, text, params, future))
+        self._queued[priority] += 1
+        if priority == INTERACTIVE and chat.ready == BROADCAST:
+            # The chat was waiting behind broadcast traffic; its reply should not.
+            self._make_ready(chat_id, chat, INTERACTIVE)
+        self._schedule(chat_id, chat)
+        self.start()
+        return future
+
+    async def send(self, chat_id, text, priority=INTERACTIVE, **params):
+        return await self.enqueue(chat_id, text, priority, **params)
+
+    async def edit(self, chat_id, message_id, text, priority=INTERACTIVE, **params):
+        """Replaces the text of a message already sent; queued and rate limited like a send."""
+        return await self.enqueue(chat_id, text, priority, message_id=message_id, **params)
+
+    def _schedule(self, chat_id, chat):
+        if chat.in_flight or chat.scheduled:
+            return
+        priority = chat.head_priority()
+        if priority is None:
+            # Forget idle chats once their bucket has refilled, so memory tracks active chats only.
+            refill = chat.bucket.time_until_full()
+            if refill <= 0:
+                del self._chats[chat_id]
+            else:
+                heapq.heappush(self._delayed, (self._clock() + refill, next(self._seq), chat_id, _IDLE))
+            return
+        chat.scheduled = True
+        delay = chat.bucket.delay()
+        if delay <= 0:
+            self._make_ready(chat_id, chat, priority)
+        else:
+            heapq.heappush(self._delayed, (self._clock() + delay, next(self._seq), chat_id, _SEND))
+        self._wakeup.set()
+
+    def _promote_delayed(self):
+        now = self._clock()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, chat_id, kind = heapq.heappop(self._delayed)
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                continue
+            if kind == _IDLE:
+                if not (chat.scheduled or chat.in_flight):
+                    self._schedule(chat_id, chat)
+                continue
+            delay = chat.bucket.delay()
+            if delay > 0:
+                heapq.heappush(self._delayed, (now + delay, next(self._seq), chat_id, _SEND))
+                continue
+            self._make_ready(chat_id, chat, chat.head_priority())
+
+    def _make_ready(self, chat_id, chat, priority):
+        chat.ready = priority
+        self._ready[priority].append(chat_id)
+
+    def _next_ready(self):
+        for priority, ready in enumerate(self._ready):
+            while ready:
+                chat_id = ready.popleft()
+                chat = self._chats.get(chat_id)
+                if chat is not None and chat.ready == priority:
+                    chat.ready = None
+                    return chat_id
+        return None
+
+    async def _run(self):
+        while True:
+            self._promote_delayed()
+            chat_id = self._next_ready()
+            if chat_id is None:
+                self._wakeup.clear()
+                timeout = self._delayed[0][0] - self._clock() if self._delayed else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self._global.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._in_flight.acquire()
+
+            chat = self._chats[chat_id]
+            priority = chat.head_priority()
+            item = chat.queues[priority].popleft()
+            self._queued[priority] -= 1
+            self._global.take()
+            chat.bucket.take()
+            chat.scheduled = False
+            chat.in_flight = True
+            task = asyncio.create_task(self._deliver(chat_id, chat, priority, item))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, chat_id, chat, priority, item):
+        enqueued_at, attempts, text, params, future = item
+        try:
+            if not future.cancelled():
+                deliver = self.api.edit_message_text if 'message_id' in params else self.api.send_message
+                result = await deliver(chat_id, text, **params)
+                self._sent[priority] += 1
+                self._latencies[priority].append(self._clock() - enqueued_at)
+                future.set_result(result)
+        except Exception as e:
+            retry_after = getattr(e, 'retry_after', None)  # set by TelegramError on 429
+            if retry_after and attempts < MAX_RETRIES:
+                self._rate_limited += 1
+                chat.bucket.pause(retry_after)
+                chat.queues[priority].appendleft((enqueued_at, attempts + 1, text, params, future))
+                self._queued[priority] += 1
+            else:
+                self._fail(future, e)
+        finally:
+            self._in_flight.release()
+            chat.in_flight = False
+            self._schedule(chat_id, chat)
+
+    def _fail(self, future, error):
+        self._failed += 1
+        logger.warning("Failed to send message: %s", error)
+        if not future.done():
+            future.set_exception(error)
+
+    def stats(self):
+        def percentile(values, fraction):
+            if not values:
+                return 0.0
+            ordered = sorted(values)
+            return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+        stats = {'chats': len(self._chats), 'rate_limited': self._rate_limited, 'failed': self._failed}
+        for priority, name in ((INTERACTIVE, 'interactive'), (BROADCAST, 'broadcast')):
+            latencies = self._latencies[priority]
+            stats[name] = {
+                'queued': self._queued[priority],
+                'sent': self._sent[priority],
+                'latency_p50': percentile(latencies, 0.5),
+                'latency_p95': percentile(latencies, 0.95),
+            }
+        return stats
@@ -0,0 +1,216 @@
+import argparse
+import io
+import sys
+import time
+from db.connection import get_db_cursor, note_writes
+from db.queries import user_cache, chat_cache
+from db.question_queries import questionnaire_cache
+from db.recommendation_queries import index_questionnaires, unindex_users
+from db.hashing import hash_passwords
+from db.validators import validate_new_user, validate_questionnaire_fields
+
+USER_FIELDS = ['first_name', 'last_name', 'email', 'password']
+PURGE_CHUNK_SIZE = 500
+
+
+def _copy_value(value):
+    # Text-format COPY: NULL is \N and backslash, tab and newlines must be escaped.
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _copy_rows(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def _error(index, message):
+    return {'index': index, 'status': 'error', 'message': message}
+
+
+def bulk_add_users(records):
+    """
+    Validates, hashes and inserts many users in one transaction.
+
+    Rows are streamed into a temporary table with COPY and moved into `users` with a single
+    INSERT ... SELECT ... ON CONFLICT, so existing emails are reported rather than aborting
+    the batch. Returns one result per input record, in input order.
+    """
+    results = [None] * len(records)
+    accepted = []
+    seen_emails = set()
+
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            results[index] = _error(index, "Record must be a JSON object")
+            continue
+        missing_fields = [field for field in USER_FIELDS if not record.get(field)]
+        if missing_fields:
+            results[index] = _error(index, "Required fields are missing: " + ", ".join(missing_fields))
+            continue
+        try:
+            validate_new_user(record['email'], record.get('age'), record.get('gender'))
+        except ValueError as e:
+            results[index] = _error(index, str(e))
+            continue
+        if record['email'] in seen_emails:
+            results[index] = _error(index, "Email appears more than once in this batch")
+            continue
+        seen_emails.add(record['email'])
+        accepted.append(index)
+
+    if accepted:
+        hashed = hash_passwords([records[index]['password'] for index in accepted])
+        rows = []
+        for index, hashed_password in zip(accepted, hashed):
+            record = records[index]
+            rows.append((index, record['first_name'], record['last_name'], record['email'],
+                         hashed_password, record.get('age'), record.get('gender')))
+
+        with get_db_cursor(commit=True) as cursor:
+            cursor.execute('''
+                CREATE TEMP TABLE users_import (
+                    ord INTEGER,
+                    first_name TEXT,
+                    last_name TEXT,
+                    email TEXT,
+                    password TEXT,
+                    age INTEGER,
+                    gender TEXT
+                ) ON COMMIT DROP
+            ''')
+            _copy_rows(cursor, 'users_import',
+                       ['ord', 'first_name', 'last_name', 'email', 'password', 'age', 'gender'], rows)
+            cursor.execute('''
+                INSERT INTO users (first_name, last_name, email, password, age, gender)
+                SELECT first_name, last_name, email, password, age, gender
+                FROM users_import ORDER BY ord
+                ON CONFLICT (email) DO NOTHING
+                RETURNING user_id, email
+            ''')
+            inserted = dict((email, user_id) for user_id, email in cursor.fetchall())
+        note_writes(*inserted.values())
+
+        for index in accepted:
+            user_id = inserted.get(records[index]['email'])
+            if user_id is None:
+                results[index] = _error(index, "Email already exists")
+            else:
+                results[index] = {'index': index, 'status': 'success', 'user_id': user_id}
+
+    return results
+
+
+def bulk_add_questionnaires(records):
+    """
+    Inserts many completed questionnaires in one transaction.
+
+    Rows are loaded with COPY into a temporary table; ids are allocated only for rows whose
+    user exists, so unknown users are reported per record instead of failing the batch.
+    Returns one result per input record, in input order.
+    """
+    results = [None] * len(records)
+    rows = []
+
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            results[index] = _error(index, "Record must be a JSON object")
+            continue
+        invalid_fields = validate_questionnaire_fields(record)
+        if invalid_fields:
+            results[index] = {'index': index, 'status': 'error', 'message': 'Validation failed',
+                              'details': invalid_fields}
+            continue
+        rows.append((index, record['user_id'], record['description'], record['goals'],
+                     record['challenges'], record['expectations']))
+
+    if rows:
+        with get_db_cursor(commit=True) as cursor:
+            cursor.execute('''
+                CREATE TEMP TABLE questionnaire_import (
+                    ord INTEGER,
+                    id INTEGER,
+                    user_id INTEGER,
+                    description TEXT,
+                    goals TEXT,
+                    challenges TEXT,
+                    expectations TEXT
+                ) ON COMMIT DROP
+            ''')
+            _copy_rows(cursor, 'questionnaire_import',
+                       ['ord', 'user_id', 'description', 'goals', 'challenges', 'expectations'], rows)
+            cursor.execute('''
+                UPDATE questionnaire_import AS q
+                SET id = nextval(pg_get_serial_sequence('questionnaire', 'id'))
+                FROM users u
+                WHERE u.user_id = q.user_id
+                RETURNING q.ord, q.id
+            ''')
+            assigned = dict(cursor.fetchall())
+            cursor.execute('''
+                INSERT INTO questionnaire (id, user_id, description, goals, challenges, expectations, completed_questionnaire)
+                SELECT id, user_id, description, goals, challenges, expectations, TRUE
+                FROM questionnaire_import
+                WHERE id IS NOT NULL
+                ORDER BY ord
+            ''')
+
+        written = set(row[1] for row in rows if row[0] in assigned)
+        note_writes(*written)
+        questionnaire_cache.invalidate(*written)
+        # In input order, so a user's last record is the one that stays indexed
+        index_questionnaires([row[1:2] + row[3:] for row in rows if row[0] in assigned])
+        for row in rows:
+            index = row[0]
+            if index in assigned:
+                results[index] = {'index': index, 'status': 'success', 'questionnaire_id': assigned[index]}
+            else:
+                results[index] = _error(index, "Invalid user ID - user does not exist")
+
+    return results
+
+
+def purge_users(user_ids, chunk_size=PURGE_CHUNK_SIZE, pause=0.0):
+    """
+    Deletes many users and all their data (the foreign keys cascade) in chunks of
+    `chunk_size`, one short transaction per chunk, so a purge of thousands of accounts never
+    holds its locks for long and a failure only rolls back the current chunk. `pause`
+    seconds between chunks leave room for other traffic.
+    Returns {'deleted': count, 'missing': [ids that did not exist]}.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    deleted = set()
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        with get_db_cursor(commit=True) as cursor:
+            cursor.execute("SET LOCAL lock_timeout = '5s'")
+            cursor.execute("DELETE FROM users WHERE user_id = ANY(%s) RETURNING user_id, telegram_chat_id", (chunk,))
+            rows = cursor.fetchall()
+        removed = [row[0] for row in rows]
+        deleted.update(removed)
+        note_writes(*removed)
+        user_cache.invalidate(*removed)
+        questionnaire_cache.invalidate(*removed)
+        unindex_users(*removed)
+        chat_cache.invalidate(*[row[1] for row in rows if row[1] is not None])
+        if pause and start + chunk_size < len(user_ids):
+            time.sleep(pause)
+    return {'deleted': len(deleted), 'missing': [user_id for user_id in user_ids if user_id not in deleted]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Delete users and all of their data (e.g. GDPR erasure requests).")
+    parser.add_argument('file', nargs='?', type=argparse.FileType(), default=sys.stdin,
+                        help="file with one user_id per line (default: stdin)")
+    parser.add_argument('--chunk-size', type=int, default=PURGE_CHUNK_SIZE)
+    parser.add_argument('--pause', type=float, default=0.0, help="seconds to sleep between chunks")
+    args = parser.parse_args()
+    ids = [int(line) for line in args.file if line.strip()]
+    result = purge_users(ids, args.chunk_size, args.pause)
+    print(f"Deleted {result['deleted']} user(s); {len(result['missing'])} id(s) not found.")
@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from db.metrics import register_collector
+
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))  # seconds an entry stays fresh
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))  # entries per cache before LRU eviction
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")  # optional shared second level, e.g. redis://localhost:6379/0
+
+_MISSING = object()
+_caches = {}
+
+
+class RedisStore:
+    """Shared cache level backed by Redis. Values are stored as JSON with a TTL."""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise EnvironmentError("CACHE_REDIS_URL is set but the redis package is not installed.")
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(key)
+        return _MISSING if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl):
+        self._client.set(key, json.dumps(value, default=str), ex=max(int(ttl), 1))
+
+    def delete(self, key):
+        self._client.delete(key)
+
+
+class TTLCache:
+    """
+    Thread-safe in-process LRU cache with per-entry TTL and an optional shared store
+    (anything with get/set/delete, such as RedisStore) consulted on local misses.
+
+    get_or_load() only fills the cache if no invalidation happened while the value was
+    being loaded, so a read racing with a write cannot put the old row back.
+    """
+
+    def __init__(self, namespace, maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL, shared=None):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._invalidations = 0
+        self._hits = 0
+        self._shared_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidated = 0
+
+    def _shared_key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._expirations += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def get(self, key, default=None):
+        value = self._get_local(key)
+        if value is not _MISSING:
+            return value
+        if self.shared is not None:
+            value = self._shared_get(key)
+            if value is not _MISSING:
+                with self._lock:
+                    self._shared_hits += 1
+                self._set_local(key, value)
+                return value
+        with self._lock:
+            self._misses += 1
+        return default
+
+    def set(self, key, value):
+        self._set_local(key, value)
+        if self.shared is not None:
+            self._shared_call(self.shared.set, self._shared_key(key), value, self.ttl)
+
+    def get_or_load(self, key, loader):
+        """Returns the cached value for key, calling loader(key) on a miss. None results are not cached."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            generation = self._invalidations
+        value = loader(key)
+        if value is not None:
+            with self._lock:
+                stale = generation != self._invalidations
+            if not stale:
+                self.set(key, value)
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._invalidations += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self._invalidated += 1
+        if self.shared is not None:
+            for key in keys:
+                self._shared_call(self.shared.delete, self._shared_key(key))
+
+    def clear(self):
+        with self._lock:
+            self._invalidations += 1
+            self._entries.clear()
+
+    def _shared_get(self, key):
+        value = self._shared_call(self.shared.get, self._shared_key(key))
+        return _MISSING if value is None else value
+
+    def _shared_call(self, fn, *args):
+        # The shared level is an optimisation; if it is unavailable, fall back to the local cache and the DB.
+        try:
+            return fn(*args)
+        except Exception:
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.maxsize,
+                'hits': self._hits,
+                'shared_hits': self._shared_hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'invalidations': self._invalidated,
+            }
+
+
+def make_cache(namespace, maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL):
+    """Creates (once per namespace) a cache configured from the environment."""
+    if namespace not in _caches:
+        shared = RedisStore(CACHE_REDIS_URL) if CACHE_REDIS_URL else None
+        _caches[namespace] = TTLCache(namespace, maxsize=maxsize, ttl=ttl, shared=shared)
+    return _caches[namespace]
+
+
+def cache_stats():
+    return dict((namespace, cache.stats()) for namespace, cache in _caches.items())
+
+
+@register_collector
+def _collect_cache_metrics():
+    stats = cache_stats()
+    yield ('cache_size', 'gauge', "Entries held in the local cache",
+           [({'cache': namespace}, s['size']) for namespace, s in stats.items()])
+    for name in ('hits', 'shared_hits', 'misses', 'evictions', 'expirations', 'invalidations'):
+        yield (f'cache_{name}_total', 'counter', f"Cache {name.replace('_', ' ')}",
+               [({'cache': namespace}, s[name]) for namespace, s in stats.items()])
@@ -0,0 +1,133 @@
+import datetime
+import psycopg2
+from db.connection import get_db_cursor, note_writes
+
+EVENT_COLUMNS = "event_id, user_id, title, description, start_time, end_time, location, event_type"
+MAX_EVENTS = 500
+
+
+def _event(row):
+    return {
+        'event_id': row[0],
+        'user_id': row[1],
+        'title': row[2],
+        'description': row[3],
+        'start_time': row[4].isoformat() if row[4] else None,
+        'end_time': row[5].isoformat() if row[5] else None,
+        'location': row[6],
+        'event_type': row[7]
+    }
+
+
+def parse_timestamp(value, field):
+    if isinstance(value, datetime.datetime):
+        return value
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be an ISO timestamp (YYYY-MM-DDTHH:MM)")
+
+
+def parse_window(start, end):
+    start = parse_timestamp(start, 'start')
+    end = parse_timestamp(end, 'end')
+    if end <= start:
+        raise ValueError("end must be after start")
+    return start, end
+
+
+def add_calendar_event(user_id, title, start_time, end_time=None, description=None, location=None, event_type=None):
+    start_time = parse_timestamp(start_time, 'start_time')
+    if end_time is not None:
+        end_time = parse_timestamp(end_time, 'end_time')
+        if end_time < start_time:
+            raise ValueError("end_time must not be before start_time")
+    try:
+        with get_db_cursor(commit=True, user_id=user_id) as cursor:
+            cursor.execute('''
+                INSERT INTO CalendarEvents (user_id, title, description, start_time, end_time, location, event_type)
+                VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING event_id
+            ''', (user_id, title, description, start_time, end_time, location, event_type))
+            return cursor.fetchone()[0]
+    except psycopg2.IntegrityError as e:
+        if 'foreign key constraint' in str(e).lower():
+            raise ValueError("Invalid user ID - user does not exist")
+        raise RuntimeError("Failed to add calendar event due to a database integrity error")
+
+
+def delete_calendar_event(event_id):
+    with get_db_cursor(commit=True) as cursor:
+        cursor.execute("DELETE FROM CalendarEvents WHERE event_id = %s RETURNING user_id", (event_id,))
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError("Event not found")
+    note_writes(row[0])
+    return True
+
+
+def get_events_in_window(user_id, start, end):
+    """Events that overlap [start, end), ordered by start time (GiST range lookup)."""
+    start, end = parse_window(start, end)
+    with get_db_cursor(readonly=True, user_id=user_id) as cursor:
+        cursor.execute(f'''
+            SELECT {EVENT_COLUMNS} FROM CalendarEvents
+            WHERE user_id = %s AND during && tsrange(%s, %s, '[)')
+            ORDER BY start_time, event_id
+            LIMIT %s
+        ''', (user_id, start, end, MAX_EVENTS))
+        return [_event(row) for row in cursor.fetchall()]
+
+
+def get_next_events(user_id, limit=5, after=None):
+    """The next `limit` events starting at or after `after` (default: now)."""
+    after = parse_timestamp(after, 'after') if after is not None else datetime.datetime.now()
+    limit = max(1, min(int(limit), MAX_EVENTS))
+    with get_db_cursor(readonly=True, user_id=user_id) as cursor:
+        cursor.execute(f'''
+            SELECT {EVENT_COLUMNS} FROM CalendarEvents
+            WHERE user_id = %s AND start_time >= %s
+            ORDER BY start_time, event_id
+            LIMIT %s
+        ''', (user_id, after, limit))
+        return [_event(row) for row in cursor.fetchall()]
+
+
+def find_conflicts(user_id, start, end, exclude_event_id=None):
+    """Events that overlap a proposed slot [start, end)."""
+    start, end = parse_window(start, end)
+    with get_db_cursor(readonly=True, user_id=user_id) as cursor:
+        cursor.execute(f'''
+            SELECT {EVENT_COLUMNS} FROM CalendarEvents
+            WHERE user_id = %s AND during && tsrange(%s, %s, '[)')
+              AND event_id IS DISTINCT FROM %s
+            ORDER BY start_time, event_id
+            LIMIT %s
+        ''', (user_id, start, end, exclude_event_id, MAX_EVENTS))
+        return [_event(row) for row in cursor.fetchall()]
+
+
+def find_free_slots(user_id, start, end, duration, limit=3, step=datetime.timedelta(minutes=30)):
+    """
+    Up to `limit` conflict-free slots of `duration` inside [start, end), aligned to `step`.
+    Reads the window's events once and computes the gaps in Python.
+    """
+    start, end = parse_window(start, end)
+    busy = []
+    for event in get_events_in_window(user_id, start, end):
+        event_start = datetime.datetime.fromisoformat(event['start_time'])
+        event_end = datetime.datetime.fromisoformat(event['end_time']) if event['end_time'] else event_start
+        busy.append((event_start, max(event_end, event_start)))
+
+    # Round the first candidate up to the next step boundary.
+    offset = (start - datetime.datetime.combine(start.date(), datetime.time())) % step
+    candidate = start + (step - offset if offset else datetime.timedelta(0))
+    slots = []
+    while candidate + duration <= end and len(slots) < limit:
+        slot_end = candidate + duration
+        # b_start >= candidate also catches zero-length events starting inside the slot
+        if not any(b_start < slot_end and (b_end > candidate or b_start >= candidate) for b_start, b_end in busy):
+            slots.append({'start_time': candidate.isoformat(), 'end_time': slot_end.isoformat()})
+            candidate = slot_end
+        else:
+            candidate += step
+    return slots
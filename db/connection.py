@@ -1,47 +1,300 @@
 import psycopg2
-from psycopg2 import pool
+from psycopg2 import extensions
 from contextlib import contextmanager
+import contextvars
+import itertools
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from db.pool import BoundedConnectionPool, PoolTimeoutError
+from db.cache import make_cache
+from db.metrics import observe_query, register_collector, POOL_WAIT
 
-username = os.getenv("DB_USERNAME")
-password = os.getenv("DB_PASSWORD")
+DB_PRIMARY_DSN = os.getenv("DB_PRIMARY_DSN", "host=127.0.0.1 port=5432 dbname=user_data")
+# Streaming replicas for read-only work, comma-separated; none means everything goes to the primary.
+DB_REPLICA_DSNS = [dsn.strip() for dsn in os.getenv("DB_REPLICA_DSNS", "").split(",") if dsn.strip()]
+READ_YOUR_WRITES_WINDOW = float(os.getenv("DB_READ_YOUR_WRITES_WINDOW", "5"))  # seconds reads stay on the primary after a write
+REPLICA_RETRY_AFTER = float(os.getenv("DB_REPLICA_RETRY_AFTER", "30"))  # seconds an unreachable replica is skipped
 
-if not (username and password):
-    raise EnvironmentError("DB_USERNAME or DB_PASSWORD environment variables are not set.")
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # recycle connections after this many seconds
+POOL_MAX_WAITERS = int(os.getenv("DB_POOL_MAX_WAITERS", "100"))  # callers allowed to queue for a connection
 
-try:
-    connection_pool = psycopg2.pool.SimpleConnectionPool(
-        1, 20,
-        user=username,
-        password=password,
-        host="127.0.0.1",
-        port="5432",
-        database="user_data"
-    )
-except psycopg2.DatabaseError as e:
-    raise ConnectionError(f"Failed to create a connection pool: {e}")
+PRIMARY = 'primary'
+REPLICAS = [f"replica{i}" for i in range(len(DB_REPLICA_DSNS))]
+_DSNS = dict([(PRIMARY, DB_PRIMARY_DSN)] + list(zip(REPLICAS, DB_REPLICA_DSNS)))
 
-@contextmanager
-def get_db_connection():
+logger = logging.getLogger(__name__)
+
+
+class TimedCursor(extensions.cursor):
+    """Cursor that records duration and row count of every statement (see db.metrics)."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            observe_query(query, time.perf_counter() - start, self.rowcount, failed)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().executemany(query, vars_list)
+            failed = False
+            return result
+        finally:
+            observe_query(query, time.perf_counter() - start, self.rowcount, failed)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().copy_expert(sql, file, size)
+            failed = False
+            return result
+        finally:
+            observe_query(sql, time.perf_counter() - start, self.rowcount, failed)
+
+
+def _connect(name=PRIMARY):
+    username = os.getenv("DB_USERNAME")
+    password = os.getenv("DB_PASSWORD")
+    if not (username and password):
+        raise EnvironmentError("DB_USERNAME or DB_PASSWORD environment variables are not set.")
     try:
-        conn = connection_pool.getconn()
+        return psycopg2.connect(
+            _DSNS[name],
+            user=username,
+            password=password,
+            cursor_factory=TimedCursor
+        )
+    except psycopg2.DatabaseError as e:
+        raise ConnectionError(f"Failed to open a database connection: {e}")
+
+
+def _check_connection(conn):
+    # Cheap round trip to catch connections the server (or a proxy) has dropped while idle.
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    conn.rollback()
+    return True
+
+
+def _reset_connection(conn):
+    status = conn.info.transaction_status
+    if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != extensions.TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+    return True
+
+
+# Pools (one per server) are created on first use rather than at import time, so importing
+# this module never touches the network, and are rebuilt in any process forked after they
+# were created.
+_pools = {}
+_pools_pid = None
+_pool_lock = threading.Lock()
+_inherited_pools = []
+
+
+def _create_pool(name):
+    try:
+        return BoundedConnectionPool(
+            lambda: _connect(name),
+            minconn=POOL_MIN_SIZE,
+            maxconn=POOL_MAX_SIZE,
+            timeout=POOL_TIMEOUT,
+            max_lifetime=POOL_MAX_LIFETIME,
+            max_waiters=POOL_MAX_WAITERS,
+            check=_check_connection,
+            reset=_reset_connection
+        )
+    except ConnectionError as e:
+        raise ConnectionError(f"Failed to create a connection pool: {e}")
+
+
+def get_pool(name=PRIMARY):
+    global _pools, _pools_pid
+    pid = os.getpid()
+    pool = _pools.get(name) if _pools_pid == pid else None
+    if pool is None:
+        with _pool_lock:
+            if _pools_pid != pid:
+                _pools = {}
+                _pools_pid = pid
+            pool = _pools.get(name)
+            if pool is None:
+                pool = _pools[name] = _create_pool(name)
+    return pool
+
+
+def _forget_pool_after_fork():
+    # The child must not close the inherited connections: that would terminate the
+    # parent's server sessions. Keep them referenced (so they are never garbage collected
+    # and closed) but unused, and let the child open its own pools on first use.
+    global _pools, _pools_pid, _pool_lock
+    _inherited_pools.extend(_pools.values())
+    _pools = {}
+    _pools_pid = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pool_after_fork)
+
+
+def close_pool():
+    global _pools, _pools_pid
+    with _pool_lock:
+        if _pools_pid == os.getpid():
+            for pool in _pools.values():
+                pool.closeall()
+        _pools = {}
+        _pools_pid = None
+
+
+def open_dedicated_connection():
+    """
+    Opens a connection to the primary outside the pool, for long-lived sessions such as
+    LISTEN. The caller owns it and must close it.
+    """
+    return _connect()
+
+
+# Read routing. Read-only work goes to a replica unless it could miss a recent write: the
+# same thread or task committed within READ_YOUR_WRITES_WINDOW, or the statement is about
+# a user written to within it (tracked in a cache, so with CACHE_REDIS_URL the window holds
+# across processes). A replica that cannot be reached is skipped for REPLICA_RETRY_AFTER
+# seconds and the read falls back to the next replica or the primary.
+_recent_writes = make_cache('recent_write', ttl=READ_YOUR_WRITES_WINDOW)
+_last_commit = contextvars.ContextVar('last_commit', default=None)
+_replica_turn = itertools.count()
+_replica_down_until = {}
+_routed = {'primary': 0, 'replica': 0, 'pinned': 0, 'fallbacks': 0}
+
+
+def note_writes(*user_ids):
+    """Keeps reads about these users on the primary until replicas have caught up with their writes."""
+    if REPLICAS:
+        for user_id in user_ids:
+            _recent_writes.set(user_id, True)
+
+
+def _read_targets(user_id=None):
+    """The pools a read-only statement may use, in order of preference."""
+    if not REPLICAS:
+        return [PRIMARY]
+    last_commit = _last_commit.get()
+    if (last_commit is not None and time.monotonic() - last_commit < READ_YOUR_WRITES_WINDOW) or \
+            (user_id is not None and _recent_writes.get(user_id)):
+        _routed['pinned'] += 1
+        return [PRIMARY]
+    now = time.monotonic()
+    start = next(_replica_turn)
+    replicas = [REPLICAS[(start + i) % len(REPLICAS)] for i in range(len(REPLICAS))]
+    return [name for name in replicas if _replica_down_until.get(name, 0) <= now] + [PRIMARY]
+
+
+def get_pool_stats(name=PRIMARY):
+    """Returns a snapshot of a pool's counters (size, in-use/idle/waiting counts, checkouts, timeouts and wait times), or None before the pool exists."""
+    pool = _pools.get(name) if _pools_pid == os.getpid() else None
+    return pool.stats() if pool is not None else None
+
+
+def get_routing_stats():
+    """How read-only work was routed: to the primary or a replica, pinned by a recent write, or fallen back."""
+    return dict(_routed, replicas_down=sum(until > time.monotonic() for until in _replica_down_until.values()))
+
+@register_collector
+def _collect_pool_metrics():
+    pools = [(name, get_pool_stats(name)) for name in _DSNS]
+    pools = [({'pool': name}, stats) for name, stats in pools if stats is not None]
+    if not pools:
+        return []
+    metrics = [(f"db_pool_{name}", 'gauge', f"Connection pool {name.replace('_', ' ')}",
+                [(labels, stats[name]) for labels, stats in pools])
+               for name in ('size', 'max_size', 'idle', 'in_use', 'waiting')] + \
+              [(f"db_pool_{name}_total", 'counter', f"Connection pool {name.replace('_', ' ')}",
+                [(labels, stats[name]) for labels, stats in pools])
+               for name in ('checkouts', 'timeouts', 'rejected', 'connections_opened', 'connections_recycled',
+                            'validation_failures')]
+    if REPLICAS:
+        routing = get_routing_stats()
+        metrics.append(('db_reads_routed_total', 'counter', "Read-only checkouts by target (pinned: kept on the primary by a recent write)",
+                        [({'target': target}, routing[target]) for target in ('primary', 'replica', 'pinned')]))
+        metrics.append(('db_replica_fallbacks_total', 'counter', "Reads moved off an unreachable replica",
+                        [({}, routing['fallbacks'])]))
+        metrics.append(('db_replicas_down', 'gauge', "Replicas currently skipped as unreachable",
+                        [({}, routing['replicas_down'])]))
+    return metrics
+
+
+def _checkout(name, timeout):
+    start = time.perf_counter()
+    try:
+        pool = get_pool(name)
+        return pool, pool.getconn(timeout=timeout)
+    except PoolTimeoutError:
+        raise
     except psycopg2.DatabaseError as e:
         raise ConnectionError(f"Failed to obtain a database connection: {e}")
+    finally:
+        POOL_WAIT.observe(time.perf_counter() - start)
+
+@contextmanager
+def get_db_connection(timeout=None, readonly=False, user_id=None):
+    """
+    A pooled connection to the primary, or with `readonly` to a replica when one can serve
+    the read (see _read_targets); `user_id` is the user whose data is read, if any.
+    """
+    targets = _read_targets(user_id) if readonly else [PRIMARY]
+    for name in targets:
+        try:
+            pool, conn = _checkout(name, timeout)
+            break
+        except PoolTimeoutError:
+            raise  # a busy pool is not a down server: shed the load rather than move it to the primary
+        except ConnectionError as e:
+            if name == PRIMARY:
+                raise
+            logger.warning("Replica %s is unreachable, skipping it for %ss: %s", name, REPLICA_RETRY_AFTER, e)
+            _replica_down_until[name] = time.monotonic() + REPLICA_RETRY_AFTER
+            _routed['fallbacks'] += 1
+    if readonly and REPLICAS:
+        _routed['primary' if name == PRIMARY else 'replica'] += 1
     try:
         yield conn
     finally:
-        connection_pool.putconn(conn)
+        pool.putconn(conn)
 
 @contextmanager
-def get_db_cursor(connection=None, commit=False):
+def get_db_cursor(connection=None, commit=False, readonly=False, user_id=None):
+    """
+    A cursor on `connection`, or on a pooled one. `readonly` work may be served by a replica;
+    after a `commit`, reads from the same thread or task, and reads about `user_id`, stay on
+    the primary for READ_YOUR_WRITES_WINDOW seconds.
+    """
     if connection is None:
-        with get_db_connection() as conn:
+        with get_db_connection(readonly=readonly and not commit, user_id=user_id) as conn:
             with conn.cursor() as cursor:
                 try:
                     yield cursor
                     if commit:
                         conn.commit()
+                        if REPLICAS:
+                            _last_commit.set(time.monotonic())
+                            if user_id is not None:
+                                note_writes(user_id)
                 finally:
                     cursor.close()
     else:
@@ -51,4 +304,4 @@ def get_db_cursor(connection=None, commit=False):
                 if commit:
                     connection.commit()
             finally:
-                cursor.close()
\ No newline at end of file
+                cursor.close()
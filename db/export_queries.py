@@ -0,0 +1,79 @@
+import datetime
+import decimal
+import json
+from db.connection import get_db_connection
+
+EXPORT_FETCH_SIZE = 2000  # rows per round trip of a server-side cursor
+EXPORT_CHUNK_BYTES = 64 * 1024  # response body is written in chunks of about this size
+
+# (record type, query, user_id column). Tables are streamed one after another, each in
+# user_id order.
+EXPORT_TABLES = [
+    ('user', "SELECT user_id, first_name, last_name, email, age, gender FROM users u", 'u.user_id'),
+    ('questionnaire', '''
+        SELECT id, user_id, description, goals, challenges, expectations, completed_questionnaire
+        FROM questionnaire q''', 'q.user_id'),
+    ('workout', "SELECT workout_id, user_id, date, duration, intensity, notes FROM Workouts w", 'w.user_id'),
+    ('exercise', '''
+        SELECT e.exercise_id, e.workout_id, w.user_id, e.name, e.reps, e.sets, e.weight
+        FROM Exercises e JOIN Workouts w ON w.workout_id = e.workout_id''', 'w.user_id'),
+    ('sleep_record', "SELECT sleep_id, user_id, sleep_start, sleep_end, quality, notes FROM SleepRecords s", 's.user_id'),
+    ('calendar_event', '''
+        SELECT event_id, user_id, title, description, start_time, end_time, location, event_type
+        FROM CalendarEvents c''', 'c.user_id'),
+    ('routine', "SELECT routine_id, user_id, name, description, created_at FROM routines r", 'r.user_id'),
+]
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+def export_records(user_id=None, fetch_size=EXPORT_FETCH_SIZE):
+    """
+    Yields (record type, dict) for every row belonging to `user_id`, or to every user if it is
+    None. Each table is read through a named (server-side) cursor, so only `fetch_size` rows
+    are in memory at a time, and all tables are read from one REPEATABLE READ snapshot.
+    """
+    with get_db_connection(readonly=True, user_id=user_id) as conn:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            for record_type, query, user_column in EXPORT_TABLES:
+                where = f"WHERE {user_column} = %s" if user_id is not None else ""
+                with conn.cursor(name=f"export_{record_type}") as cursor:
+                    cursor.itersize = fetch_size
+                    cursor.execute(f"{query} {where} ORDER BY {user_column}, 1",
+                                   (user_id,) if user_id is not None else None)
+                    columns = None
+                    for row in cursor:
+                        if columns is None:
+                            columns = [column[0] for column in cursor.description]
+                        yield record_type, dict(zip(columns, row))
+        finally:
+            conn.rollback()
+
+
+def export_ndjson(user_id=None, fetch_size=EXPORT_FETCH_SIZE, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """
+    The export as NDJSON text chunks: a header line first (sent before any query runs), then
+    one {"type": ..., "data": ...} line per row, grouped into chunks of about `chunk_bytes`.
+    """
+    yield json.dumps({'type': 'export', 'user_id': user_id,
+                      'generated_at': datetime.datetime.now(datetime.timezone.utc).isoformat()}) + '\n'
+    lines = []
+    size = 0
+    for record_type, record in export_records(user_id, fetch_size):
+        line = json.dumps({'type': record_type, 'data': record}, default=_json_default) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield ''.join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield ''.join(lines)
@@ -0,0 +1,125 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # bcrypt cost factor, each step doubles the work
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 2)))  # 0 hashes inline in the caller
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", "64"))  # hashes allowed running or queued at once
+HASH_TIMEOUT = float(os.getenv("HASH_TIMEOUT", "10"))  # seconds a caller waits for its hash
+
+
+class HashingBusyError(RuntimeError):
+    """Raised when the hashing queue is full (or too slow) and the request should be retried later."""
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _hash_many(passwords, rounds):
+    return [_hashpw(password, rounds) for password in passwords]
+
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password.encode(), hashed.encode())
+
+
+# Like the connection pool, the executor is created lazily and per process so that
+# forked workers never share the parent's worker processes. Its workers are started from a
+# fork server (or spawned) rather than forked from a threaded web worker, where a lock held
+# by another thread at fork time would stay locked forever in the child.
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(HASH_QUEUE_SIZE, 1))
+
+
+def _get_executor():
+    global _executor, _executor_pid, _slots
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS,
+                                                mp_context=multiprocessing.get_context(start_method))
+                _executor_pid = pid
+                _slots = threading.BoundedSemaphore(max(HASH_QUEUE_SIZE, 1))
+    return _executor
+
+
+def _run(fn, *args, wait=False):
+    """Submits fn(*args) if a queue slot is free; with `wait`, waits up to HASH_TIMEOUT for one."""
+    if HASH_WORKERS <= 0:
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    executor = _get_executor()
+    slots = _slots
+    if not (slots.acquire(timeout=HASH_TIMEOUT) if wait else slots.acquire(blocking=False)):
+        raise HashingBusyError("Password hashing queue is full")
+    try:
+        future = executor.submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+
+def _result(future):
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        raise HashingBusyError("Timed out waiting for password hashing")
+
+
+def hash_password(password, rounds=None):
+    return _result(_run(_hashpw, password, rounds or BCRYPT_ROUNDS))
+
+
+def hash_passwords(passwords, rounds=None, chunk_size=4):
+    """
+    Hashes many passwords in parallel for bulk imports, preserving order.
+
+    Work is submitted in small chunks with at most HASH_WORKERS chunks queued at a time, each
+    holding a queue slot like any other hash, so interactive hash_password calls interleave
+    with a large import instead of waiting behind all of it. Raises HashingBusyError if no
+    slot frees up, or a chunk does not finish, within HASH_TIMEOUT.
+    """
+    rounds = rounds or BCRYPT_ROUNDS
+    passwords = list(passwords)
+    if HASH_WORKERS <= 0:
+        return _hash_many(passwords, rounds)
+
+    hashed = []
+    pending = deque()
+    try:
+        for start in range(0, len(passwords), chunk_size):
+            if len(pending) >= HASH_WORKERS:
+                hashed.extend(_result(pending.popleft()))
+            pending.append(_run(_hash_many, passwords[start:start + chunk_size], rounds, wait=True))
+        while pending:
+            hashed.extend(_result(pending.popleft()))
+    finally:
+        for future in pending:
+            future.cancel()
+    return hashed
+
+
+def check_password(password, hashed):
+    return _result(_run(_checkpw, password, hashed))
+
+
+def shutdown():
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=True)
+        _executor = None
+        _executor_pid = None
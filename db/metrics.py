@@ -0,0 +1,212 @@
+import functools
+import logging
+import os
+import random
+import re
+import threading
+from bisect import bisect_left
+
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))  # share of routine events (requests, deletes) logged
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))  # statements slower than this are logged
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("DB_SLOW_QUERY_SAMPLE_RATE", "1"))
+
+# Seconds; fine enough below 10ms for cached reads and index lookups, up to bulk loads.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger(__name__)
+query_logger = logging.getLogger('db.queries.slow')
+
+_metrics = {}
+_collectors = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels.get(name, '')) for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name + _format_labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def count(self, **labels):
+        counts = self._values.get(tuple(str(labels.get(name, '')) for name in self.labelnames))
+        return counts[-2] if counts else 0
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(key, list(counts)) for key, counts in self._values.items()]
+        samples = []
+        for key, counts in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((self.name + '_bucket' + _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))]), cumulative))
+            samples.append((self.name + '_bucket' + _format_labels(self.labelnames, key, [('le', '+Inf')]), counts[-2]))
+            samples.append((self.name + '_count' + _format_labels(self.labelnames, key), counts[-2]))
+            samples.append((self.name + '_sum' + _format_labels(self.labelnames, key), counts[-1]))
+        return samples
+
+
+def _register(cls, name, *args, **kwargs):
+    with _registry_lock:
+        if name not in _metrics:
+            _metrics[name] = cls(name, *args, **kwargs)
+        return _metrics[name]
+
+
+def counter(name, help, labelnames=()):
+    """Returns the process-wide counter `name`, creating it on first use."""
+    return _register(Counter, name, help, labelnames)
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Returns the process-wide histogram `name`, creating it on first use."""
+    return _register(Histogram, name, help, labelnames, buckets)
+
+
+def register_collector(collect):
+    """
+    Registers `collect()`, called at scrape time, which returns an iterable of
+    (name, type, help, [(labels dict, value), ...]) for values owned elsewhere (pool, caches).
+    """
+    _collectors.append(collect)
+    return collect
+
+
+def render():
+    """
+    All metrics of this process in the Prometheus text exposition format. With several
+    worker processes each one reports its own; Prometheus sums them per instance.
+    """
+    lines = []
+    for metric in list(_metrics.values()):
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(f"{sample} {_format_value(value)}" for sample, value in metric.samples())
+    for collect in _collectors:
+        try:
+            families = list(collect())
+        except Exception:
+            logger.exception("Metrics collector %s failed", getattr(collect, '__name__', collect))
+            continue
+        for name, type, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def _logfmt(value):
+    value = str(value)
+    if not value or any(c in value for c in ' ="\n'):
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+    return value
+
+
+def log_event(log, event, level=logging.INFO, sample_rate=1.0, **fields):
+    """
+    Logs `event key=value ...` (logfmt), keeping only `sample_rate` of the calls. The fields
+    are also attached to the record (`record.event`, `record.fields`) for JSON formatters.
+    """
+    if sample_rate < 1 and random.random() >= sample_rate:
+        return
+    if not log.isEnabledFor(level):
+        return
+    message = ' '.join([event] + [f"{key}={_logfmt(value)}" for key, value in fields.items()])
+    log.log(level, message, extra={'event': event, 'fields': fields})
+
+
+_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN|TABLE)\s+([A-Za-z_][\w.]*)', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=2048)
+def _label(head):
+    words = head.split(None, 1)
+    if not words:
+        return 'empty'
+    table = _TABLE_RE.search(head)
+    verb = words[0].lower()
+    return f"{verb}:{table.group(1).lower()}" if table else verb
+
+
+def statement_label(sql):
+    """A low-cardinality name for a statement: its verb and first table, e.g. "select:users"."""
+    if isinstance(sql, bytes):
+        sql = sql[:512].decode('utf-8', 'replace')
+    elif not isinstance(sql, str):
+        return 'composed'
+    return _label(sql[:512])
+
+
+QUERY_DURATION = histogram('db_query_duration_seconds', "Time spent executing statements", ('statement',))
+QUERY_ROWS = counter('db_query_rows_total', "Rows returned or affected by statements", ('statement',))
+QUERY_ERRORS = counter('db_query_errors_total', "Statements that raised an error", ('statement',))
+POOL_WAIT = histogram('db_pool_wait_seconds', "Time spent waiting for a pooled connection")
+
+
+def observe_query(sql, duration, rowcount, failed=False):
+    label = statement_label(sql)
+    QUERY_DURATION.observe(duration, statement=label)
+    if rowcount and rowcount > 0:
+        QUERY_ROWS.inc(rowcount, statement=label)
+    if failed:
+        QUERY_ERRORS.inc(statement=label)
+    if duration * 1000 >= SLOW_QUERY_MS:
+        log_event(query_logger, 'slow_query', logging.WARNING, SLOW_QUERY_SAMPLE_RATE,
+                  statement=label, duration_ms=round(duration * 1000, 1), rows=rowcount,
+                  sql=(sql[:200] if isinstance(sql, str) else label))
+
@@ -0,0 +1,515 @@
+"""
+Versioned, forward-only schema migrations.
+
+Each migration runs once and is recorded in `schema_migrations`, so the runner is safe to
+call on every deploy. Transactional migrations run in a single transaction; migrations that
+build indexes with CREATE INDEX CONCURRENTLY cannot run inside a transaction and are
+executed statement by statement in autocommit mode so they never block writes.
+
+    python -m db.migrations           # apply pending migrations
+    python -m db.migrations --list    # show applied / pending versions
+"""
+import argparse
+import time
+from collections import namedtuple
+from db.connection import get_db_connection
+from db.workout_backfill import replace_workout_stats
+
+# Arbitrary key for pg_advisory_lock so that concurrent deploys apply migrations one at a time.
+MIGRATION_LOCK_ID = 7345120
+MIGRATION_LOCK_POLL_INTERVAL = 1.0  # seconds between attempts to take the lock
+BACKFILL_BATCH_SIZE = 5000  # rows per committed UPDATE when a migration backfills a column
+
+# `statements` are SQL strings or callables taking a cursor (see backfill). `indexes` names
+# the indexes a non-transactional migration builds; an INVALID leftover from an interrupted
+# CREATE INDEX CONCURRENTLY is dropped before the migration is retried.
+Migration = namedtuple('Migration', ['version', 'name', 'statements', 'transactional', 'indexes'])
+
+
+def concurrent_index(version, name, table, columns, unique=False):
+    return Migration(
+        version,
+        f"index {name}",
+        [f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})"],
+        False,
+        [name]
+    )
+
+
+def backfill(table, key, column, expression, batch_size=BACKFILL_BATCH_SIZE):
+    """
+    A migration step that sets `column` to `expression` on the rows where it is NULL, walking
+    the integer primary key `key` in ranges of `batch_size`. In a non-transactional migration
+    every batch commits on its own, so row locks are short and the table stays writable; rows
+    written meanwhile are expected to be kept current by a trigger created beforehand.
+    """
+    def run(cursor):
+        cursor.execute(f"SELECT min({key}), max({key}) FROM {table}")
+        low, high = cursor.fetchone()
+        if low is None:
+            return
+        for start in range(low, high + 1, batch_size):
+            cursor.execute(f"UPDATE {table} SET {column} = {expression} "
+                           f"WHERE {key} >= %s AND {key} < %s AND {column} IS NULL", (start, start + batch_size))
+    return run
+
+
+MIGRATIONS = [
+    Migration(1, "baseline schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id SERIAL PRIMARY KEY,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            age INTEGER,
+            gender TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS questionnaire (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(user_id),
+            description TEXT,
+            goals TEXT,
+            challenges TEXT,
+            expectations TEXT,
+            completed_questionnaire BOOLEAN DEFAULT FALSE
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS CalendarEvents (
+            event_id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(user_id),
+            title TEXT,
+            description TEXT,
+            start_time TIMESTAMP,
+            end_time TIMESTAMP,
+            location TEXT,
+            event_type TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS Workouts (
+            workout_id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(user_id),
+            date DATE,
+            duration INTEGER,
+            intensity TEXT,
+            notes TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS Exercises (
+            exercise_id SERIAL PRIMARY KEY,
+            workout_id INTEGER REFERENCES Workouts(workout_id),
+            name TEXT,
+            reps INTEGER,
+            sets INTEGER,
+            weight DECIMAL(10, 2)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS SleepRecords (
+            sleep_id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(user_id),
+            sleep_start TIMESTAMP,
+            sleep_end TIMESTAMP,
+            quality TEXT,
+            notes TEXT
+        )
+        ''',
+    ], True, []),
+    # get_questionnaire / delete_questionnaire / delete_user filter on questionnaire.user_id
+    concurrent_index(2, 'questionnaire_user_id_idx', 'questionnaire', 'user_id'),
+    # Per-user calendar lookups are time ordered
+    concurrent_index(3, 'calendarevents_user_id_start_time_idx', 'CalendarEvents', 'user_id, start_time'),
+    # Per-user workout history, newest first
+    concurrent_index(4, 'workouts_user_id_date_idx', 'Workouts', 'user_id, date, workout_id'),
+    # Exercises are always loaded (and deleted) through their workout
+    concurrent_index(5, 'exercises_workout_id_idx', 'Exercises', 'workout_id'),
+    # Per-user sleep history, time ordered
+    concurrent_index(6, 'sleeprecords_user_id_sleep_start_idx', 'SleepRecords', 'user_id, sleep_start'),
+    # The Telegram chat a user has linked to their account (see bot.commands /link)
+    Migration(7, "users.telegram_chat_id", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_chat_id BIGINT",
+    ], True, []),
+    concurrent_index(8, 'users_telegram_chat_id_key', 'users', 'telegram_chat_id', unique=True),
+    # Daily sleep rollups maintained on insert (see db.sleep_queries); range queries read these only
+    Migration(9, "sleep_daily rollup", [
+        '''
+        CREATE OR REPLACE FUNCTION sleep_quality_score(quality TEXT) RETURNS NUMERIC AS $$
+            SELECT CASE
+                WHEN trim(quality) ~ '^[0-9]+([.][0-9]+)?$' THEN trim(quality)::NUMERIC
+                ELSE CASE lower(trim(quality))
+                    WHEN 'very poor' THEN 1
+                    WHEN 'poor' THEN 2
+                    WHEN 'fair' THEN 3
+                    WHEN 'average' THEN 3
+                    WHEN 'ok' THEN 3
+                    WHEN 'good' THEN 4
+                    WHEN 'very good' THEN 5
+                    WHEN 'excellent' THEN 5
+                END
+            END
+        $$ LANGUAGE SQL IMMUTABLE
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS sleep_daily (
+            user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            day DATE NOT NULL,
+            records INTEGER NOT NULL,
+            total_minutes NUMERIC NOT NULL,
+            quality_sum NUMERIC NOT NULL DEFAULT 0,
+            quality_count INTEGER NOT NULL DEFAULT 0,
+            bedtime_minutes NUMERIC,
+            PRIMARY KEY (user_id, day)
+        )
+        ''',
+        # Backfill from the records that already exist
+        '''
+        INSERT INTO sleep_daily (user_id, day, records, total_minutes, quality_sum, quality_count, bedtime_minutes)
+        SELECT user_id, sleep_end::date, count(*),
+               sum(EXTRACT(EPOCH FROM sleep_end - sleep_start) / 60),
+               coalesce(sum(sleep_quality_score(quality)), 0),
+               count(sleep_quality_score(quality)),
+               min(EXTRACT(EPOCH FROM sleep_start - (sleep_end::date - 1 + TIME '12:00')) / 60)
+        FROM SleepRecords
+        WHERE user_id IS NOT NULL AND sleep_start IS NOT NULL AND sleep_end IS NOT NULL
+        GROUP BY user_id, sleep_end::date
+        ON CONFLICT (user_id, day) DO NOTHING
+        ''',
+    ], True, []),
+    # Calendar events as a range so window/overlap lookups can use a GiST index. Events with
+    # no (or an inverted) end time are treated as a single instant. The column is nullable and
+    # kept current by a trigger rather than GENERATED ... STORED, which would rewrite the whole
+    # table under an ACCESS EXCLUSIVE lock; existing rows are backfilled in batches by 11.
+    Migration(10, "CalendarEvents.during range", [
+        "SET LOCAL lock_timeout = '5s'",
+        "CREATE EXTENSION IF NOT EXISTS btree_gist",
+        "ALTER TABLE CalendarEvents ADD COLUMN IF NOT EXISTS during TSRANGE",
+        '''
+        CREATE OR REPLACE FUNCTION calendar_event_during(start_time TIMESTAMP, end_time TIMESTAMP) RETURNS TSRANGE AS $$
+            SELECT CASE
+                WHEN start_time IS NULL THEN NULL
+                WHEN end_time IS NULL OR end_time <= start_time THEN tsrange(start_time, start_time, '[]')
+                ELSE tsrange(start_time, end_time, '[)')
+            END
+        $$ LANGUAGE SQL IMMUTABLE
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION set_calendar_event_during() RETURNS TRIGGER AS $$
+        BEGIN
+            NEW.during := calendar_event_during(NEW.start_time, NEW.end_time);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+        "DROP TRIGGER IF EXISTS calendar_events_during ON CalendarEvents",
+        '''
+        CREATE TRIGGER calendar_events_during
+        BEFORE INSERT OR UPDATE OF start_time, end_time, during ON CalendarEvents
+        FOR EACH ROW EXECUTE FUNCTION set_calendar_event_during()
+        ''',
+    ], True, []),
+    Migration(11, "index calendarevents_user_id_during_idx", [
+        backfill('CalendarEvents', 'event_id', 'during', 'calendar_event_during(start_time, end_time)'),
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS calendarevents_user_id_during_idx ON CalendarEvents USING GIST (user_id, during)",
+    ], False, ['calendarevents_user_id_during_idx']),
+    # Reminders already sent (per event and start time, so a rescheduled event is reminded
+    # again) and change notifications for the bot's reminder scheduler (bot.reminders).
+    Migration(12, "calendar reminders", [
+        '''
+        CREATE TABLE IF NOT EXISTS reminder_deliveries (
+            event_id INTEGER NOT NULL REFERENCES CalendarEvents(event_id) ON DELETE CASCADE,
+            start_time TIMESTAMP NOT NULL,
+            sent_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (event_id, start_time)
+        )
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION notify_calendar_event_change() RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('calendar_events', json_build_object('op', TG_OP, 'event_id', OLD.event_id)::text);
+            ELSE
+                PERFORM pg_notify('calendar_events', json_build_object(
+                    'op', TG_OP, 'event_id', NEW.event_id, 'start_time', NEW.start_time)::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+        "DROP TRIGGER IF EXISTS calendar_events_notify ON CalendarEvents",
+        '''
+        CREATE TRIGGER calendar_events_notify
+        AFTER INSERT OR DELETE OR UPDATE OF start_time, user_id ON CalendarEvents
+        FOR EACH ROW EXECUTE FUNCTION notify_calendar_event_change()
+        ''',
+    ], True, []),
+    # Deleting a user removes everything that belongs to them in the same statement. The new
+    # constraints are added NOT VALID so the swap only takes brief locks (and gives up after
+    # lock_timeout rather than queueing behind long transactions)...
+    Migration(13, "cascade deletes from users", [
+        "SET LOCAL lock_timeout = '5s'",
+        '''
+        ALTER TABLE questionnaire
+            DROP CONSTRAINT IF EXISTS questionnaire_user_id_fkey,
+            ADD CONSTRAINT questionnaire_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE NOT VALID
+        ''',
+        '''
+        ALTER TABLE CalendarEvents
+            DROP CONSTRAINT IF EXISTS calendarevents_user_id_fkey,
+            ADD CONSTRAINT calendarevents_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE NOT VALID
+        ''',
+        '''
+        ALTER TABLE Workouts
+            DROP CONSTRAINT IF EXISTS workouts_user_id_fkey,
+            ADD CONSTRAINT workouts_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE NOT VALID
+        ''',
+        '''
+        ALTER TABLE SleepRecords
+            DROP CONSTRAINT IF EXISTS sleeprecords_user_id_fkey,
+            ADD CONSTRAINT sleeprecords_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE NOT VALID
+        ''',
+        '''
+        ALTER TABLE Exercises
+            DROP CONSTRAINT IF EXISTS exercises_workout_id_fkey,
+            ADD CONSTRAINT exercises_workout_id_fkey FOREIGN KEY (workout_id) REFERENCES Workouts(workout_id) ON DELETE CASCADE NOT VALID
+        ''',
+    ], True, []),
+    # ...and existing rows are checked afterwards, outside that transaction, which only takes
+    # a SHARE UPDATE EXCLUSIVE lock and does not block reads or writes.
+    Migration(14, "validate cascading foreign keys", [
+        "ALTER TABLE questionnaire VALIDATE CONSTRAINT questionnaire_user_id_fkey",
+        "ALTER TABLE CalendarEvents VALIDATE CONSTRAINT calendarevents_user_id_fkey",
+        "ALTER TABLE Workouts VALIDATE CONSTRAINT workouts_user_id_fkey",
+        "ALTER TABLE SleepRecords VALIDATE CONSTRAINT sleeprecords_user_id_fkey",
+        "ALTER TABLE Exercises VALIDATE CONSTRAINT exercises_workout_id_fkey",
+    ], False, []),
+    # Workout progress aggregates kept current on insert (db.workout_stats). Exercises are
+    # grouped by their normalised name; weeks start on Monday. Existing data is loaded by 21.
+    Migration(15, "workout stats", [
+        '''
+        CREATE TABLE IF NOT EXISTS exercise_stats (
+            user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            exercise TEXT NOT NULL,
+            entries INTEGER NOT NULL,
+            sets_total INTEGER NOT NULL,
+            reps_total INTEGER NOT NULL,
+            volume NUMERIC NOT NULL,
+            best_weight NUMERIC NOT NULL,
+            best_e1rm NUMERIC NOT NULL,
+            best_e1rm_date DATE,
+            last_date DATE,
+            PRIMARY KEY (user_id, exercise)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS workout_weekly (
+            user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            week DATE NOT NULL,
+            workouts INTEGER NOT NULL,
+            minutes INTEGER NOT NULL,
+            volume NUMERIC NOT NULL,
+            PRIMARY KEY (user_id, week)
+        )
+        ''',
+    ], True, []),
+    # Routines users follow, recommended to users with similar questionnaires
+    # (db.recommendation_queries). The table is new and empty, so its index is built inline.
+    Migration(16, "routines", [
+        '''
+        CREATE TABLE IF NOT EXISTS routines (
+            routine_id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            description TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS routines_user_id_idx ON routines (user_id)",
+    ], True, []),
+    # Full-text search over questionnaires (db.search_queries). Each field gets its own weight
+    # so a search can be limited to one of them: goals A, challenges B, expectations C,
+    # description D. A trigger keeps the column current on insert and update; it is not
+    # GENERATED ... STORED because adding that rewrites the whole table under an ACCESS
+    # EXCLUSIVE lock. 18 backfills existing rows in batches, then indexes them concurrently.
+    Migration(17, "questionnaire.search_vector", [
+        "SET LOCAL lock_timeout = '5s'",
+        "ALTER TABLE questionnaire ADD COLUMN IF NOT EXISTS search_vector TSVECTOR",
+        '''
+        CREATE OR REPLACE FUNCTION questionnaire_search_vector(goals TEXT, challenges TEXT, expectations TEXT,
+                                                               description TEXT) RETURNS TSVECTOR AS $$
+            SELECT setweight(to_tsvector('english', coalesce(goals, '')), 'A') ||
+                   setweight(to_tsvector('english', coalesce(challenges, '')), 'B') ||
+                   setweight(to_tsvector('english', coalesce(expectations, '')), 'C') ||
+                   setweight(to_tsvector('english', coalesce(description, '')), 'D')
+        $$ LANGUAGE SQL IMMUTABLE
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION set_questionnaire_search_vector() RETURNS TRIGGER AS $$
+        BEGIN
+            NEW.search_vector := questionnaire_search_vector(NEW.goals, NEW.challenges, NEW.expectations,
+                                                             NEW.description);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+        "DROP TRIGGER IF EXISTS questionnaire_search_vector ON questionnaire",
+        '''
+        CREATE TRIGGER questionnaire_search_vector
+        BEFORE INSERT OR UPDATE OF goals, challenges, expectations, description, search_vector ON questionnaire
+        FOR EACH ROW EXECUTE FUNCTION set_questionnaire_search_vector()
+        ''',
+    ], True, []),
+    Migration(18, "index questionnaire_search_vector_idx", [
+        backfill('questionnaire', 'id', 'search_vector',
+                 'questionnaire_search_vector(goals, challenges, expectations, description)'),
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS questionnaire_search_vector_idx ON questionnaire USING GIN (search_vector)",
+    ], False, ['questionnaire_search_vector_idx']),
+    # Generated training plans by the hash of the questionnaire they were made from
+    # (bot.plans), so identical questionnaires never pay for inference twice.
+    Migration(19, "generated_plans", [
+        '''
+        CREATE TABLE IF NOT EXISTS generated_plans (
+            plan_key TEXT PRIMARY KEY,
+            backend TEXT NOT NULL,
+            plan TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        ''',
+    ], True, []),
+    # The reminder scheduler pages through every user's upcoming events by (start_time, event_id)
+    concurrent_index(20, 'calendarevents_start_time_event_id_idx', 'CalendarEvents', 'start_time, event_id'),
+    # Loads the workout aggregates (15) from the workouts logged before they existed. The
+    # rebuild locks only the aggregate tables; it can be rerun with `python -m db.workout_backfill`.
+    Migration(21, "workout stats backfill", [
+        lambda cursor: replace_workout_stats(cursor.connection),
+    ], True, []),
+]
+
+
+def _ensure_migrations_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    ''')
+
+
+def _applied_versions(cursor):
+    cursor.execute("SELECT version FROM schema_migrations")
+    return set(row[0] for row in cursor.fetchall())
+
+
+def _drop_invalid_indexes(cursor, names):
+    cursor.execute('''
+        SELECT c.relname FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid AND c.relname = ANY(%s)
+    ''', (list(names),))
+    for (name,) in cursor.fetchall():
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def _execute(cursor, statement):
+    if callable(statement):
+        statement(cursor)
+    else:
+        cursor.execute(statement)
+
+
+def _apply(conn, migration):
+    if migration.transactional:
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cursor:
+                for statement in migration.statements:
+                    _execute(cursor, statement)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                               (migration.version, migration.name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+    else:
+        with conn.cursor() as cursor:
+            if migration.indexes:
+                _drop_invalid_indexes(cursor, migration.indexes)
+            for statement in migration.statements:
+                _execute(cursor, statement)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                           (migration.version, migration.name))
+
+
+def pending_migrations(applied, target=None):
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m.version)
+            if m.version not in applied and (target is None or m.version <= target)]
+
+
+def _acquire_migration_lock(cursor, poll_interval=MIGRATION_LOCK_POLL_INTERVAL):
+    # Polls with pg_try_advisory_lock instead of blocking in pg_advisory_lock: a deployer
+    # waiting inside a statement holds a snapshot, and CREATE INDEX CONCURRENTLY in the
+    # deployer holding the lock would wait for that snapshot forever.
+    waiting = False
+    while True:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        if cursor.fetchone()[0]:
+            return
+        if not waiting:
+            print("Another deploy is applying migrations; waiting for it to finish")
+            waiting = True
+        time.sleep(poll_interval)
+
+
+def run_migrations(target=None):
+    """Applies every pending migration up to `target` (default: all). Returns the versions applied."""
+    applied_now = []
+    with get_db_connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                _acquire_migration_lock(cursor)
+                try:
+                    _ensure_migrations_table(cursor)
+                    for migration in pending_migrations(_applied_versions(cursor), target):
+                        print(f"Applying migration {migration.version}: {migration.name}")
+                        _apply(conn, migration)
+                        applied_now.append(migration.version)
+                finally:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        finally:
+            conn.autocommit = False
+    return applied_now
+
+
+def list_migrations():
+    with get_db_connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                _ensure_migrations_table(cursor)
+                applied = _applied_versions(cursor)
+        finally:
+            conn.autocommit = False
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        state = 'applied' if migration.version in applied else 'pending'
+        print(f"{migration.version:4d}  {state:8s}  {migration.name}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Apply database schema migrations.")
+    parser.add_argument('--list', action='store_true', help="show applied and pending migrations")
+    parser.add_argument('--target', type=int, help="stop after this version")
+    args = parser.parse_args()
+    if args.list:
+        list_migrations()
+    else:
+        applied = run_migrations(args.target)
+        print(f"Applied {len(applied)} migration(s)." if applied else "Database schema is up to date.")
@@ -0,0 +1,18 @@
+from db.connection import get_db_cursor
+
+
+def get_stored_plan(plan_key):
+    """The generated plan stored under `plan_key`, or None."""
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT plan FROM generated_plans WHERE plan_key = %s", (plan_key,))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def store_plan(plan_key, backend, plan):
+    """Stores a generated plan; if one was stored under the same key meanwhile, that one is kept."""
+    with get_db_cursor(commit=True) as cursor:
+        cursor.execute('''
+            INSERT INTO generated_plans (plan_key, backend, plan) VALUES (%s, %s, %s)
+            ON CONFLICT (plan_key) DO NOTHING
+        ''', (plan_key, backend, plan))
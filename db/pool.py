@@ -0,0 +1,216 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeoutError(ConnectionError):
+    """Raised when no connection could be checked out before the timeout expired."""
+
+
+class PoolClosedError(ConnectionError):
+    """Raised when a connection is requested from a pool that has been closed."""
+
+
+class BoundedConnectionPool:
+    """
+    Thread-safe connection pool with a bounded size and a bounded wait queue.
+
+    Callers that find every connection busy wait (up to `timeout` seconds) for one to be
+    returned instead of failing immediately. Idle connections are validated before they are
+    handed out and connections older than `max_lifetime` seconds are recycled.
+
+    The pool is driver agnostic: `connect` opens a new connection, `check` returns True if an
+    idle connection is still usable and `reset` prepares a returned connection for reuse
+    (returning False discards it).
+    """
+
+    def __init__(self, connect, minconn=1, maxconn=20, timeout=30.0, max_lifetime=1800.0,
+                 max_waiters=None, validate_after=5.0, check=None, reset=None):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Pool size must satisfy 0 <= minconn <= maxconn and maxconn >= 1")
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_waiters = max_waiters
+        self.validate_after = validate_after
+
+        self._connect = connect
+        self._check = check
+        self._reset = reset
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, created_at, returned_at), most recently returned on the right
+        self._in_use = {}  # id(conn) -> (conn, created_at)
+        self._size = 0  # idle + in use + currently being opened
+        self._waiting = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._rejected = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._opened = 0
+        self._recycled = 0
+        self._validation_failures = 0
+
+        for _ in range(minconn):
+            with self._cond:
+                self._size += 1
+            conn = self._open()
+            with self._cond:
+                self._idle.append((conn, time.monotonic(), time.monotonic()))
+
+    def _open(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opened += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn, created_at, returned_at, now):
+        if self.max_lifetime is not None and now - created_at > self.max_lifetime:
+            with self._cond:
+                self._recycled += 1
+            return False
+        if getattr(conn, 'closed', False):
+            with self._cond:
+                self._validation_failures += 1
+            return False
+        if self._check is not None and now - returned_at >= self.validate_after:
+            try:
+                healthy = self._check(conn)
+            except Exception:
+                healthy = False
+            if not healthy:
+                with self._cond:
+                    self._validation_failures += 1
+                return False
+        return True
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            entry = None
+            with self._cond:
+                if self._closed:
+                    raise PoolClosedError("Connection pool is closed")
+                if (self.max_waiters is not None and not self._idle
+                        and self._size >= self.maxconn and self._waiting >= self.max_waiters):
+                    self._rejected += 1
+                    raise PoolTimeoutError("Connection pool wait queue is full")
+
+                while True:
+                    if self._closed:
+                        raise PoolClosedError("Connection pool is closed")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"Timed out after {timeout:.1f}s waiting for a database connection")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            now = time.monotonic()
+            if entry is None:
+                conn, created_at = self._open(), now
+            else:
+                conn, created_at, returned_at = entry
+                if not self._is_usable(conn, created_at, returned_at, now):
+                    # Replace the stale connection; its slot stays reserved for us.
+                    self._discard(conn)
+                    conn, created_at = self._open(), time.monotonic()
+
+            waited = time.monotonic() - started
+            with self._cond:
+                if self._closed:
+                    self._size -= 1
+                    self._discard(conn)
+                    raise PoolClosedError("Connection pool is closed")
+                self._in_use[id(conn)] = (conn, created_at)
+                self._checkouts += 1
+                self._wait_time_total += waited
+                self._wait_time_max = max(self._wait_time_max, waited)
+            return conn
+
+    def putconn(self, conn, close=False):
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+            if entry is None:
+                raise ValueError("Connection does not belong to this pool")
+            closed = self._closed
+        _, created_at = entry
+
+        keep = not (close or closed or getattr(conn, 'closed', False))
+        if keep and self._reset is not None:
+            try:
+                keep = self._reset(conn) is not False
+            except Exception:
+                keep = False
+
+        with self._cond:
+            if keep:
+                self._idle.append((conn, created_at, time.monotonic()))
+            else:
+                self._size -= 1
+            self._cond.notify()
+        if not keep:
+            self._discard(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'rejected': self._rejected,
+                'wait_time_total': self._wait_time_total,
+                'wait_time_max': self._wait_time_max,
+                'wait_time_avg': self._wait_time_total / self._checkouts if self._checkouts else 0.0,
+                'connections_opened': self._opened,
+                'connections_recycled': self._recycled,
+                'validation_failures': self._validation_failures,
+            }
@@ -1,60 +1,127 @@
+import logging
 import psycopg2
-from db.validators import validate_email, hash_password, validate_password, is_email_unique
-from db.connection import get_db_cursor  # Import the new cursor manager
+from db.validators import validate_email, hash_password, check_password, validate_password, validate_new_user
+from db.connection import get_db_cursor, note_writes  # Import the new cursor manager
+from db.cache import make_cache
+from db.question_queries import questionnaire_cache
+from db.recommendation_queries import unindex_users
+from db.metrics import log_event, LOG_SAMPLE_RATE
 
-def add_user(first_name, last_name, email, password, age=None, gender=None):
-    # Validate email format
-    if not validate_email(email):
-        raise ValueError("Invalid email format")
-    
-    # Check if the email is unique
-    if not is_email_unique(email):
-        raise ValueError("Email already exists")
+logger = logging.getLogger(__name__)
 
-    # Validate data types for age and gender
-    if age is not None:
-        if not isinstance(age, int) or age < 0 or age > 120:  # Assuming age should be between 0 and 120
-            raise ValueError("must be an integer.")
-    
-    if gender is not None:
-        if not isinstance(gender, str) or gender not in ['Male', 'Female', 'Other']:  # Example gender validation
-            raise ValueError("Gender must be either 'Male', 'Female', or 'Other'.")
+user_cache = make_cache('user')
+chat_cache = make_cache('telegram_chat')
+
+def add_user(first_name, last_name, email, password, age=None, gender=None):
+    # Validate email format, age and gender
+    validate_new_user(email, age, gender)
 
     # Hash the password securely
     hashed_password = hash_password(password)
     
+    # Uniqueness is enforced by the users.email constraint: a duplicate inserts nothing and
+    # returns no row, so a single round trip either creates the user or reports the clash.
     try:
         with get_db_cursor(commit=True) as cursor:
             cursor.execute('''
                 INSERT INTO users (first_name, last_name, email, password, age, gender)
-                VALUES (%s, %s, %s, %s, %s, %s) RETURNING user_id
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (email) DO NOTHING
+                RETURNING user_id
             ''', (first_name, last_name, email, hashed_password, age, gender))
-            user_id = cursor.fetchone()[0]
-            return user_id
+            row = cursor.fetchone()
     except psycopg2.IntegrityError as e:
         if 'unique constraint' in str(e).lower():
             raise ValueError("Email already exists")  # More specific exception if the unique constraint is violated
         else:
             raise RuntimeError("Failed to add user due to an integrity error")  # General integrity error
     except Exception as e:
-        print(f"Unexpected error when adding user: {e}")
+        logger.exception("Unexpected error when adding user")
         raise RuntimeError("Failed to add user due to an unexpected error")  # Raise a general runtime error for other exceptions
-    
+
+    if row is None:
+        raise ValueError("Email already exists")
+    note_writes(row[0])
+    return row[0]
+
+USER_COLUMNS = "user_id, first_name, last_name, email, age, gender"
+MAX_BATCH_USERS = 100
+
+def _user(row):
+    # Never includes the password hash: nothing outside authentication needs it.
+    return {
+        'user_id': row[0],
+        'first_name': row[1],
+        'last_name': row[2],
+        'email': row[3],
+        'age': row[4],
+        'gender': row[5]
+    }
+
 def get_user(user_id):
-    with get_db_cursor() as cursor:
-        cursor.execute("SELECT user_id, first_name, last_name, email, password, age, gender FROM users WHERE user_id = %s", (user_id,))
+    # Read-through cache: hot users (e.g. the bot looking up a profile per message) skip the DB.
+    user = user_cache.get_or_load(user_id, _fetch_user)
+    return dict(user) if user else None
+
+def _fetch_user(user_id):
+    with get_db_cursor(readonly=True, user_id=user_id) as cursor:
+        cursor.execute(f"SELECT {USER_COLUMNS} FROM users WHERE user_id = %s", (user_id,))
         user_data = cursor.fetchone()
-        if user_data:
-            return {
-                'user_id': user_data[0],
-                'first_name': user_data[1],
-                'last_name': user_data[2],
-                'email': user_data[3],
-                'password': user_data[4],
-                'age': user_data[5],
-                'gender': user_data[6]
-            }
+        return _user(user_data) if user_data else None
+
+def get_users(user_ids):
+    """
+    Looks up many users at once: cached users are served from the cache and the rest are
+    read with a single `user_id = ANY(...)` query. Returns (users in request order, missing ids).
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if len(user_ids) > MAX_BATCH_USERS:
+        raise ValueError(f"At most {MAX_BATCH_USERS} user ids can be requested at once")
+    found = {}
+    for user_id in user_ids:
+        user = user_cache.get(user_id)
+        if user is not None:
+            found[user_id] = user
+    uncached = [user_id for user_id in user_ids if user_id not in found]
+    if uncached:
+        with get_db_cursor(readonly=True) as cursor:
+            cursor.execute(f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ANY(%s)", (uncached,))
+            for row in cursor.fetchall():
+                found[row[0]] = _user(row)
+    users = [dict(found[user_id]) for user_id in user_ids if user_id in found]
+    missing = [user_id for user_id in user_ids if user_id not in found]
+    return users, missing
+
+def get_profile(user_id):
+    """
+    A user together with their latest questionnaire (None if they have not filled one in),
+    read with one JOIN. Returns None if the user does not exist.
+    """
+    with get_db_cursor(readonly=True, user_id=user_id) as cursor:
+        cursor.execute('''
+            SELECT u.user_id, u.first_name, u.last_name, u.email, u.age, u.gender,
+                   q.user_id, q.description, q.goals, q.challenges, q.expectations, q.completed_questionnaire
+            FROM users u
+            LEFT JOIN LATERAL (
+                SELECT user_id, description, goals, challenges, expectations, completed_questionnaire
+                FROM questionnaire WHERE user_id = u.user_id ORDER BY id DESC LIMIT 1
+            ) q ON TRUE
+            WHERE u.user_id = %s
+        ''', (user_id,))
+        row = cursor.fetchone()
+    if row is None:
         return None
+    questionnaire = None
+    if row[6] is not None:
+        questionnaire = {
+            'user_id': row[6],
+            'description': row[7],
+            'goals': row[8],
+            'challenges': row[9],
+            'expectations': row[10],
+            'completed_questionnaire': row[11]
+        }
+    return {'user': _user(row[:6]), 'questionnaire': questionnaire}
 
 def update_user(user_id, email=None, password=None):
     updates = []
@@ -76,43 +143,77 @@ def update_user(user_id, email=None, password=None):
         raise ValueError("No valid field to update")
 
     params.append(user_id)
-    update_query = f"UPDATE users SET {', '.join(updates)} WHERE user_id = %s RETURNING user_id, email, password"
+    update_query = f"UPDATE users SET {', '.join(updates)} WHERE user_id = %s RETURNING user_id, email"
 
-    with get_db_cursor(commit=True) as cursor:
+    with get_db_cursor(commit=True, user_id=user_id) as cursor:
         cursor.execute(update_query, params)
         updated_user = cursor.fetchone()
-        if not updated_user:
-            raise ValueError("User not found or no update made")
-        return {
-            'user_id': updated_user[0],
-            'email': updated_user[1],
-            'password': updated_user[2]  # Be cautious with returning sensitive data like passwords
-        }
+    if not updated_user:
+        raise ValueError("User not found or no update made")
+    # Invalidate only after the commit so a concurrent read cannot re-cache the old row.
+    user_cache.invalidate(user_id)
+    return {
+        'user_id': updated_user[0],
+        'email': updated_user[1]
+    }
 
 def delete_user(user_id):
-    with get_db_cursor(commit=True) as cursor:
-        try:
-            # First, delete any questionnaires associated with the user.
-            # This step assumes that there are no further nested foreign key dependencies in the questionnaire table.
-            cursor.execute("DELETE FROM questionnaire WHERE user_id = %s", (user_id,))
-            print(f"Deleted questionnaires for user with ID {user_id}.")  # Log for successful deletion of questionnaires
-
-            # Proceed to delete the user.
-            cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
-            deleted_count = cursor.rowcount
-            if deleted_count == 0:
-                print(f"User with ID {user_id} not found.")  # Log for debugging
-                raise ValueError("User not found")
-
-            print(f"User with ID {user_id} deleted successfully.")  # Log for successful deletion
-            return "User deleted successfully"
-
-        except Exception as e:
-            print(f"Failed to delete user with ID {user_id}: {e}")  # Log any exception that arises
-            raise RuntimeError(f"Failed to delete user due to: {str(e)}")  # Raise a more generic error for external handling
+    """
+    Deletes a user and everything that belongs to them (questionnaires, workouts and their
+    exercises, sleep records, calendar events) in one statement: the foreign keys cascade.
+    """
+    with get_db_cursor(commit=True, user_id=user_id) as cursor:
+        cursor.execute("DELETE FROM users WHERE user_id = %s RETURNING telegram_chat_id", (user_id,))
+        deleted = cursor.fetchone()
+    if deleted is None:
+        raise ValueError("User not found")
+
+    log_event(logger, 'user_deleted', sample_rate=LOG_SAMPLE_RATE, user_id=user_id)
+    user_cache.invalidate(user_id)
+    questionnaire_cache.invalidate(user_id)
+    unindex_users(user_id)
+    if deleted[0] is not None:
+        chat_cache.invalidate(deleted[0])
+    return "User deleted successfully"
 
 def is_email_unique(email):
-    with get_db_cursor() as cursor:
+    with get_db_cursor(readonly=True) as cursor:
         cursor.execute("SELECT COUNT(*) FROM users WHERE email = %s", (email,))
         count = cursor.fetchone()[0]
-        return count == 0
\ No newline at end of file
+        return count == 0
+
+def link_telegram_chat(email, password, chat_id):
+    """Links a Telegram chat to the account with these credentials and returns its user_id."""
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT user_id, password FROM users WHERE email = %s", (email,))
+        user_data = cursor.fetchone()
+    if not user_data or not check_password(password, user_data[1]):
+        raise ValueError("Invalid email or password")
+
+    with get_db_cursor(commit=True, user_id=user_data[0]) as cursor:
+        # A chat belongs to one account at a time; linking it elsewhere releases it first.
+        cursor.execute("UPDATE users SET telegram_chat_id = NULL WHERE telegram_chat_id = %s AND user_id <> %s "
+                       "RETURNING user_id", (chat_id, user_data[0]))
+        released = [row[0] for row in cursor.fetchall()]
+        cursor.execute("UPDATE users SET telegram_chat_id = %s WHERE user_id = %s", (chat_id, user_data[0]))
+    note_writes(*released)
+    chat_cache.invalidate(chat_id)
+    return user_data[0]
+
+def get_user_id_for_chat(chat_id):
+    """Returns the user_id linked to a Telegram chat, or None if the chat is not linked."""
+    return chat_cache.get_or_load(chat_id, _fetch_user_id_for_chat)
+
+def _fetch_user_id_for_chat(chat_id):
+    # Read from the primary: a lagging replica would cache a chat's old owner after /link.
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT user_id FROM users WHERE telegram_chat_id = %s", (chat_id,))
+        user_data = cursor.fetchone()
+        return user_data[0] if user_data else None
+
+def get_chat_ids(user_ids):
+    """Maps each of the given users that has linked a Telegram chat to its chat id."""
+    with get_db_cursor(readonly=True) as cursor:
+        cursor.execute("SELECT user_id, telegram_chat_id FROM users WHERE user_id = ANY(%s) AND telegram_chat_id IS NOT NULL",
+                       (list(user_ids),))
+        return dict(cursor.fetchall())
@@ -1,6 +1,11 @@
 import psycopg2
 import logging
 from db.connection import get_db_cursor  # Import the new cursor manager
+from db.cache import make_cache
+from db.recommendation_queries import index_questionnaire, unindex_users
+
+questionnaire_cache = make_cache('questionnaire')
+logger = logging.getLogger(__name__)
 
 def add_questionnaire(user_id, description, goals, challenges, expectations):
     """
@@ -8,26 +13,32 @@ def add_questionnaire(user_id, description, goals, challenges, expectations):
     Assumes that user_id is valid and that the caller has verified user existence.
     """
     try:
-        with get_db_cursor(commit=True) as cursor:  # Assuming get_db_cursor is imported from db.connection
+        with get_db_cursor(commit=True, user_id=user_id) as cursor:  # Assuming get_db_cursor is imported from db.connection
             cursor.execute('''
                 INSERT INTO questionnaire (user_id, description, goals, challenges, expectations, completed_questionnaire)
                 VALUES (%s, %s, %s, %s, %s, TRUE) RETURNING id
             ''', (user_id, description, goals, challenges, expectations))
             questionnaire_id = cursor.fetchone()[0]
-            return questionnaire_id
+        questionnaire_cache.invalidate(user_id)
+        index_questionnaire(user_id, goals, challenges, expectations)
+        return questionnaire_id
     except psycopg2.IntegrityError as e:
         if 'foreign key constraint' in str(e).lower():
             raise ValueError("Invalid user ID - user does not exist")  # Specific exception if the user ID does not exist
         else:
             raise RuntimeError("Failed to add questionnaire due to a database integrity error")
     except Exception as e:
-        print(f"Unexpected error when adding questionnaire: {e}")
+        logger.exception("Unexpected error when adding questionnaire")
         raise RuntimeError("Failed to add questionnaire due to an unexpected error")
     
 def get_questionnaire(user_id):
+    questionnaire = questionnaire_cache.get_or_load(user_id, _fetch_questionnaire)
+    return dict(questionnaire) if questionnaire else None
+
+def _fetch_questionnaire(user_id):
     try:
-        with get_db_cursor() as cursor:
-            cursor.execute("SELECT user_id, description, goals, challenges, expectations, completed_questionnaire FROM questionnaire WHERE user_id = %s", (user_id,))
+        with get_db_cursor(readonly=True, user_id=user_id) as cursor:
+            cursor.execute("SELECT user_id, description, goals, challenges, expectations, completed_questionnaire FROM questionnaire WHERE user_id = %s ORDER BY id DESC LIMIT 1", (user_id,))
             user_data = cursor.fetchone()
             if user_data:
                 return {
@@ -39,11 +50,11 @@ def get_questionnaire(user_id):
                     'completed_questionnaire': user_data[5]                
                 }
     except Exception as e:
-        print(f"Error fetching questionnaire data: {e}")
+        logger.exception("Error fetching questionnaire for user %s", user_id)
         return None  # Optionally, raise an error or handle it as needed
     
 def delete_questionnaire(user_id):
-    with get_db_cursor(commit=True) as cursor:
+    with get_db_cursor(commit=True, user_id=user_id) as cursor:
         try:
             cursor.execute("DELETE FROM questionnaire WHERE user_id = %s", (user_id,))
             deleted_count = cursor.rowcount
@@ -53,9 +64,12 @@ def delete_questionnaire(user_id):
                 raise ValueError("User not found")
 
             logging.info(f"Questionnaire for user with ID {user_id} deleted successfully.")
-            return True  # Indicating success programmatically
 
         except Exception as e:
             # Ensuring any database error is caught and logged
             logging.error(f"Error deleting questionnaire for user ID {user_id}: {str(e)}")
-            raise  # Optionally re-raise the exception after logging
\ No newline at end of file
+            raise  # Optionally re-raise the exception after logging
+
+    questionnaire_cache.invalidate(user_id)
+    unindex_users(user_id)
+    return True  # Indicating success programmatically
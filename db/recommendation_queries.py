@@ -0,0 +1,151 @@
+"""
+Routines and routine recommendations: users are matched by the similarity of their latest
+questionnaire's goals, challenges and expectations (db.similarity_index), and the routines
+of the closest users are suggested.
+
+The index is kept current by the questionnaire and user write paths but is never built
+from the database in a request. Build it once per deploy (after migrations), and after
+changes made outside those paths:
+
+    python -m db.recommendation_queries
+"""
+import logging
+import os
+import threading
+import psycopg2
+from db.connection import get_db_cursor
+from db.similarity_index import SimilarityIndex
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+SIMILARITY_INDEX_PATH = os.getenv("SIMILARITY_INDEX_PATH", os.path.join(DATA_DIR, 'similarity_index'))  # empty: in memory
+MAX_SIMILAR_USERS = 50
+MAX_RECOMMENDED_ROUTINES = 20
+
+logger = logging.getLogger(__name__)
+
+
+def questionnaire_text(goals, challenges, expectations):
+    return " ".join(part for part in (goals, challenges, expectations) if part)
+
+
+def add_routine(user_id, name, description=None):
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("name is required")
+    try:
+        with get_db_cursor(commit=True, user_id=user_id) as cursor:
+            cursor.execute('''
+                INSERT INTO routines (user_id, name, description) VALUES (%s, %s, %s) RETURNING routine_id
+            ''', (user_id, name.strip(), description))
+            return cursor.fetchone()[0]
+    except psycopg2.IntegrityError as e:
+        if 'foreign key constraint' in str(e).lower():
+            raise ValueError("Invalid user ID - user does not exist")
+        raise RuntimeError("Failed to add routine due to a database integrity error")
+
+
+def get_routines(user_ids):
+    """Routines of the given users, newest first."""
+    with get_db_cursor(readonly=True) as cursor:
+        cursor.execute('''
+            SELECT routine_id, user_id, name, description, created_at
+            FROM routines
+            WHERE user_id = ANY(%s)
+            ORDER BY routine_id DESC
+        ''', (list(user_ids),))
+        return [{
+            'routine_id': row[0],
+            'user_id': row[1],
+            'name': row[2],
+            'description': row[3],
+            'created_at': row[4].isoformat()
+        } for row in cursor.fetchall()]
+
+
+def _latest_questionnaires():
+    with get_db_cursor() as cursor:
+        cursor.execute('''
+            SELECT DISTINCT ON (user_id) user_id, goals, challenges, expectations
+            FROM questionnaire
+            WHERE user_id IS NOT NULL
+            ORDER BY user_id, id DESC
+        ''')
+        return [(row[0], questionnaire_text(*row[1:])) for row in cursor.fetchall()]
+
+
+def rebuild_similarity_index(index=None):
+    """Reindexes every user's latest questionnaire. Returns the number of users indexed."""
+    index = index if index is not None else get_similarity_index()
+    index.rebuild(_latest_questionnaires())
+    return len(index)
+
+
+# One index per process, opened on first use like the connection pool. Processes that share
+# SIMILARITY_INDEX_PATH share the files (see SimilarityIndex). Opening never reads the
+# database: an index that has not been built yet starts out empty.
+_index = None
+_index_pid = None
+_index_lock = threading.Lock()
+
+
+def get_similarity_index():
+    global _index, _index_pid
+    pid = os.getpid()
+    if _index is None or _index_pid != pid:
+        with _index_lock:
+            if _index is None or _index_pid != pid:
+                _index = SimilarityIndex(SIMILARITY_INDEX_PATH or None)
+                _index_pid = pid
+    return _index
+
+
+def index_questionnaires(questionnaires):
+    """
+    Makes each user match on their questionnaire from now on, given (user_id, goals,
+    challenges, expectations) tuples in insertion order. Called after the questionnaires have
+    been committed; the index is derived data, so a failure is logged rather than raised.
+    """
+    try:
+        get_similarity_index().add_many((user_id, questionnaire_text(goals, challenges, expectations))
+                                        for user_id, goals, challenges, expectations in questionnaires)
+    except Exception:
+        logger.exception("Could not index %d questionnaire(s)", len(questionnaires))
+
+
+def index_questionnaire(user_id, goals, challenges, expectations):
+    index_questionnaires([(user_id, goals, challenges, expectations)])
+
+
+def unindex_users(*user_ids):
+    try:
+        get_similarity_index().remove(*user_ids)
+    except Exception:
+        logger.exception("Could not remove users %s from the similarity index", user_ids)
+
+
+def recommend_routines(user_id, k=5):
+    """
+    The `k` users whose questionnaires are most similar to this user's latest one, and their
+    routines ranked by that similarity. Raises ValueError if the user has no questionnaire,
+    and RuntimeError if the index has not been built.
+    """
+    k = max(1, min(int(k), MAX_SIMILAR_USERS))
+    index = get_similarity_index()
+    similar = index.similar_to(user_id, k)
+    if similar is None:
+        if len(index) == 0:
+            raise RuntimeError("Recommendations are not available until the similarity index is built")
+        raise ValueError("User has no questionnaire")
+    scores = dict(similar)
+    routines = get_routines(scores) if scores else []
+    routines.sort(key=lambda routine: -scores[routine['user_id']])  # stable: newest first per user
+    for routine in routines:
+        routine['score'] = scores[routine['user_id']]
+    return {
+        'user_id': user_id,
+        'similar_users': [{'user_id': similar_id, 'score': score} for similar_id, score in similar],
+        'routines': routines[:MAX_RECOMMENDED_ROUTINES]
+    }
+
+
+if __name__ == '__main__':
+    print(f"Indexed the questionnaires of {rebuild_similarity_index()} users.")
@@ -0,0 +1,56 @@
+from db.connection import get_db_cursor
+
+NOTIFY_CHANNEL = 'calendar_events'
+
+
+def load_upcoming_reminders(after, until, limit):
+    """
+    Events not yet reminded whose start time is after the (start_time, event_id) key `after`
+    and at most `until`, for users with a linked Telegram chat. Ordered by that key, so the
+    last row is the key to continue from when `limit` rows come back.
+    """
+    with get_db_cursor() as cursor:
+        cursor.execute('''
+            SELECT e.event_id, e.start_time
+            FROM CalendarEvents e
+            JOIN users u ON u.user_id = e.user_id
+            LEFT JOIN reminder_deliveries d ON d.event_id = e.event_id AND d.start_time = e.start_time
+            WHERE (e.start_time, e.event_id) > (%s, %s) AND e.start_time <= %s
+              AND u.telegram_chat_id IS NOT NULL
+              AND d.event_id IS NULL
+            ORDER BY e.start_time, e.event_id
+            LIMIT %s
+        ''', (after[0], after[1], until, limit))
+        return cursor.fetchall()
+
+
+def claim_reminders(reminders, now):
+    """
+    Marks (event_id, start_time) reminders as sent and returns the ones this call claimed,
+    with what is needed to send them: (event_id, chat_id, title, start_time, location).
+
+    Claiming before sending makes delivery at-most-once: after a restart, or with several
+    schedulers running, a reminder that was already claimed is never sent again. Events that
+    were moved, deleted or have already started are skipped.
+    """
+    if not reminders:
+        return []
+    event_ids, start_times = zip(*reminders)
+    with get_db_cursor(commit=True) as cursor:
+        cursor.execute('''
+            WITH due AS (
+                SELECT e.event_id, e.start_time, e.title, e.location, u.telegram_chat_id
+                FROM unnest(%s::int[], %s::timestamp[]) AS r(event_id, start_time)
+                JOIN CalendarEvents e ON e.event_id = r.event_id AND e.start_time = r.start_time
+                JOIN users u ON u.user_id = e.user_id
+                WHERE e.start_time > %s AND u.telegram_chat_id IS NOT NULL
+            ), claimed AS (
+                INSERT INTO reminder_deliveries (event_id, start_time)
+                SELECT event_id, start_time FROM due
+                ON CONFLICT DO NOTHING
+                RETURNING event_id
+            )
+            SELECT due.event_id, due.telegram_chat_id, due.title, due.start_time, due.location
+            FROM due JOIN claimed USING (event_id)
+        ''', (list(event_ids), list(start_times), now))
+        return cursor.fetchall()
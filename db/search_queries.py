@@ -0,0 +1,100 @@
+import html
+from db.connection import get_db_cursor
+
+MAX_SEARCH_PAGE_SIZE = 50
+
+# Weight each field was given in questionnaire.search_vector (see migration 17)
+SEARCH_FIELDS = {'goals': 'a', 'challenges': 'b', 'expectations': 'c', 'description': 'd'}
+# ts_headline marks matches with these control characters (removed from the text itself
+# first); html.escape leaves them alone, so the snippet is escaped before they become <mark>.
+HEADLINE_START, HEADLINE_STOP = '\x02', '\x03'
+HEADLINE_OPTIONS = f'StartSel={HEADLINE_START}, StopSel={HEADLINE_STOP}, MaxFragments=2, MaxWords=20, MinWords=5'
+
+
+def encode_search_cursor(rank, questionnaire_id):
+    return f"{rank!r}_{questionnaire_id}"
+
+
+def render_snippet(headline):
+    """A ts_headline result as HTML: the text escaped, the matched words wrapped in <mark>."""
+    return html.escape(headline).replace(HEADLINE_START, '<mark>').replace(HEADLINE_STOP, '</mark>')
+
+
+def decode_search_cursor(cursor):
+    try:
+        rank, questionnaire_id = cursor.split('_')
+        return float(rank), int(questionnaire_id)
+    except (AttributeError, ValueError):
+        raise ValueError("Invalid pagination cursor")
+
+
+def search_questionnaires(query, field=None, limit=20, cursor=None):
+    """
+    Questionnaires matching a web-style search (`knee injury`, `"lower back" -surgery`,
+    `run or swim`), best match first, optionally only in one field.
+
+    Matches come from the GIN index on search_vector, so the cost grows with the number of
+    matching rows rather than the size of the table; snippets (HTML-escaped text with the
+    matched words wrapped in <mark>) are only generated for the rows on the page. Pagination is
+    keyset based on (rank, id): `cursor` is the previous page's `next_cursor`.
+    Returns {'results': [...], 'next_cursor': str or None}.
+    """
+    if not isinstance(query, str) or not query.strip():
+        raise ValueError("q is required")
+    if field is not None and field not in SEARCH_FIELDS:
+        raise ValueError("field must be one of: " + ", ".join(SEARCH_FIELDS))
+    limit = max(1, min(int(limit), MAX_SEARCH_PAGE_SIZE))
+
+    params = [query]
+    field_filter = ''
+    if field is not None:
+        # The index finds rows matching anywhere; ts_filter rechecks only those rows.
+        field_filter = f"AND ts_filter(search_vector, '{{{SEARCH_FIELDS[field]}}}') @@ q"
+    after = ''
+    if cursor:
+        params.extend(decode_search_cursor(cursor))
+        after = 'WHERE (rank, id) < (%s, %s)'
+    params.append(limit + 1)  # one extra row tells us whether there is another page
+    headline_text = (f"coalesce(qn.{field}, '')" if field is not None
+                     else "concat_ws(' ... ', qn.goals, qn.challenges, qn.expectations, qn.description)")
+    params.extend([query, HEADLINE_OPTIONS])
+
+    with get_db_cursor(readonly=True) as db_cursor:
+        db_cursor.execute(f'''
+            WITH matches AS (
+                SELECT id, ts_rank_cd(search_vector, q, 1)::float8 AS rank
+                FROM questionnaire, websearch_to_tsquery('english', %s) q
+                WHERE search_vector @@ q {field_filter}
+            ), page AS (
+                SELECT id, rank
+                FROM matches
+                {after}
+                ORDER BY rank DESC, id DESC
+                LIMIT %s
+            )
+            SELECT qn.id, qn.user_id, qn.description, qn.goals, qn.challenges, qn.expectations, p.rank,
+                   ts_headline('english', translate({headline_text}, chr(2) || chr(3), ''),
+                               websearch_to_tsquery('english', %s), %s)
+            FROM page p
+            JOIN questionnaire qn ON qn.id = p.id
+            ORDER BY p.rank DESC, p.id DESC
+        ''', params)
+        rows = db_cursor.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_search_cursor(rows[-1][6], rows[-1][0])
+    return {
+        'results': [{
+            'id': row[0],
+            'user_id': row[1],
+            'description': row[2],
+            'goals': row[3],
+            'challenges': row[4],
+            'expectations': row[5],
+            'rank': round(row[6], 6),
+            'snippet': render_snippet(row[7])
+        } for row in rows],
+        'next_cursor': next_cursor
+    }
@@ -0,0 +1,321 @@
+"""
+Hashed TF-IDF vectors with top-k cosine search, for matching free text (questionnaire
+answers) without any model download or network call.
+
+Words and word pairs are hashed into `dim` signed buckets (the sign halves the bias of
+collisions); term frequencies are damped with log1p and weighted by IDF, and rows are
+L2-normalised so a query is one matrix-vector product. The matrices can live in memory-
+mapped files so a restart only maps them back in.
+"""
+import fcntl
+import json
+import os
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+import numpy as np
+
+SIMILARITY_DIM = int(os.getenv("SIMILARITY_DIM", "1024"))  # hashed features per vector
+REWEIGHT_RATIO = 1.25  # IDF is recomputed once the corpus has grown or shrunk by this factor
+REWEIGHT_CHUNK_ROWS = 8192
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset(
+    "a about all am an and are as at be been but by can do for from get have i im in into is it "
+    "its just me more my not of on or so some than that the their them this to too up want was "
+    "we what when will with would you your".split())
+
+
+def features(text):
+    """Lower-cased words (without stop words) and adjacent word pairs."""
+    words = [word for word in TOKEN_RE.findall((text or '').lower()) if word not in STOP_WORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def hashed_counts(text, dim=SIMILARITY_DIM):
+    """Signed, log-damped feature counts of `text` hashed into `dim` buckets."""
+    row = np.zeros(dim, dtype=np.float32)
+    for feature in features(text):
+        h = zlib.crc32(feature.encode())  # stable across processes, unlike hash()
+        row[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    return np.sign(row) * np.log1p(np.abs(row))
+
+
+def _normalized(rows):
+    norms = np.linalg.norm(rows, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return rows / norms
+
+
+class SimilarityIndex:
+    """
+    Integer keys (user ids) mapped to text vectors, searchable by cosine similarity.
+
+    Each key holds the raw hashed counts (so IDF can be reapplied) and its weighted,
+    normalised vector. add() replaces a key's text, remove() moves the last row into the
+    freed slot, and IDF is only recomputed for every row when the number of documents has
+    changed by REWEIGHT_RATIO since the last time, so updates are O(dim) in between.
+
+    With a `path`, everything is kept in memory-mapped files in that directory. Several
+    processes may share one directory: changes are made under an exclusive file lock and
+    each process picks up the others' changes (by the meta file's version) before reading
+    or writing. Without a path the index lives in memory only.
+    """
+
+    def __init__(self, path=None, dim=SIMILARITY_DIM, capacity=1024):
+        self.path = path
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._positions = {}
+        self._size = 0
+        self._idf_docs = 0
+        self._version = 0
+        self._meta_mtime = None
+        if path:
+            os.makedirs(path, exist_ok=True)
+        with self._locked_files():
+            meta = self._read_meta()
+            if meta is not None and meta['dim'] == dim:
+                self._load(meta)
+            else:
+                self._create(capacity)
+
+    # Storage
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _arrays(self, capacity):
+        return [('ids', np.int64, (capacity,)), ('counts', np.float32, (capacity, self.dim)),
+                ('vectors', np.float32, (capacity, self.dim)), ('df', np.float32, (self.dim,)),
+                ('idf', np.float32, (self.dim,))]
+
+    def _map(self, capacity):
+        self._capacity = capacity
+        for name, dtype, shape in self._arrays(capacity):
+            if self.path:
+                array = np.memmap(self._file(name), dtype=dtype, mode='r+', shape=shape)
+            else:
+                array = np.zeros(shape, dtype=dtype)
+            setattr(self, '_' + name, array)
+
+    def _create(self, capacity):
+        if self.path:
+            for name, dtype, shape in self._arrays(capacity):
+                with open(self._file(name), 'wb') as f:
+                    f.truncate(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        self._map(capacity)
+        self._idf[:] = 1
+        self._size = 0
+        self._idf_docs = 0
+        self._positions = {}
+        self._write_meta()
+
+    def _grow(self):
+        capacity = self._capacity * 2
+        if not self.path:
+            for name in ('ids', 'counts', 'vectors'):
+                old = getattr(self, '_' + name)
+                new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:self._size] = old[:self._size]
+                setattr(self, '_' + name, new)
+            self._capacity = capacity
+            return
+        # Rows are stored row-major, so extending the files keeps every existing row in place.
+        self._flush()
+        for name, dtype, shape in self._arrays(capacity):
+            if name in ('ids', 'counts', 'vectors'):
+                setattr(self, '_' + name, None)
+                os.truncate(self._file(name), int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        self._map(capacity)
+
+    def _read_meta(self):
+        if not self.path:
+            return None
+        try:
+            with open(self._file('meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self):
+        self._version += 1
+        if not self.path:
+            return
+        self._flush()
+        temporary = self._file('meta.json.tmp')
+        with open(temporary, 'w') as f:
+            json.dump({'dim': self.dim, 'capacity': self._capacity, 'size': self._size,
+                       'idf_docs': self._idf_docs, 'version': self._version}, f)
+        os.replace(temporary, self._file('meta.json'))
+        self._meta_mtime = os.stat(self._file('meta.json')).st_mtime_ns
+
+    def _load(self, meta):
+        if meta['capacity'] != getattr(self, '_capacity', None):
+            self._map(meta['capacity'])
+        self._size = meta['size']
+        self._idf_docs = meta['idf_docs']
+        self._version = meta['version']
+        self._positions = dict((key, position) for position, key in enumerate(self._ids[:self._size].tolist()))
+        self._meta_mtime = os.stat(self._file('meta.json')).st_mtime_ns
+
+    def _refresh(self):
+        """Picks up changes made by other processes since this one last read the meta file."""
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self._file('meta.json')).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._meta_mtime:
+            meta = self._read_meta()
+            if meta is not None and meta['version'] != self._version:
+                self._load(meta)
+            self._meta_mtime = mtime
+
+    def _flush(self):
+        for name in ('ids', 'counts', 'vectors', 'df', 'idf'):
+            array = getattr(self, '_' + name, None)
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    @contextmanager
+    def _locked_files(self):
+        with self._lock:
+            if not self.path:
+                yield
+                return
+            with open(self._file('lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _writing(self):
+        with self._locked_files():
+            self._refresh()
+            yield
+            if self._idf_docs == 0 or not (1 / REWEIGHT_RATIO <= self._size / self._idf_docs <= REWEIGHT_RATIO):
+                self._reweight()
+            self._write_meta()
+
+    # Weighting
+
+    def _reweight(self):
+        size = self._size
+        self._idf[:] = np.log((1 + size) / (1 + self._df)) + 1
+        self._idf_docs = size
+        for start in range(0, size, REWEIGHT_CHUNK_ROWS):
+            end = min(start + REWEIGHT_CHUNK_ROWS, size)
+            self._vectors[start:end] = _normalized(self._counts[start:end] * self._idf)
+
+    def _weighted(self, counts):
+        return _normalized(counts * self._idf)
+
+    # Public API
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return self._size
+
+    def __contains__(self, key):
+        with self._lock:
+            self._refresh()
+            return key in self._positions
+
+    def add(self, key, text):
+        """Adds `key`, or replaces its text if it is already indexed."""
+        self.add_many([(key, text)])
+
+    def add_many(self, items):
+        """add() for each (key, text) pair, as one change; a repeated key keeps its last text."""
+        items = [(key, hashed_counts(text, self.dim)) for key, text in items]
+        with self._writing():
+            for key, counts in items:
+                position = self._positions.get(key)
+                if position is None:
+                    if self._size == self._capacity:
+                        self._grow()
+                    position = self._size
+                    self._size += 1
+                    self._ids[position] = key
+                    self._positions[key] = position
+                else:
+                    self._df -= self._counts[position] != 0
+                self._counts[position] = counts
+                self._df += counts != 0
+                self._vectors[position] = self._weighted(counts)
+
+    def remove(self, *keys):
+        """Removes keys; unknown keys are ignored. Returns how many were removed."""
+        removed = 0
+        with self._writing():
+            for key in keys:
+                position = self._positions.pop(key, None)
+                if position is None:
+                    continue
+                self._df -= self._counts[position] != 0
+                last = self._size - 1
+                if position != last:
+                    self._ids[position] = self._ids[last]
+                    self._counts[position] = self._counts[last]
+                    self._vectors[position] = self._vectors[last]
+                    self._positions[int(self._ids[position])] = position
+                self._size -= 1
+                removed += 1
+        return removed
+
+    def rebuild(self, items):
+        """Replaces the whole index with (key, text) pairs."""
+        with self._writing():
+            self._size = 0
+            self._positions = {}
+            for key, text in items:
+                if key in self._positions:
+                    continue
+                if self._size == self._capacity:
+                    self._grow()
+                self._ids[self._size] = key
+                self._counts[self._size] = hashed_counts(text, self.dim)
+                self._positions[key] = self._size
+                self._size += 1
+            self._df[:] = (self._counts[:self._size] != 0).sum(axis=0)
+            self._idf_docs = 0  # forces a reweight of every row
+
+    def _top(self, vector, k, exclude):
+        size = self._size
+        if size == 0 or k <= 0 or not vector.any():
+            return []
+        scores = self._vectors[:size] @ vector
+        for key in exclude:
+            position = self._positions.get(key)
+            if position is not None:
+                scores[position] = -np.inf
+        k = min(k, size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(self._ids[i]), round(float(scores[i]), 4)) for i in top if scores[i] > 0]
+
+    def query(self, text, k=10, exclude=()):
+        """The `k` keys most similar to `text`, as (key, cosine similarity), best first."""
+        counts = hashed_counts(text, self.dim)
+        with self._lock:
+            self._refresh()
+            return self._top(self._weighted(counts), k, exclude)
+
+    def similar_to(self, key, k=10):
+        """The `k` keys most similar to an indexed key (excluding itself), or None if it is not indexed."""
+        with self._lock:
+            self._refresh()
+            position = self._positions.get(key)
+            if position is None:
+                return None
+            return self._top(np.array(self._vectors[position]), k, (key,))
+
+    def close(self):
+        with self._lock:
+            self._flush()
@@ -0,0 +1,166 @@
+import argparse
+import datetime
+import psycopg2
+from psycopg2.extras import execute_values
+from db.calendar_queries import parse_timestamp
+from db.connection import get_db_cursor
+
+# Folds the given SleepRecords (by sleep_id) into sleep_daily. Sleep counts towards the day
+# the user woke up; bedtime is in minutes after noon of the previous day, so that 23:30 and
+# 00:30 are 60 minutes apart rather than 23 hours.
+ROLLUP_ADD_SQL = '''
+    INSERT INTO sleep_daily (user_id, day, records, total_minutes, quality_sum, quality_count, bedtime_minutes)
+    SELECT user_id, sleep_end::date, count(*),
+           sum(EXTRACT(EPOCH FROM sleep_end - sleep_start) / 60),
+           coalesce(sum(sleep_quality_score(quality)), 0),
+           count(sleep_quality_score(quality)),
+           min(EXTRACT(EPOCH FROM sleep_start - (sleep_end::date - 1 + TIME '12:00')) / 60)
+    FROM SleepRecords
+    WHERE sleep_id = ANY(%s)
+    GROUP BY user_id, sleep_end::date
+    ON CONFLICT (user_id, day) DO UPDATE SET
+        records = sleep_daily.records + EXCLUDED.records,
+        total_minutes = sleep_daily.total_minutes + EXCLUDED.total_minutes,
+        quality_sum = sleep_daily.quality_sum + EXCLUDED.quality_sum,
+        quality_count = sleep_daily.quality_count + EXCLUDED.quality_count,
+        bedtime_minutes = LEAST(sleep_daily.bedtime_minutes, EXCLUDED.bedtime_minutes)
+'''
+
+BUCKETS = ('day', 'week', 'month')
+
+
+def validate_sleep_record(sleep_start, sleep_end):
+    sleep_start = parse_timestamp(sleep_start, 'sleep_start')
+    sleep_end = parse_timestamp(sleep_end, 'sleep_end')
+    if sleep_end <= sleep_start:
+        raise ValueError("sleep_end must be after sleep_start")
+    if sleep_end - sleep_start > datetime.timedelta(hours=24):
+        raise ValueError("A sleep record cannot be longer than 24 hours")
+    return sleep_start, sleep_end
+
+
+def add_sleep_records(cursor, records):
+    """
+    Inserts (user_id, sleep_start, sleep_end, quality, notes) tuples on an open cursor and
+    folds them into the daily rollup in the same transaction. Returns the new sleep_ids.
+    """
+    sleep_ids = [row[0] for row in execute_values(cursor, '''
+        INSERT INTO SleepRecords (user_id, sleep_start, sleep_end, quality, notes) VALUES %s RETURNING sleep_id
+    ''', records, fetch=True)]
+    cursor.execute(ROLLUP_ADD_SQL, (sleep_ids,))
+    return sleep_ids
+
+
+def add_sleep_record(user_id, sleep_start, sleep_end, quality=None, notes=None):
+    sleep_start, sleep_end = validate_sleep_record(sleep_start, sleep_end)
+    try:
+        with get_db_cursor(commit=True, user_id=user_id) as cursor:
+            return add_sleep_records(cursor, [(user_id, sleep_start, sleep_end, quality, notes)])[0]
+    except psycopg2.IntegrityError as e:
+        if 'foreign key constraint' in str(e).lower():
+            raise ValueError("Invalid user ID - user does not exist")
+        raise RuntimeError("Failed to add sleep record due to a database integrity error")
+
+
+def refresh_sleep_rollups(user_id=None, start=None, end=None):
+    """
+    Rebuilds rollup rows from the raw records, optionally limited to one user and/or a day
+    range. Use after bulk loads or corrections; normal inserts keep the rollup current.
+    """
+    conditions = []
+    raw_conditions = ["user_id IS NOT NULL", "sleep_start IS NOT NULL", "sleep_end IS NOT NULL"]
+    params = []
+    if user_id is not None:
+        conditions.append("user_id = %s")
+        raw_conditions.append("user_id = %s")
+        params.append(user_id)
+    if start is not None:
+        conditions.append("day >= %s")
+        raw_conditions.append("sleep_end::date >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("day <= %s")
+        raw_conditions.append("sleep_end::date <= %s")
+        params.append(end)
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+    with get_db_cursor(commit=True, user_id=user_id) as cursor:
+        cursor.execute(f"DELETE FROM sleep_daily {where}", params)
+        cursor.execute(f'''
+            INSERT INTO sleep_daily (user_id, day, records, total_minutes, quality_sum, quality_count, bedtime_minutes)
+            SELECT user_id, sleep_end::date, count(*),
+                   sum(EXTRACT(EPOCH FROM sleep_end - sleep_start) / 60),
+                   coalesce(sum(sleep_quality_score(quality)), 0),
+                   count(sleep_quality_score(quality)),
+                   min(EXTRACT(EPOCH FROM sleep_start - (sleep_end::date - 1 + TIME '12:00')) / 60)
+            FROM SleepRecords
+            WHERE {" AND ".join(raw_conditions)}
+            GROUP BY user_id, sleep_end::date
+        ''', params)
+        return cursor.rowcount
+
+
+def get_sleep_stats(user_id, start, end, bucket='day'):
+    """
+    Sleep duration, consistency and quality for a user between two dates (inclusive), read
+    from the daily rollup only. Consistency is the standard deviation of nightly duration and
+    of bedtime (minutes); trends are least-squares slopes per day.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError("bucket must be one of: " + ", ".join(BUCKETS))
+    if end < start:
+        raise ValueError("end must not be before start")
+
+    with get_db_cursor(readonly=True, user_id=user_id) as cursor:
+        cursor.execute('''
+            SELECT count(*), coalesce(sum(records), 0),
+                   avg(total_minutes), stddev_pop(total_minutes), stddev_pop(bedtime_minutes),
+                   sum(quality_sum) / NULLIF(sum(quality_count), 0),
+                   regr_slope(total_minutes, day - %s),
+                   regr_slope(quality_sum / NULLIF(quality_count, 0), day - %s)
+            FROM sleep_daily
+            WHERE user_id = %s AND day BETWEEN %s AND %s
+        ''', (start, start, user_id, start, end))
+        summary = cursor.fetchone()
+
+        cursor.execute('''
+            SELECT date_trunc(%s, day)::date AS period, sum(records), avg(total_minutes),
+                   sum(quality_sum) / NULLIF(sum(quality_count), 0)
+            FROM sleep_daily
+            WHERE user_id = %s AND day BETWEEN %s AND %s
+            GROUP BY period
+            ORDER BY period
+        ''', (bucket, user_id, start, end))
+        series = cursor.fetchall()
+
+    def number(value):
+        return round(float(value), 2) if value is not None else None
+
+    return {
+        'user_id': user_id,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'nights': summary[0],
+        'records': int(summary[1]),
+        'avg_duration_minutes': number(summary[2]),
+        'duration_stddev_minutes': number(summary[3]),
+        'bedtime_stddev_minutes': number(summary[4]),
+        'avg_quality': number(summary[5]),
+        'duration_trend_per_day': number(summary[6]),
+        'quality_trend_per_day': number(summary[7]),
+        'series': [{
+            'period': row[0].isoformat(),
+            'records': int(row[1]),
+            'avg_duration_minutes': number(row[2]),
+            'avg_quality': number(row[3])
+        } for row in series]
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuild the sleep_daily rollup from SleepRecords.")
+    parser.add_argument('--user', type=int, help="only this user")
+    parser.add_argument('--start', type=datetime.date.fromisoformat, help="first day to rebuild")
+    parser.add_argument('--end', type=datetime.date.fromisoformat, help="last day to rebuild")
+    args = parser.parse_args()
+    print(f"Rebuilt {refresh_sleep_rollups(args.user, args.start, args.end)} rollup rows.")
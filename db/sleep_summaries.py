@@ -0,0 +1,68 @@
+import datetime
+import numpy as np
+from db.connection import get_db_cursor
+
+
+def summarize_sleep(user_ids, minutes, quality_sum, quality_count, bedtime):
+    """
+    Per-user sleep summary from flat arrays of daily rollup rows, in one vectorized pass.
+    `bedtime` may contain NaN for days without a bedtime. Returns {user_id: summary}.
+    """
+    users, index = np.unique(np.asarray(user_ids), return_inverse=True)
+    if users.size == 0:
+        return {}
+    minutes = np.asarray(minutes, dtype=np.float64)
+    quality_sum = np.asarray(quality_sum, dtype=np.float64)
+    quality_count = np.asarray(quality_count, dtype=np.float64)
+    bedtime = np.asarray(bedtime, dtype=np.float64)
+
+    nights = np.bincount(index, minlength=users.size)
+    total = np.bincount(index, weights=minutes, minlength=users.size)
+    mean = total / nights
+    variance = np.bincount(index, weights=minutes ** 2, minlength=users.size) / nights - mean ** 2
+    duration_std = np.sqrt(np.maximum(variance, 0))
+
+    rated = np.bincount(index, weights=quality_count, minlength=users.size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        quality = np.where(rated > 0, np.bincount(index, weights=quality_sum, minlength=users.size) / rated, np.nan)
+
+    has_bedtime = ~np.isnan(bedtime)
+    bedtime_filled = np.where(has_bedtime, bedtime, 0.0)
+    bed_nights = np.bincount(index, weights=has_bedtime, minlength=users.size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bed_mean = np.bincount(index, weights=bedtime_filled, minlength=users.size) / bed_nights
+        bed_variance = np.bincount(index, weights=bedtime_filled ** 2, minlength=users.size) / bed_nights - bed_mean ** 2
+    bedtime_std = np.where(bed_nights > 0, np.sqrt(np.maximum(bed_variance, 0)), np.nan)
+
+    def value(x):
+        return None if np.isnan(x) else round(float(x), 2)
+
+    return dict((int(user), {
+        'nights': int(nights[i]),
+        'avg_duration_minutes': value(mean[i]),
+        'duration_stddev_minutes': value(duration_std[i]),
+        'bedtime_stddev_minutes': value(bedtime_std[i]),
+        'avg_quality': value(quality[i])
+    }) for i, user in enumerate(users))
+
+
+def weekly_sleep_summaries(week_start):
+    """
+    Summaries for every user with sleep data in the 7 days from `week_start`, computed from
+    a single rollup query instead of one query per user.
+    """
+    week_end = week_start + datetime.timedelta(days=6)
+    with get_db_cursor() as cursor:
+        cursor.execute('''
+            SELECT user_id, total_minutes, quality_sum, quality_count, bedtime_minutes
+            FROM sleep_daily
+            WHERE day BETWEEN %s AND %s
+        ''', (week_start, week_end))
+        rows = cursor.fetchall()
+    if not rows:
+        return {}
+
+    user_ids, minutes, quality_sum, quality_count, bedtime = zip(*rows)
+    bedtime = [np.nan if b is None else float(b) for b in bedtime]
+    return summarize_sleep(np.array(user_ids), np.array(minutes, dtype=np.float64),
+                           np.array(quality_sum, dtype=np.float64), np.array(quality_count), bedtime)
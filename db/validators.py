@@ -1,6 +1,6 @@
 import re
 from validators import email as email_validator
-from db.connection import get_db_cursor
+from db.hashing import hash_password, check_password
 
 def validate_email(email):
     return email_validator(email)
@@ -11,18 +11,41 @@ def validate_password(password):
         return True
     return False
 
-def hash_password(password):
-    import bcrypt
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-
-def is_email_unique(email):
-    with get_db_cursor() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT COUNT(*) FROM users WHERE email = %s", (email,))
-            count = cursor.fetchone()[0]
-            return count == 0
-        
 def validate_age(age):
     if age is not None:
         if not 18 <= age <= 100:
             raise ValueError("Age must be between 18 and 100.")
+
+def validate_new_user(email, age=None, gender=None):
+    """Raises ValueError if the fields of a new user are not acceptable."""
+    if not validate_email(email):
+        raise ValueError("Invalid email format")
+
+    # Validate data types for age and gender
+    if age is not None:
+        if not isinstance(age, int) or age < 0 or age > 120:  # Assuming age should be between 0 and 120
+            raise ValueError("must be an integer.")
+
+    if gender is not None:
+        if not isinstance(gender, str) or gender not in ['Male', 'Female', 'Other']:  # Example gender validation
+            raise ValueError("Gender must be either 'Male', 'Female', or 'Other'.")
+
+def validate_questionnaire_fields(data):
+    """
+    Checks a questionnaire payload and returns a list of problems (empty if valid).
+    A valid user_id is normalised to an int in place.
+    """
+    invalid_fields = []
+    for field in ['user_id', 'description', 'goals', 'challenges', 'expectations']:
+        if field not in data or data[field] is None:
+            invalid_fields.append(f"{field} is missing")
+        elif isinstance(data[field], str) and not data[field].strip():
+            invalid_fields.append(f"{field} is empty or contains only whitespace")
+        elif field == 'user_id':
+            try:
+                data['user_id'] = int(data['user_id'])
+                if data['user_id'] <= 0:
+                    invalid_fields.append("user_id (invalid value: must be greater than 0)")
+            except (TypeError, ValueError):
+                invalid_fields.append("user_id (not an integer)")
+    return invalid_fields
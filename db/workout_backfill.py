@@ -0,0 +1,187 @@
+"""
+Recomputes exercise_stats and workout_weekly from the raw Workouts and Exercises in one
+vectorized pass. Normal inserts keep the aggregates current (db.workout_stats); migration
+21 runs this once to load existing data, and it can be rerun after bulk loads or to repair
+drift:
+
+    python -m db.workout_backfill
+"""
+import datetime
+import numpy as np
+from psycopg2.extras import execute_values
+from db.connection import get_db_connection
+
+BACKFILL_FETCH_SIZE = 50000  # rows per round trip while reading the raw tables
+
+# Dates are read as day numbers (datetime.date.toordinal()), so weeks are integer arithmetic.
+WORKOUT_COLUMNS_SQL = '''
+    SELECT user_id, (date - DATE '0001-01-01') + 1, duration
+    FROM Workouts
+    WHERE user_id IS NOT NULL AND date IS NOT NULL
+'''
+EXERCISE_COLUMNS_SQL = '''
+    SELECT w.user_id, lower(trim(e.name)), (w.date - DATE '0001-01-01') + 1, e.sets, e.reps, e.weight::float8
+    FROM Exercises e
+    JOIN Workouts w ON w.workout_id = e.workout_id
+    WHERE w.user_id IS NOT NULL AND w.date IS NOT NULL
+'''
+
+
+def _filled(values, default):
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isnan(values), default, values)
+
+
+def exercise_volume(sets, reps, weights):
+    """Per-row volume with the same defaults as the incremental SQL (missing sets count as one)."""
+    return _filled(sets, 1) * _filled(reps, 0) * _filled(weights, 0)
+
+
+def _group(*keys):
+    """Group index of each row by the combination of `keys`, and the distinct values of each key per group."""
+    uniques, indexes = zip(*(np.unique(np.asarray(key), return_inverse=True) for key in keys))
+    combined = np.zeros(len(indexes[0]), dtype=np.int64)
+    for unique, index in zip(uniques, indexes):
+        combined = combined * unique.size + index.ravel()
+    groups, inverse = np.unique(combined, return_inverse=True)
+    inverse = inverse.ravel()
+    values = []
+    for unique in reversed(uniques):
+        values.append(unique[groups % unique.size])
+        groups = groups // unique.size
+    return inverse, list(reversed(values))
+
+
+def exercise_aggregates(user_ids, exercises, days, sets, reps, weights):
+    """
+    exercise_stats rows from flat arrays of exercise rows (one element per Exercises row).
+    `days` are day ordinals; sets, reps and weights may contain NaN for missing values.
+    Returns (user_id, exercise, entries, sets_total, reps_total, volume, best_weight,
+    best_e1rm, best_e1rm_day, last_day) tuples in (user_id, exercise) order.
+    """
+    if len(user_ids) == 0:
+        return []
+    inverse, (users, names) = _group(user_ids, exercises)
+    count = users.size
+    days = np.asarray(days, dtype=np.int64)
+    sets = _filled(sets, 1)
+    reps = _filled(reps, 0)
+    weights = _filled(weights, 0)
+
+    entries = np.bincount(inverse, minlength=count)
+    sets_total = np.bincount(inverse, weights=sets, minlength=count)
+    reps_total = np.bincount(inverse, weights=sets * reps, minlength=count)
+    volume = np.bincount(inverse, weights=sets * reps * weights, minlength=count)
+    best_weight = np.zeros(count)
+    np.maximum.at(best_weight, inverse, weights)
+    last_day = np.full(count, np.iinfo(np.int64).min)
+    np.maximum.at(last_day, inverse, days)
+
+    # Epley estimate; the best row per group is the last one after sorting by (group, e1RM,
+    # -day), i.e. the highest e1RM and, among equal ones, the earliest day.
+    e1rm = np.where(reps > 1, weights * (1 + reps / 30), np.where(reps == 1, weights, 0))
+    order = np.lexsort((-days, e1rm, inverse))
+    best = order[np.append(np.flatnonzero(np.diff(inverse[order])), inverse.size - 1)]
+
+    return list(zip(users.tolist(), names.tolist(), entries.tolist(), sets_total.astype(np.int64).tolist(),
+                    reps_total.astype(np.int64).tolist(), volume.tolist(), best_weight.tolist(),
+                    e1rm[best].tolist(), days[best].tolist(), last_day.tolist()))
+
+
+def weekly_aggregates(workout_user_ids, workout_days, minutes, exercise_user_ids, exercise_days, volume):
+    """
+    workout_weekly rows from flat arrays of workouts (user, day ordinal, minutes or NaN) and
+    of exercise volumes (user, day ordinal of their workout, volume). Weeks start on Monday.
+    Returns (user_id, week_day, workouts, minutes, volume) tuples in (user_id, week) order.
+    """
+    if len(workout_user_ids) == 0 and len(exercise_user_ids) == 0:
+        return []
+    workout_count = len(workout_user_ids)
+    exercise_count = len(exercise_user_ids)
+    user_ids = np.concatenate([np.asarray(workout_user_ids, dtype=np.int64),
+                               np.asarray(exercise_user_ids, dtype=np.int64)])
+    days = np.concatenate([np.asarray(workout_days, dtype=np.int64), np.asarray(exercise_days, dtype=np.int64)])
+    weeks = days - (days - 1) % 7  # ordinal 1 (0001-01-01) is a Monday
+    inverse, (users, week_days) = _group(user_ids, weeks)
+    count = users.size
+
+    workouts = np.bincount(inverse, weights=np.concatenate([np.ones(workout_count), np.zeros(exercise_count)]),
+                           minlength=count)
+    total_minutes = np.bincount(inverse, weights=np.concatenate([_filled(minutes, 0), np.zeros(exercise_count)]),
+                                minlength=count)
+    total_volume = np.bincount(inverse, weights=np.concatenate([np.zeros(workout_count),
+                                                                np.asarray(volume, dtype=np.float64)]),
+                               minlength=count)
+    return list(zip(users.tolist(), week_days.tolist(), workouts.astype(np.int64).tolist(),
+                    total_minutes.astype(np.int64).tolist(), total_volume.tolist()))
+
+
+def _read_columns(conn, name, query, width, fetch_size):
+    """Reads a query through a named cursor into one list per column."""
+    columns = None
+    with conn.cursor(name=name) as cursor:
+        cursor.execute(query)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            chunk = list(zip(*rows))
+            if columns is None:
+                columns = [list(column) for column in chunk]
+            else:
+                for column, values in zip(columns, chunk):
+                    column.extend(values)
+    return columns or [[] for _ in range(width)]
+
+
+def replace_workout_stats(conn, fetch_size=BACKFILL_FETCH_SIZE):
+    """
+    Replaces both aggregate tables with values recomputed from the raw tables, inside the
+    current transaction of `conn`; the caller commits. The aggregates are locked against
+    writes first, so inserts that commit while the rebuild runs wait and are then folded in
+    on top of it; reads carry on. Returns (exercise_stats rows, workout_weekly rows).
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("LOCK TABLE exercise_stats, workout_weekly IN EXCLUSIVE MODE")
+    w_users, w_days, w_minutes = _read_columns(conn, 'backfill_workouts', WORKOUT_COLUMNS_SQL, 3, fetch_size)
+    e_users, e_names, e_days, e_sets, e_reps, e_weights = _read_columns(
+        conn, 'backfill_exercises', EXERCISE_COLUMNS_SQL, 6, fetch_size)
+
+    # None becomes NaN in float arrays
+    e_sets = np.array(e_sets, dtype=np.float64)
+    e_reps = np.array(e_reps, dtype=np.float64)
+    e_weights = np.array(e_weights, dtype=np.float64)
+    exercise_rows = exercise_aggregates(np.array(e_users, dtype=np.int64), np.array(e_names, dtype=object),
+                                        e_days, e_sets, e_reps, e_weights)
+    weekly_rows = weekly_aggregates(w_users, w_days, np.array(w_minutes, dtype=np.float64),
+                                    e_users, e_days, exercise_volume(e_sets, e_reps, e_weights))
+
+    day = datetime.date.fromordinal
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM exercise_stats")
+        cursor.execute("DELETE FROM workout_weekly")
+        execute_values(cursor, '''
+            INSERT INTO exercise_stats (user_id, exercise, entries, sets_total, reps_total, volume,
+                                        best_weight, best_e1rm, best_e1rm_date, last_date) VALUES %s
+        ''', [row[:8] + (day(row[8]), day(row[9])) for row in exercise_rows], page_size=1000)
+        execute_values(cursor, '''
+            INSERT INTO workout_weekly (user_id, week, workouts, minutes, volume) VALUES %s
+        ''', [(user_id, day(week), workouts, minutes, volume)
+              for user_id, week, workouts, minutes, volume in weekly_rows], page_size=1000)
+    return len(exercise_rows), len(weekly_rows)
+
+
+def rebuild_workout_stats(fetch_size=BACKFILL_FETCH_SIZE):
+    """replace_workout_stats on a pooled connection, committed as one transaction."""
+    with get_db_connection() as conn:
+        try:
+            counts = replace_workout_stats(conn, fetch_size)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return counts
+
+if __name__ == '__main__':
+    exercise_count, week_count = rebuild_workout_stats()
+    print(f"Rebuilt {exercise_count} exercise_stats rows and {week_count} workout_weekly rows.")
@@ -0,0 +1,152 @@
+import datetime
+import math
+import psycopg2
+from psycopg2.extras import execute_values
+from db.connection import get_db_cursor
+from db.workout_stats import fold_workout_stats
+
+MAX_PAGE_SIZE = 100
+
+
+def _validate_exercise(exercise):
+    if not isinstance(exercise, dict) or not isinstance(exercise.get('name'), str) or not exercise['name'].strip():
+        raise ValueError("Each exercise needs a name")
+    for field in ('reps', 'sets'):
+        value = exercise.get(field)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+            raise ValueError(f"Exercise {field} must be a non-negative integer")
+    weight = exercise.get('weight')
+    # NaN passes `< 0` and would poison the progress aggregates; inf overflows the column.
+    if weight is not None and (not isinstance(weight, (int, float)) or isinstance(weight, bool)
+                               or not math.isfinite(weight) or weight < 0):
+        raise ValueError("Exercise weight must be a non-negative number")
+
+
+def parse_date(value):
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError("date must be an ISO date (YYYY-MM-DD)")
+
+
+def validate_workout(date, duration=None, exercises=()):
+    """Checks a workout and its exercises; returns the parsed date and the exercises as a list."""
+    date = parse_date(date)
+    if duration is not None and (not isinstance(duration, int) or duration < 0):
+        raise ValueError("duration must be a non-negative integer (minutes)")
+    return date, validate_exercises(exercises)
+
+
+def validate_exercises(exercises):
+    exercises = list(exercises or [])
+    for exercise in exercises:
+        _validate_exercise(exercise)
+    return exercises
+
+
+def exercise_row(workout_id, exercise):
+    return (workout_id, exercise['name'].strip(), exercise.get('reps'), exercise.get('sets'), exercise.get('weight'))
+
+
+def add_workout(user_id, date, duration=None, intensity=None, notes=None, exercises=()):
+    """
+    Inserts a workout and all of its exercises in one transaction, together with their
+    progress aggregates, and returns the workout_id. Exercises are dicts with name, reps,
+    sets and weight.
+    """
+    date, exercises = validate_workout(date, duration, exercises)
+
+    try:
+        with get_db_cursor(commit=True, user_id=user_id) as cursor:
+            cursor.execute('''
+                INSERT INTO Workouts (user_id, date, duration, intensity, notes)
+                VALUES (%s, %s, %s, %s, %s) RETURNING workout_id
+            ''', (user_id, date, duration, intensity, notes))
+            workout_id = cursor.fetchone()[0]
+            exercise_ids = []
+            if exercises:
+                exercise_ids = [row[0] for row in execute_values(cursor, '''
+                    INSERT INTO Exercises (workout_id, name, reps, sets, weight) VALUES %s RETURNING exercise_id
+                ''', [exercise_row(workout_id, e) for e in exercises], fetch=True)]
+            fold_workout_stats(cursor, [workout_id], exercise_ids)
+            return workout_id
+    except psycopg2.IntegrityError as e:
+        if 'foreign key constraint' in str(e).lower():
+            raise ValueError("Invalid user ID - user does not exist")
+        raise RuntimeError("Failed to add workout due to a database integrity error")
+
+
+def encode_cursor(date, workout_id):
+    return f"{date.isoformat()}_{workout_id}"
+
+
+def decode_cursor(cursor):
+    try:
+        date, workout_id = cursor.split('_')
+        return datetime.date.fromisoformat(date), int(workout_id)
+    except (AttributeError, ValueError):
+        raise ValueError("Invalid pagination cursor")
+
+
+def list_workouts(user_id, limit=20, cursor=None):
+    """
+    Returns one page of a user's workouts, newest first, each with its exercises.
+
+    Pagination is keyset based on (date, workout_id): `cursor` is the `next_cursor` of the
+    previous page, so every page costs the same index range scan however deep it is. The page
+    and its exercises are fetched by a single statement.
+    Returns {'workouts': [...], 'next_cursor': str or None}.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    params = [user_id]
+    after = ''
+    if cursor:
+        params.extend(decode_cursor(cursor))
+        after = 'AND (date, workout_id) < (%s, %s)'
+    params.append(limit + 1)  # one extra row tells us whether there is another page
+
+    with get_db_cursor(readonly=True, user_id=user_id) as db_cursor:
+        db_cursor.execute(f'''
+            WITH page AS (
+                SELECT workout_id, date, duration, intensity, notes
+                FROM Workouts
+                WHERE user_id = %s {after}
+                ORDER BY date DESC, workout_id DESC
+                LIMIT %s
+            )
+            SELECT p.workout_id, p.date, p.duration, p.intensity, p.notes,
+                   e.exercise_id, e.name, e.reps, e.sets, e.weight
+            FROM page p
+            LEFT JOIN Exercises e ON e.workout_id = p.workout_id
+            ORDER BY p.date DESC, p.workout_id DESC, e.exercise_id
+        ''', params)
+        rows = db_cursor.fetchall()
+
+    workouts = []
+    for row in rows:
+        if not workouts or workouts[-1]['workout_id'] != row[0]:
+            workouts.append({
+                'workout_id': row[0],
+                'date': row[1].isoformat() if row[1] else None,
+                'duration': row[2],
+                'intensity': row[3],
+                'notes': row[4],
+                'exercises': []
+            })
+        if row[5] is not None:
+            workouts[-1]['exercises'].append({
+                'exercise_id': row[5],
+                'name': row[6],
+                'reps': row[7],
+                'sets': row[8],
+                'weight': float(row[9]) if row[9] is not None else None
+            })
+
+    next_cursor = None
+    if len(workouts) > limit:
+        workouts = workouts[:limit]
+        last = workouts[-1]
+        next_cursor = encode_cursor(datetime.date.fromisoformat(last['date']), last['workout_id'])
+    return {'workouts': workouts, 'next_cursor': next_cursor}
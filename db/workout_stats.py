@@ -0,0 +1,146 @@
+import datetime
+from db.connection import get_db_cursor
+
+# Folds new Exercises (by exercise_id) into exercise_stats. Exercises are grouped by their
+# normalised name; volume is sets x reps x weight with a missing sets count taken as one set,
+# and the estimated one-rep max uses the Epley formula weight * (1 + reps / 30). The best
+# e1RM date is the earliest day it was reached. Rows are upserted in key order so that
+# concurrent writers lock them in the same order.
+EXERCISE_STATS_ADD_SQL = '''
+    INSERT INTO exercise_stats (user_id, exercise, entries, sets_total, reps_total, volume,
+                                best_weight, best_e1rm, best_e1rm_date, last_date)
+    SELECT user_id, exercise, count(*), sum(sets), sum(sets * reps), sum(sets * reps * weight), max(weight),
+           max(e1rm), (array_agg(date ORDER BY e1rm DESC, date))[1], max(date)
+    FROM (
+        SELECT w.user_id, lower(trim(e.name)) AS exercise, w.date,
+               coalesce(e.sets, 1) AS sets, coalesce(e.reps, 0) AS reps, coalesce(e.weight, 0) AS weight,
+               CASE WHEN e.reps > 1 THEN coalesce(e.weight, 0) * (1 + e.reps / 30.0)
+                    WHEN e.reps = 1 THEN coalesce(e.weight, 0)
+                    ELSE 0 END AS e1rm
+        FROM Exercises e
+        JOIN Workouts w ON w.workout_id = e.workout_id
+        WHERE e.exercise_id = ANY(%s) AND w.user_id IS NOT NULL AND w.date IS NOT NULL
+    ) added
+    GROUP BY user_id, exercise
+    ORDER BY user_id, exercise
+    ON CONFLICT (user_id, exercise) DO UPDATE SET
+        entries = exercise_stats.entries + EXCLUDED.entries,
+        sets_total = exercise_stats.sets_total + EXCLUDED.sets_total,
+        reps_total = exercise_stats.reps_total + EXCLUDED.reps_total,
+        volume = exercise_stats.volume + EXCLUDED.volume,
+        best_weight = GREATEST(exercise_stats.best_weight, EXCLUDED.best_weight),
+        best_e1rm = GREATEST(exercise_stats.best_e1rm, EXCLUDED.best_e1rm),
+        best_e1rm_date = CASE
+            WHEN EXCLUDED.best_e1rm > exercise_stats.best_e1rm
+              OR (EXCLUDED.best_e1rm = exercise_stats.best_e1rm AND EXCLUDED.best_e1rm_date < exercise_stats.best_e1rm_date)
+            THEN EXCLUDED.best_e1rm_date ELSE exercise_stats.best_e1rm_date END,
+        last_date = GREATEST(exercise_stats.last_date, EXCLUDED.last_date)
+'''
+
+# Folds new Workouts (by workout_id) into workout_weekly; weeks start on Monday.
+WEEKLY_WORKOUTS_ADD_SQL = '''
+    INSERT INTO workout_weekly (user_id, week, workouts, minutes, volume)
+    SELECT user_id, date_trunc('week', date)::date AS week, count(*), coalesce(sum(duration), 0), 0
+    FROM Workouts
+    WHERE workout_id = ANY(%s) AND user_id IS NOT NULL AND date IS NOT NULL
+    GROUP BY user_id, week
+    ORDER BY user_id, week
+    ON CONFLICT (user_id, week) DO UPDATE SET
+        workouts = workout_weekly.workouts + EXCLUDED.workouts,
+        minutes = workout_weekly.minutes + EXCLUDED.minutes
+'''
+
+# Adds the volume of new Exercises (by exercise_id) to the week of their workout.
+WEEKLY_VOLUME_ADD_SQL = '''
+    INSERT INTO workout_weekly (user_id, week, workouts, minutes, volume)
+    SELECT w.user_id, date_trunc('week', w.date)::date AS week, 0, 0,
+           sum(coalesce(e.sets, 1) * coalesce(e.reps, 0) * coalesce(e.weight, 0))
+    FROM Exercises e
+    JOIN Workouts w ON w.workout_id = e.workout_id
+    WHERE e.exercise_id = ANY(%s) AND w.user_id IS NOT NULL AND w.date IS NOT NULL
+    GROUP BY w.user_id, week
+    ORDER BY w.user_id, week
+    ON CONFLICT (user_id, week) DO UPDATE SET
+        volume = workout_weekly.volume + EXCLUDED.volume
+'''
+
+PROGRESS_WEEKS = 8
+
+
+def fold_workout_stats(cursor, workout_ids=(), exercise_ids=()):
+    """
+    Adds newly inserted workouts and exercises to the aggregates. Call it on the cursor that
+    inserted them, before the commit, so the aggregates change in the same transaction.
+    """
+    if workout_ids:
+        cursor.execute(WEEKLY_WORKOUTS_ADD_SQL, (list(workout_ids),))
+    if exercise_ids:
+        cursor.execute(EXERCISE_STATS_ADD_SQL, (list(exercise_ids),))
+        cursor.execute(WEEKLY_VOLUME_ADD_SQL, (list(exercise_ids),))
+
+
+def week_start(day):
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def get_progress(user_id, weeks=PROGRESS_WEEKS, today=None):
+    """
+    A user's training progress read from the aggregates only: totals, per-exercise records
+    (best estimated 1RM first) and the last `weeks` weeks of volume, including empty weeks.
+    The cost depends on the number of exercise names and weeks, not on how much was logged.
+    """
+    today = today or datetime.date.today()
+    first_week = week_start(today) - datetime.timedelta(weeks=weeks - 1)
+
+    with get_db_cursor(readonly=True, user_id=user_id) as cursor:
+        cursor.execute('''
+            SELECT exercise, entries, sets_total, reps_total, volume, best_weight, best_e1rm,
+                   best_e1rm_date, last_date
+            FROM exercise_stats
+            WHERE user_id = %s
+            ORDER BY best_e1rm DESC, exercise
+        ''', (user_id,))
+        exercises = cursor.fetchall()
+        cursor.execute('''
+            SELECT coalesce(sum(workouts), 0), coalesce(sum(minutes), 0)
+            FROM workout_weekly
+            WHERE user_id = %s
+        ''', (user_id,))
+        workouts, minutes = cursor.fetchone()
+        cursor.execute('''
+            SELECT week, workouts, minutes, volume
+            FROM workout_weekly
+            WHERE user_id = %s AND week >= %s
+            ORDER BY week
+        ''', (user_id, first_week))
+        recent = dict((row[0], row[1:]) for row in cursor.fetchall())
+
+    def number(value):
+        return round(float(value), 2) if value is not None else None
+
+    def day(value):
+        return value.isoformat() if value is not None else None
+
+    return {
+        'user_id': user_id,
+        'workouts': int(workouts),
+        'minutes': int(minutes),
+        'volume': number(sum(row[4] for row in exercises)) if exercises else 0.0,
+        'exercises': [{
+            'exercise': row[0],
+            'entries': row[1],
+            'sets': row[2],
+            'reps': row[3],
+            'volume': number(row[4]),
+            'best_weight': number(row[5]),
+            'best_e1rm': number(row[6]),
+            'best_e1rm_date': day(row[7]),
+            'last_date': day(row[8])
+        } for row in exercises],
+        'weeks': [{
+            'week': week.isoformat(),
+            'workouts': recent.get(week, (0, 0, 0))[0],
+            'minutes': recent.get(week, (0, 0, 0))[1],
+            'volume': number(recent.get(week, (0, 0, 0))[2])
+        } for week in (first_week + datetime.timedelta(weeks=i) for i in range(weeks))]
+    }
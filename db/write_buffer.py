@@ -0,0 +1,304 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import psycopg2
+from psycopg2.extras import execute_values
+from db.connection import get_db_cursor, note_writes, REPLICAS
+from db.metrics import register_collector
+from db.sleep_queries import ROLLUP_ADD_SQL, validate_sleep_record
+from db.workout_queries import exercise_row, validate_exercises, validate_workout
+from db.workout_stats import fold_workout_stats
+
+WRITE_BUFFER_MAX_BATCH = int(os.getenv("WRITE_BUFFER_MAX_BATCH", "500"))  # writes per transaction
+WRITE_BUFFER_MAX_DELAY = float(os.getenv("WRITE_BUFFER_MAX_DELAY", "0.05"))  # seconds a write may wait for its batch
+WRITE_BUFFER_MAX_PENDING = int(os.getenv("WRITE_BUFFER_MAX_PENDING", "50000"))
+WRITE_BUFFER_SHUTDOWN_TIMEOUT = float(os.getenv("WRITE_BUFFER_SHUTDOWN_TIMEOUT", "10"))  # seconds to flush at exit
+
+logger = logging.getLogger(__name__)
+
+WORKOUT, EXERCISES, SLEEP = 'workout', 'exercises', 'sleep'
+
+
+class WriteBufferFullError(RuntimeError):
+    """Raised when too many writes are waiting to be flushed; the caller should retry later."""
+
+
+def _allocate_ids(cursor, table, column, count):
+    # Ids are taken from the table's sequence up front so each write knows its own id
+    # without relying on the order of RETURNING rows.
+    cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+                   (table, column, count))
+    return [row[0] for row in cursor.fetchall()]
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer for high-frequency inserts (workouts, exercises, sleep records).
+
+    Writes are validated immediately, queued, and committed by a background thread in
+    batches of up to `max_batch`, at most `max_delay` seconds after the oldest queued write:
+    one pool checkout and one commit for the whole batch instead of one per write. Every
+    add_* call returns a Future that resolves with the new id once the transaction holding
+    it has committed (the durability acknowledgement), or fails with the write's error.
+
+    If a batch fails on its data, its writes are retried one transaction each, so one bad
+    row (e.g. a deleted user) does not fail the others; if it fails because the database
+    or the pool is unavailable, the whole batch fails at once. flush() waits for everything
+    queued so far; close() flushes and stops the thread, and runs at interpreter exit.
+    """
+
+    def __init__(self, max_batch=WRITE_BUFFER_MAX_BATCH, max_delay=WRITE_BUFFER_MAX_DELAY,
+                 max_pending=WRITE_BUFFER_MAX_PENDING):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self._pending = deque()  # (kind, payload, future, queued_at)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._flush_waiters = 0
+        self._submitted = 0
+        self._completed = 0
+        self._batches = 0
+        self._failures = 0
+        self._largest_batch = 0
+
+    def _submit(self, kind, payload):
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write buffer is closed")
+            if len(self._pending) >= self.max_pending:
+                raise WriteBufferFullError("Too many writes waiting to be flushed")
+            self._pending.append((kind, payload, future, time.monotonic()))
+            self._submitted += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-write-buffer', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        return future
+
+    def add_workout(self, user_id, date, duration=None, intensity=None, notes=None, exercises=()):
+        """Queues a workout with its exercises; the future resolves with the workout_id."""
+        date, exercises = validate_workout(date, duration, exercises)
+        return self._submit(WORKOUT, ((user_id, date, duration, intensity, notes), exercises))
+
+    def add_exercises(self, workout_id, exercises):
+        """Queues exercises for an existing workout; the future resolves with their exercise_ids."""
+        exercises = validate_exercises(exercises)
+        if not exercises:
+            raise ValueError("At least one exercise is required")
+        return self._submit(EXERCISES, (workout_id, exercises))
+
+    def add_sleep_record(self, user_id, sleep_start, sleep_end, quality=None, notes=None):
+        """Queues a sleep record (folded into the daily rollup on commit); resolves with the sleep_id."""
+        sleep_start, sleep_end = validate_sleep_record(sleep_start, sleep_end)
+        return self._submit(SLEEP, (user_id, sleep_start, sleep_end, quality, notes))
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if self._pending:
+                    due = self._pending[0][3] + self.max_delay - time.monotonic()
+                    if len(self._pending) >= self.max_batch or self._closed or self._flush_waiters or due <= 0:
+                        break
+                    self._cond.wait(due)
+                elif self._closed:
+                    return None
+                else:
+                    self._cond.wait()
+            return [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            failed = 0
+            try:
+                self._write(batch)
+            except Exception as e:  # never let the flusher die with futures unresolved
+                logger.exception("Write buffer flush failed")
+                for kind, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(self._translate(kind, e))
+                        failed += 1
+            with self._cond:
+                self._failures += failed
+                self._completed += len(batch)
+                self._batches += 1
+                self._largest_batch = max(self._largest_batch, len(batch))
+                self._cond.notify_all()
+
+    def _write(self, batch):
+        try:
+            with get_db_cursor(commit=True) as cursor:
+                results = self._apply(cursor, batch)
+                user_ids = self._written_users(cursor, batch)
+        except (psycopg2.IntegrityError, psycopg2.DataError, ValueError) as e:
+            # Anything else (an unreachable database, a pool timeout) would fail every replay
+            # as well, so it propagates and _run fails the writes still unresolved.
+            if len(batch) > 1:
+                for item in batch:
+                    self._write([item])
+                return
+            with self._cond:
+                self._failures += 1
+            kind, _, future, _ = batch[0]
+            future.set_exception(self._translate(kind, e))
+            return
+        note_writes(*user_ids)
+        for (_, _, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    @staticmethod
+    def _translate(kind, error):
+        if isinstance(error, psycopg2.IntegrityError) and 'foreign key constraint' in str(error).lower():
+            return ValueError("Invalid workout ID - workout does not exist" if kind == EXERCISES
+                              else "Invalid user ID - user does not exist")
+        if isinstance(error, psycopg2.Error):
+            return RuntimeError(f"Failed to write {kind} due to a database error")
+        return error
+
+    @staticmethod
+    def _written_users(cursor, batch):
+        """The users whose data the batch wrote, so their reads stay on the primary for a while."""
+        user_ids = set(payload[0][0] if kind == WORKOUT else payload[0]
+                       for kind, payload, _, _ in batch if kind != EXERCISES)
+        workout_ids = [payload[0] for kind, payload, _, _ in batch if kind == EXERCISES]
+        if workout_ids and REPLICAS:  # exercises only name their workout
+            cursor.execute("SELECT DISTINCT user_id FROM Workouts WHERE workout_id = ANY(%s)", (workout_ids,))
+            user_ids.update(row[0] for row in cursor.fetchall())
+        return user_ids
+
+    def _apply(self, cursor, batch):
+        """Inserts a batch on one cursor with one statement per table. Returns each write's result."""
+        results = [None] * len(batch)
+        workouts = [(i, payload) for i, (kind, payload, _, _) in enumerate(batch) if kind == WORKOUT]
+        exercises = [(i, payload) for i, (kind, payload, _, _) in enumerate(batch) if kind == EXERCISES]
+        sleep = [(i, payload) for i, (kind, payload, _, _) in enumerate(batch) if kind == SLEEP]
+
+        exercise_rows = []  # (workout_id, exercise) for both kinds of write
+        workout_ids, exercise_ids = [], []
+        if workouts:
+            workout_ids = _allocate_ids(cursor, 'workouts', 'workout_id', len(workouts))
+            execute_values(cursor, '''
+                INSERT INTO Workouts (workout_id, user_id, date, duration, intensity, notes) VALUES %s
+            ''', [(workout_id,) + row for workout_id, (_, (row, _)) in zip(workout_ids, workouts)], page_size=1000)
+            for workout_id, (i, (_, workout_exercises)) in zip(workout_ids, workouts):
+                results[i] = workout_id
+                exercise_rows.extend((workout_id, e) for e in workout_exercises)
+        exercises_start = len(exercise_rows)
+        for i, (workout_id, workout_exercises) in exercises:
+            exercise_rows.extend((workout_id, e) for e in workout_exercises)
+        if exercise_rows:
+            exercise_ids = _allocate_ids(cursor, 'exercises', 'exercise_id', len(exercise_rows))
+            execute_values(cursor, '''
+                INSERT INTO Exercises (exercise_id, workout_id, name, reps, sets, weight) VALUES %s
+            ''', [(exercise_id,) + exercise_row(workout_id, e)
+                  for exercise_id, (workout_id, e) in zip(exercise_ids, exercise_rows)], page_size=1000)
+            position = exercises_start
+            for i, (_, workout_exercises) in exercises:
+                results[i] = exercise_ids[position:position + len(workout_exercises)]
+                position += len(workout_exercises)
+        fold_workout_stats(cursor, workout_ids, exercise_ids)
+        if sleep:
+            ids = _allocate_ids(cursor, 'sleeprecords', 'sleep_id', len(sleep))
+            execute_values(cursor, '''
+                INSERT INTO SleepRecords (sleep_id, user_id, sleep_start, sleep_end, quality, notes) VALUES %s
+            ''', [(sleep_id,) + row for sleep_id, (_, row) in zip(ids, sleep)], page_size=1000)
+            cursor.execute(ROLLUP_ADD_SQL, (ids,))
+            for sleep_id, (i, _) in zip(ids, sleep):
+                results[i] = sleep_id
+        return results
+
+    def flush(self, timeout=None):
+        """Blocks until every write queued before the call has been committed (or failed)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            target = self._submitted
+            self._flush_waiters += 1
+            self._cond.notify_all()
+            try:
+                while self._completed < target:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                self._flush_waiters -= 1
+
+    def close(self, timeout=None):
+        """Stops accepting writes, commits everything still queued and stops the flusher."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                with self._cond:
+                    dropped = self._submitted - self._completed
+                logger.warning("Write buffer did not finish flushing within %ss; %d write(s) not committed",
+                               timeout, dropped)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._pending),
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'batches': self._batches,
+                'failures': self._failures,
+                'largest_batch': self._largest_batch,
+                'avg_batch': self._completed / self._batches if self._batches else 0.0
+            }
+
+
+# One buffer per process, created on first use like the connection pool.
+_buffer = None
+_buffer_pid = None
+_buffer_lock = threading.Lock()
+
+
+def get_write_buffer():
+    global _buffer, _buffer_pid
+    pid = os.getpid()
+    if _buffer is None or _buffer_pid != pid:
+        with _buffer_lock:
+            if _buffer is None or _buffer_pid != pid:
+                _buffer = WriteBuffer()
+                _buffer_pid = pid
+    return _buffer
+
+
+def close_write_buffer(timeout=None):
+    """Flushes and stops this process's buffer, if it was ever used."""
+    global _buffer, _buffer_pid
+    with _buffer_lock:
+        buffer, pid = _buffer, _buffer_pid
+        _buffer = None
+        _buffer_pid = None
+    if buffer is not None and pid == os.getpid():
+        buffer.close(timeout)
+
+
+atexit.register(close_write_buffer, WRITE_BUFFER_SHUTDOWN_TIMEOUT)
+
+
+@register_collector
+def _collect_write_buffer_metrics():
+    if _buffer is None or _buffer_pid != os.getpid():
+        return []
+    stats = _buffer.stats()
+    return [
+        ('write_buffer_pending', 'gauge', "Writes waiting to be flushed", [({}, stats['pending'])]),
+        ('write_buffer_writes_total', 'counter', "Writes flushed", [({}, stats['completed'])]),
+        ('write_buffer_batches_total', 'counter', "Batched transactions committed", [({}, stats['batches'])]),
+        ('write_buffer_failures_total', 'counter', "Writes that failed", [({}, stats['failures'])]),
+    ]
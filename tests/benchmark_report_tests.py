@@ -0,0 +1,38 @@
+import unittest
+from benchmarks.report import compare, percentile, summarize
+
+
+class TestBenchmarkReport(unittest.TestCase):
+    def test_percentile_interpolates(self):
+        values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile(values, 100), 10)
+        self.assertAlmostEqual(percentile(values, 50), 5.5)
+        self.assertAlmostEqual(percentile(values, 95), 9.55)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize(self):
+        summary = summarize([0.001] * 99 + [0.1], errors=2, elapsed=0.5)
+        self.assertEqual(summary['requests'], 100)
+        self.assertEqual(summary['errors'], 2)
+        self.assertEqual(summary['throughput_rps'], 200.0)
+        self.assertEqual(summary['p50_ms'], 1.0)
+        self.assertEqual(summary['max_ms'], 100.0)
+
+    def test_compare_flags_regressions_beyond_threshold(self):
+        baseline = {'results': {
+            'api.get_user': {'p50_ms': 2.0, 'p95_ms': 5.0, 'p99_ms': 8.0, 'throughput_rps': 1000},
+            'api.removed': {'p50_ms': 1.0, 'p95_ms': 1.0, 'p99_ms': 1.0, 'throughput_rps': 1},
+        }}
+        current = {'results': {
+            'api.get_user': {'p50_ms': 2.1, 'p95_ms': 7.0, 'p99_ms': 8.0, 'throughput_rps': 700},
+            'api.new': {'p50_ms': 50.0, 'p95_ms': 50.0, 'p99_ms': 50.0, 'throughput_rps': 1},
+        }}
+        self.assertEqual(compare(baseline, current, threshold=0.1), [
+            ('api.get_user', 'p95_ms', 5.0, 7.0),
+            ('api.get_user', 'throughput_rps', 1000, 700),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import asyncio
+import datetime
+import unittest
+from bot.bot import Bot, TelegramAPI, next_weekly_run
+from tests.fake_telegram import FakeTelegramServer
+
+
+async def echo(bot, update):
+    message = update['message']
+    await asyncio.sleep(0.01)
+    await bot.api.send_message(message['chat']['id'], message['text'])
+
+
+class TestBotRuntime(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await FakeTelegramServer().start()
+        self.bot = Bot(TelegramAPI(self.server.token, base_url=self.server.url), echo)
+
+    async def asyncTearDown(self):
+        await self.bot.shutdown()
+        await self.server.stop()
+
+    async def wait_for_messages(self, count):
+        for _ in range(200):
+            if len(self.server.sent_messages()) >= count:
+                return
+            await asyncio.sleep(0.01)
+        self.fail("Timed out waiting for the bot to reply")
+
+    async def test_long_polling_replies_in_order_per_chat(self):
+        polling = asyncio.create_task(self.bot.run_polling(poll_timeout=1))
+        for n in range(5):
+            self.server.push_message(1, f"a{n}")
+            self.server.push_message(2, f"b{n}")
+        await self.wait_for_messages(10)
+        self.bot.stop()
+        polling.cancel()
+
+        self.assertEqual([m['text'] for m in self.server.sent_messages(1)], [f"a{n}" for n in range(5)])
+        self.assertEqual([m['text'] for m in self.server.sent_messages(2)], [f"b{n}" for n in range(5)])
+
+    async def test_webhook_accepts_updates(self):
+        from aiohttp.test_utils import TestClient, TestServer
+        client = TestClient(TestServer(self.bot.webhook_app(secret_token='s3cret')))
+        await client.start_server()
+        try:
+            forbidden = await client.post('/webhook', json={})
+            self.assertEqual(forbidden.status, 403)
+            response = await client.post('/webhook', headers={'X-Telegram-Bot-Api-Secret-Token': 's3cret'},
+                                         json={'update_id': 1, 'message': {'chat': {'id': 7}, 'text': 'hi'}})
+            self.assertEqual(response.status, 200)
+            await self.wait_for_messages(1)
+            self.assertEqual(self.server.sent_messages(7)[0]['text'], 'hi')
+        finally:
+            await client.close()
+
+
+
+class TestWeeklySchedule(unittest.TestCase):
+    def test_next_monday_run(self):
+        at = datetime.time(9, 0)
+        sunday = datetime.datetime(2024, 3, 10, 20, 0)
+        self.assertEqual(next_weekly_run(sunday, at), datetime.datetime(2024, 3, 11, 9, 0))
+        monday_before = datetime.datetime(2024, 3, 11, 8, 59)
+        self.assertEqual(next_weekly_run(monday_before, at), datetime.datetime(2024, 3, 11, 9, 0))
+        monday_at = datetime.datetime(2024, 3, 11, 9, 0)
+        self.assertEqual(next_weekly_run(monday_at, at), datetime.datetime(2024, 3, 18, 9, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import time
+import unittest
+from db.cache import TTLCache
+
+
+class DictStore:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ttl):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_read_through_loads_once(self):
+        cache = TTLCache('test', maxsize=10, ttl=60)
+        calls = []
+
+        def loader(key):
+            calls.append(key)
+            return {'user_id': key}
+
+        self.assertEqual(cache.get_or_load(1, loader), {'user_id': 1})
+        self.assertEqual(cache.get_or_load(1, loader), {'user_id': 1})
+        self.assertEqual(calls, [1])
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_none_is_not_cached(self):
+        cache = TTLCache('test', maxsize=10, ttl=60)
+        calls = []
+        cache.get_or_load(1, lambda key: calls.append(key))
+        cache.get_or_load(1, lambda key: calls.append(key))
+        self.assertEqual(len(calls), 2)
+
+    def test_lru_eviction(self):
+        cache = TTLCache('test', maxsize=2, ttl=60)
+        cache.set(1, 'a')
+        cache.set(2, 'b')
+        cache.get(1)
+        cache.set(3, 'c')
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), 'a')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        cache = TTLCache('test', maxsize=10, ttl=0.01)
+        cache.set(1, 'a')
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_invalidate_removes_entry(self):
+        cache = TTLCache('test', maxsize=10, ttl=60)
+        cache.set(1, 'a')
+        cache.set(2, 'b')
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get(2), 'b')
+
+    def test_load_racing_with_invalidation_is_not_cached(self):
+        cache = TTLCache('test', maxsize=10, ttl=60)
+
+        def loader(key):
+            cache.invalidate(key)  # a write lands while the old row is being read
+            return 'stale'
+
+        self.assertEqual(cache.get_or_load(1, loader), 'stale')
+        self.assertIsNone(cache.get(1))
+
+    def test_shared_store_is_consulted_on_local_miss(self):
+        store = DictStore()
+        writer = TTLCache('user', maxsize=10, ttl=60, shared=store)
+        reader = TTLCache('user', maxsize=10, ttl=60, shared=store)
+        writer.set(1, 'a')
+        self.assertEqual(reader.get(1), 'a')
+        self.assertEqual(reader.stats()['shared_hits'], 1)
+        writer.invalidate(1)
+        self.assertNotIn('user:1', store.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from bot import commands
+from bot.commands import Conversation, ConversationStore, handle_update, parse_set
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, chat_id, text, **params):
+        self.sent.append((chat_id, text))
+
+
+def message_update(chat_id, text):
+    return {'update_id': 1, 'message': {'message_id': 1, 'chat': {'id': chat_id}, 'text': text}}
+
+
+class TestConversationStore(unittest.TestCase):
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'state.json')
+            store = ConversationStore(path)
+            store.set(42, Conversation('questionnaire', 7, step=2, answers=('a', 'b')))
+            store.snapshot()
+
+            restored = ConversationStore(path)
+            restored.load()
+            conversation = restored.get(42)
+            self.assertEqual((conversation.flow, conversation.step, conversation.user_id), ('questionnaire', 2, 7))
+            self.assertEqual(conversation.answers, ('a', 'b'))
+
+    def test_expired_conversations_are_dropped(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ConversationStore(os.path.join(tmp, 'state.json'), ttl=60)
+            store.set(1, Conversation('questionnaire', 7))
+            store.get(1).updated_at -= 120
+            self.assertEqual(store.dump(), [])
+
+
+class TestQuestionnaireFlow(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ConversationStore(os.path.join(self.tmp.name, 'state.json'))
+        patcher = patch.object(commands, 'conversations', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    @patch('bot.commands.get_user_id_for_chat', return_value=7)
+    @patch('bot.commands.add_questionnaire', return_value=1)
+    async def test_answers_are_saved_once_at_the_end(self, add_questionnaire, get_user_id_for_chat):
+        bot = FakeBot()
+        await handle_update(bot, message_update(5, '/questionnaire'))
+        for answer in ['About me', 'Get strong', 'No time', 'Results']:
+            add_questionnaire.assert_not_called()
+            await handle_update(bot, message_update(5, answer))
+
+        add_questionnaire.assert_called_once_with(7, 'About me', 'Get strong', 'No time', 'Results')
+        self.assertIsNone(self.store.get(5))
+        self.assertIn('saved', bot.sent[-1][1])
+
+    @patch('bot.commands.get_user_id_for_chat', return_value=7)
+    @patch('bot.commands.add_questionnaire', side_effect=[ConnectionError("database down"), 1])
+    async def test_failed_save_keeps_the_flow_open(self, add_questionnaire, get_user_id_for_chat):
+        bot = FakeBot()
+        await handle_update(bot, message_update(5, '/questionnaire'))
+        for answer in ['About me', 'Get strong', 'No time']:
+            await handle_update(bot, message_update(5, answer))
+        with self.assertRaises(ConnectionError):
+            await handle_update(bot, message_update(5, 'Results'))
+        self.assertEqual(self.store.get(5).answers, ('About me', 'Get strong', 'No time'))
+
+        await handle_update(bot, message_update(5, 'Results'))
+        add_questionnaire.assert_called_with(7, 'About me', 'Get strong', 'No time', 'Results')
+        self.assertIsNone(self.store.get(5))
+
+    @patch('bot.commands.get_user_id_for_chat', return_value=7)
+    @patch('bot.commands.add_questionnaire')
+    async def test_cancel_discards_partial_answers(self, add_questionnaire, get_user_id_for_chat):
+        bot = FakeBot()
+        await handle_update(bot, message_update(5, '/questionnaire'))
+        await handle_update(bot, message_update(5, 'About me'))
+        await handle_update(bot, message_update(5, '/cancel'))
+        self.assertIsNone(self.store.get(5))
+        add_questionnaire.assert_not_called()
+
+
+class TestParseSet(unittest.TestCase):
+    def test_parses_name_sets_reps_and_weight(self):
+        self.assertEqual(parse_set("bench press 3x8 70.5kg"),
+                         {'name': 'bench press', 'sets': 3, 'reps': 8, 'weight': 70.5})
+        self.assertEqual(parse_set("pull up 4X10"), {'name': 'pull up', 'sets': 4, 'reps': 10, 'weight': None})
+
+    def test_rejects_malformed_input(self):
+        for text in ("", "3x8", "squat", "squat 3x8 heavy", "squat 3x8 100 extra",
+                     "squat 3x8 nan", "squat 3x8 inf", "squat 3x8 -infinity", "squat ²x8"):
+            self.assertIsNone(parse_set(text), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,15 @@
+import json
 import unittest
 from flask import Flask, jsonify
 from uuid import uuid4
 from api.app import setup_routes  # Ensure this import suits your project structure
 from db.connection import get_db_cursor
-from db.queries import add_user, delete_user
+from db.queries import add_user, delete_user, get_user
+from db.workout_queries import add_workout
+from db.sleep_queries import add_sleep_record
+from db.bulk_queries import purge_users
+from db.question_queries import add_questionnaire
+from db.search_queries import search_questionnaires
 
 class TestUserEndpoints(unittest.TestCase):
     def create_app(self):
@@ -80,6 +86,32 @@ class TestUserEndpoints(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn('success', data['status'])
 
+    def test_get_user_omits_password(self):
+        response = self.app.get(f'/get_user/{self.user_id}')
+        self.assertNotIn('password', response.get_json()['user_data'])
+
+    def test_get_users_batch(self):
+        response = self.app.get(f'/users?ids={self.user_id},{self.user_id},0')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['user_id'] for user in data['users']], [self.user_id])
+        self.assertEqual(data['missing'], [0])
+        self.assertNotIn('password', data['users'][0])
+
+    def test_get_users_rejects_bad_ids(self):
+        response = self.app.get('/users?ids=1,abc')
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_profile(self):
+        response = self.app.get(f'/profile/{self.user_id}')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['user_data']['user_id'], self.user_id)
+        self.assertNotIn('password', data['user_data'])
+        self.assertIsNone(data['questionnaire'])
+
+        self.assertEqual(self.app.get('/profile/0').status_code, 404)
+
     def test_delete_existing_user(self):
         # Create a user explicitly here for this test
         user_id = add_user("John", "Doe", "john.doe@exale.com", "password123", 30, "Male")
@@ -106,6 +138,93 @@ class TestUserEndpoints(unittest.TestCase):
             self.assertIn('error', data_check['status'])  # Assuming 'error' is part of the response for non-found users even if status code is 200
 
         
+    def test_delete_user_cascades_to_dependent_rows(self):
+        user_id = add_user("Jane", "Doe", f"jane_{uuid4()}@example.com", "password123", 30, "Female")
+        add_workout(user_id, '2024-01-01', 30, 'high', None, [{'name': 'Squat', 'reps': 5, 'sets': 5}])
+        add_sleep_record(user_id, '2024-01-01T23:00', '2024-01-02T07:00', 'good')
+
+        response = self.app.delete(f'/delete_user/{user_id}')
+        self.assertEqual(response.get_json()['status'], 'success')
+        with get_db_cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM Workouts WHERE user_id = %s", (user_id,))
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_purge_users_in_chunks(self):
+        user_ids = [add_user("Purge", str(i), f"purge_{uuid4()}@example.com", "password123") for i in range(5)]
+        add_workout(user_ids[0], '2024-01-01', exercises=[{'name': 'Row'}])
+        result = purge_users(user_ids + [0], chunk_size=2)
+        self.assertEqual(result, {'deleted': 5, 'missing': [0]})
+        self.assertIsNone(get_user(user_ids[0]))
+
+    def test_export_user_streams_ndjson(self):
+        add_workout(self.user_id, '2024-01-01', 30, exercises=[{'name': 'Squat', 'reps': 5, 'sets': 5, 'weight': 80.5}])
+        response = self.app.get(f'/export/{self.user_id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(lines[0]['type'], 'export')
+        types = [line['type'] for line in lines[1:]]
+        self.assertEqual(types, ['user', 'workout', 'exercise'])
+        self.assertNotIn('password', lines[1]['data'])
+        self.assertEqual(lines[3]['data']['weight'], 80.5)
+
+    def test_progress_aggregates_follow_inserts(self):
+        add_workout(self.user_id, '2024-01-01', 30, exercises=[{'name': 'Squat', 'reps': 5, 'sets': 3, 'weight': 100},
+                                                               {'name': 'squat ', 'reps': 1, 'sets': 1, 'weight': 120}])
+        add_workout(self.user_id, '2024-01-03', 45, exercises=[{'name': 'Row', 'reps': 10, 'sets': 3}])
+        response = self.app.get(f'/get_progress/{self.user_id}?weeks=2')
+        self.assertEqual(response.status_code, 200)
+        progress = response.get_json()['progress']
+        self.assertEqual(progress['workouts'], 2)
+        self.assertEqual(progress['minutes'], 75)
+        self.assertEqual(progress['volume'], 1620)
+        squat = progress['exercises'][0]
+        self.assertEqual(squat['exercise'], 'squat')
+        self.assertEqual(squat['sets'], 4)
+        self.assertEqual(squat['best_weight'], 120)
+        self.assertEqual(squat['best_e1rm'], 120)
+        self.assertEqual(squat['best_e1rm_date'], '2024-01-01')
+
+    def test_recommendations_from_similar_questionnaires(self):
+        other = add_user("Rec", "User", f"rec_{uuid4()}@example.com", "password123")
+        try:
+            for user_id, goals in ((self.user_id, 'Run my first marathon'), (other, 'Marathon training plan')):
+                self.app.post('/add_questionnaire', json={'user_id': user_id, 'description': 'd', 'goals': goals,
+                                                          'challenges': 'endurance', 'expectations': 'finish'})
+            response = self.app.post('/add_routine', json={'user_id': other, 'name': 'Long run Sundays'})
+            self.assertEqual(response.status_code, 201)
+
+            data = self.app.get(f'/recommendations/{self.user_id}').get_json()
+            self.assertIn(other, [user['user_id'] for user in data['similar_users']])
+            self.assertIn('Long run Sundays', [routine['name'] for routine in data['routines']])
+        finally:
+            delete_user(other)
+        self.assertNotIn(other, [user['user_id'] for user in
+                                 self.app.get(f'/recommendations/{self.user_id}').get_json()['similar_users']])
+        self.assertEqual(self.app.get('/recommendations/0').status_code, 404)
+
+    def test_search_questionnaires_ranked_and_paginated(self):
+        word = f"zq{uuid4().hex[:10]}"  # unique to this test run
+        add_questionnaire(self.user_id, 'd', f'Run again after {word} <b>5k</b>', f'Old {word} knee injury', 'Patience')
+        add_questionnaire(self.user_id, 'd', 'Swim', f'Shoulder pain, not {word}', 'Fun')
+
+        results = search_questionnaires(f'{word} knee')['results']
+        self.assertEqual(len(results), 1)
+        self.assertIn(f'<mark>{word}</mark>', results[0]['snippet'])
+        self.assertIn('&lt;b&gt;5k&lt;/b&gt;', results[0]['snippet'])
+        self.assertIn('knee', results[0]['challenges'])
+
+        first = search_questionnaires(word, limit=1)
+        second = search_questionnaires(word, limit=1, cursor=first['next_cursor'])
+        self.assertEqual(len(second['results']), 1)
+        self.assertNotEqual(first['results'][0]['id'], second['results'][0]['id'])
+        self.assertIsNone(second['next_cursor'])
+        self.assertEqual(len(search_questionnaires(word, field='goals')['results']), 1)
+        self.assertEqual(self.app.get(f'/search/questionnaires?q={word}').status_code, 403)
+
+    def test_export_all_requires_admin(self):
+        self.assertEqual(self.app.get('/export').status_code, 403)
+
     def test_empty_inputs(self):
         """Test adding a user with empty inputs for required fields."""
         response = self.app.post('/add_user', json={
@@ -0,0 +1,100 @@
+import asyncio
+import unittest
+from bot.dispatcher import Dispatcher
+
+
+class TestDispatcher(unittest.IsolatedAsyncioTestCase):
+    async def test_keeps_order_within_a_chat(self):
+        handled = []
+
+        async def handler(update):
+            # Later updates finish faster; ordering must still hold per chat.
+            await asyncio.sleep(0.01 * (3 - update['n']))
+            handled.append((update['chat'], update['n']))
+
+        dispatcher = Dispatcher(handler)
+        for n in range(3):
+            for chat in ('a', 'b'):
+                await dispatcher.submit(chat, {'chat': chat, 'n': n})
+        await dispatcher.join()
+
+        self.assertEqual([n for chat, n in handled if chat == 'a'], [0, 1, 2])
+        self.assertEqual([n for chat, n in handled if chat == 'b'], [0, 1, 2])
+        self.assertEqual(dispatcher.stats()['processed'], 6)
+        self.assertEqual(dispatcher.stats()['active_chats'], 0)
+
+    async def test_chats_run_concurrently(self):
+        running = set()
+        overlap = []
+
+        async def handler(update):
+            running.add(update)
+            overlap.append(len(running))
+            await asyncio.sleep(0.02)
+            running.discard(update)
+
+        dispatcher = Dispatcher(handler)
+        for chat in range(5):
+            await dispatcher.submit(chat, chat)
+        await dispatcher.join()
+        self.assertEqual(max(overlap), 5)
+
+    async def test_concurrency_limit(self):
+        running = []
+        peak = []
+
+        async def handler(update):
+            running.append(update)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(update)
+
+        dispatcher = Dispatcher(handler, max_concurrency=2)
+        for chat in range(6):
+            await dispatcher.submit(chat, chat)
+        await dispatcher.join()
+        self.assertEqual(max(peak), 2)
+
+    async def test_failing_handler_does_not_stop_the_chat(self):
+        handled = []
+
+        async def handler(update):
+            if update == 0:
+                raise RuntimeError("boom")
+            handled.append(update)
+
+        dispatcher = Dispatcher(handler)
+        await dispatcher.submit('a', 0)
+        await dispatcher.submit('a', 1)
+        await dispatcher.join()
+        self.assertEqual(handled, [1])
+        self.assertEqual(dispatcher.stats()['failed'], 1)
+
+
+    async def test_cancelled_drain_releases_the_chat(self):
+        handled = []
+        started = asyncio.Event()
+
+        async def handler(update):
+            if update == 0:
+                started.set()
+                await asyncio.sleep(10)
+            handled.append(update)
+
+        dispatcher = Dispatcher(handler)
+        await dispatcher.submit('a', 0)
+        await dispatcher.submit('a', 1)
+        await started.wait()
+        for task in list(dispatcher._tasks):
+            task.cancel()
+        await dispatcher.join()
+        self.assertEqual(dispatcher.stats()['active_chats'], 0)
+        self.assertEqual(dispatcher.stats()['pending'], 0)
+
+        await dispatcher.submit('a', 2)
+        await dispatcher.join()
+        self.assertEqual(handled, [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import asyncio
+from aiohttp import web
+
+
+class FakeTelegramServer:
+    """
+    Local stand-in for the Telegram Bot API. Queue updates with push_update(); every other
+    method call is recorded in `calls` and answered with a minimal successful result.
+    """
+
+    def __init__(self, token='test-token'):
+        self.token = token
+        self.calls = []
+        self._updates = []
+        self._next_update_id = 1
+        self._new_update = asyncio.Event()
+        self._runner = None
+        self.url = None
+
+    def push_update(self, update):
+        update = dict(update, update_id=self._next_update_id)
+        self._next_update_id += 1
+        self._updates.append(update)
+        self._new_update.set()
+
+    def push_message(self, chat_id, text):
+        self.push_update({'message': {'message_id': self._next_update_id, 'chat': {'id': chat_id}, 'text': text}})
+
+    def sent_messages(self, chat_id=None):
+        return [params for method, params in self.calls
+                if method == 'sendMessage' and (chat_id is None or params['chat_id'] == chat_id)]
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        params = await request.json() if request.can_read_body else {}
+        if method == 'getUpdates':
+            offset = params.get('offset') or 0
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            if not self._updates:
+                self._new_update.clear()
+                try:
+                    await asyncio.wait_for(self._new_update.wait(), params.get('timeout', 0))
+                except asyncio.TimeoutError:
+                    pass
+            return web.json_response({'ok': True, 'result': self._updates})
+        self.calls.append((method, params))
+        return web.json_response({'ok': True, 'result': {'message_id': len(self.calls)}})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(f'/bot{self.token}/{{method}}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
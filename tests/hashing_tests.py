@@ -0,0 +1,55 @@
+import threading
+import unittest
+from concurrent.futures import Future
+from unittest.mock import patch
+from db import hashing
+from db.hashing import HashingBusyError, check_password, hash_password
+
+
+class TestHashing(unittest.TestCase):
+    def test_round_trip_in_worker_processes(self):
+        with patch.object(hashing, 'HASH_WORKERS', 2):
+            try:
+                hashed = hash_password("s3cret-pass", rounds=4)
+                self.assertTrue(check_password("s3cret-pass", hashed))
+                self.assertFalse(check_password("wrong-pass", hashed))
+            finally:
+                hashing.shutdown()
+
+    def test_bulk_hashing_holds_queue_slots(self):
+        with patch.object(hashing, 'HASH_WORKERS', 2):
+            try:
+                hashed = hashing.hash_passwords(["a", "b", "c", "d", "e"], rounds=4, chunk_size=2)
+                self.assertEqual(len(hashed), 5)
+                self.assertTrue(check_password("e", hashed[4]))
+
+                for _ in range(hashing.HASH_QUEUE_SIZE):
+                    hashing._slots.acquire()
+                with patch.object(hashing, 'HASH_TIMEOUT', 0.05), self.assertRaises(HashingBusyError):
+                    hashing.hash_passwords(["a"], rounds=4)
+            finally:
+                hashing.shutdown()
+
+    def test_inline_when_no_workers(self):
+        with patch.object(hashing, 'HASH_WORKERS', 0), \
+                patch.object(hashing, '_get_executor', side_effect=AssertionError("no executor expected")):
+            hashed = hash_password("s3cret-pass", rounds=4)
+            self.assertTrue(check_password("s3cret-pass", hashed))
+            self.assertEqual(len(hashing.hash_passwords(["a", "b", "c"], rounds=4)), 3)
+
+    def test_full_queue_is_rejected(self):
+        with patch.object(hashing, 'HASH_WORKERS', 1), \
+                patch.object(hashing, '_get_executor'), \
+                patch.object(hashing, '_slots', threading.BoundedSemaphore(1)) as slots:
+            slots.acquire()
+            with self.assertRaises(HashingBusyError):
+                hash_password("s3cret-pass", rounds=4)
+
+    def test_slow_hash_times_out(self):
+        with patch.object(hashing, 'HASH_TIMEOUT', 0.01):
+            with self.assertRaises(HashingBusyError):
+                hashing._result(Future())  # never completes
+
+
+if __name__ == '__main__':
+    unittest.main()
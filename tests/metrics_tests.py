@@ -0,0 +1,48 @@
+import logging
+import unittest
+from db.metrics import Counter, Histogram, log_event, register_collector, render, statement_label, histogram, counter
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        h = Histogram('test_latency_seconds', "Latency", ('route',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            h.observe(value, route='/a')
+        samples = dict(h.samples())
+        self.assertEqual(samples['test_latency_seconds_bucket{route="/a",le="0.1"}'], 1)
+        self.assertEqual(samples['test_latency_seconds_bucket{route="/a",le="1.0"}'], 3)
+        self.assertEqual(samples['test_latency_seconds_bucket{route="/a",le="+Inf"}'], 4)
+        self.assertEqual(samples['test_latency_seconds_count{route="/a"}'], 4)
+        self.assertAlmostEqual(samples['test_latency_seconds_sum{route="/a"}'], 6.05)
+
+    def test_counter_labels_are_escaped(self):
+        c = Counter('test_total', "Test", ('name',))
+        c.inc(name='say "hi"')
+        c.inc(2, name='say "hi"')
+        self.assertEqual(c.samples(), [('test_total{name="say \\"hi\\""}', 3)])
+
+    def test_render_includes_registered_metrics_and_collectors(self):
+        counter('test_render_total', "Rendered").inc()
+        histogram('test_render_seconds', "Rendered latency").observe(0.01)
+        register_collector(lambda: [('test_gauge', 'gauge', "A gauge", [({'pool': 'main'}, 7)])])
+        text = render()
+        self.assertIn('# TYPE test_render_total counter\ntest_render_total 1\n', text)
+        self.assertIn('test_render_seconds_count 1', text)
+        self.assertIn('# TYPE test_gauge gauge\ntest_gauge{pool="main"} 7\n', text)
+
+    def test_statement_label(self):
+        self.assertEqual(statement_label("SELECT user_id FROM users WHERE user_id = %s"), 'select:users')
+        self.assertEqual(statement_label(b"INSERT INTO Exercises (workout_id) VALUES (1)"), 'insert:exercises')
+        self.assertEqual(statement_label("  UPDATE users SET email = %s"), 'update:users')
+        self.assertEqual(statement_label("SELECT 1"), 'select')
+
+    def test_log_event_sampling(self):
+        log = logging.getLogger('tests.metrics')
+        with self.assertLogs(log, logging.INFO) as logs:
+            log_event(log, 'dropped', sample_rate=0)
+            log_event(log, 'kept', user_id=1, note='two words')
+        self.assertEqual(logs.output, ['INFO:tests.metrics:kept user_id=1 note="two words"'])
+
+
+if __name__ == '__main__':
+    unittest.main()
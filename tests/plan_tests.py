@@ -0,0 +1,112 @@
+import asyncio
+import unittest
+from bot.commands import split_message, stream_message
+from bot.plans import LocalPlanBackend, PlanService, plan_key
+from db.cache import TTLCache
+
+QUESTIONNAIRE = {
+    'description': "Office worker, I walk a bit",
+    'goals': "Run a marathon and build strength",
+    'challenges': "Busy schedule, bad knee",
+    'expectations': "A plan I can stick to"
+}
+
+
+class CountingBackend(LocalPlanBackend):
+    def __init__(self, delay=0.01, fail=False):
+        super().__init__(delay)
+        self.calls = 0
+        self.fail = fail
+
+    async def stream(self, prompt, questionnaire):
+        self.calls += 1
+        async for chunk in super().stream(prompt, questionnaire):
+            yield chunk
+            if self.fail:
+                raise RuntimeError("model unavailable")
+
+
+class FakeBot:
+    def __init__(self):
+        self.messages = {}
+        self.edits = 0
+
+    async def send(self, chat_id, text):
+        message_id = len(self.messages) + 1
+        self.messages[message_id] = text
+        return {'message_id': message_id}
+
+    async def edit(self, chat_id, message_id, text):
+        self.edits += 1
+        self.messages[message_id] = text
+
+
+def service(backend, **kwargs):
+    return PlanService(backend, cache=TTLCache('test-plan', maxsize=100, ttl=60), **kwargs)
+
+
+class TestPlans(unittest.IsolatedAsyncioTestCase):
+    async def test_local_backend_is_deterministic(self):
+        first = await service(LocalPlanBackend()).generate(QUESTIONNAIRE)
+        second = await service(LocalPlanBackend()).generate(dict(QUESTIONNAIRE))
+        self.assertEqual(first, second)
+        self.assertIn("endurance, strength", first)
+        self.assertIn("low impact", first)
+
+    def test_key_ignores_case_and_spacing(self):
+        shouted = dict(QUESTIONNAIRE, goals="  RUN a   marathon and build STRENGTH ")
+        self.assertEqual(plan_key(QUESTIONNAIRE, 'local'), plan_key(shouted, 'local'))
+        self.assertNotEqual(plan_key(QUESTIONNAIRE, 'local'), plan_key(QUESTIONNAIRE, 'other'))
+        self.assertNotEqual(plan_key(QUESTIONNAIRE, 'local'), plan_key(dict(QUESTIONNAIRE, goals="Swim"), 'local'))
+
+    async def test_concurrent_requests_share_one_generation(self):
+        backend = CountingBackend()
+        plans = service(backend)
+        texts = await asyncio.gather(*(plans.generate(QUESTIONNAIRE) for _ in range(5)))
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(len(set(texts)), 1)
+        self.assertEqual(plans.stats()['coalesced'], 4)
+
+        await plans.generate(dict(QUESTIONNAIRE, goals=QUESTIONNAIRE['goals'].upper()))
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(plans.stats()['cache_hits'], 1)
+
+    async def test_stored_plans_are_loaded_and_new_ones_saved(self):
+        stored = {}
+
+        async def load(key):
+            return stored.get(key)
+
+        async def save(key, backend, text):
+            stored[key] = text
+
+        backend = CountingBackend()
+        text = await service(backend, load=load, save=save).generate(QUESTIONNAIRE)
+        self.assertEqual(list(stored.values()), [text])
+        # A restarted bot has an empty memory cache but finds the plan in storage.
+        self.assertEqual(await service(backend, load=load, save=save).generate(QUESTIONNAIRE), text)
+        self.assertEqual(backend.calls, 1)
+
+    async def test_failures_are_not_cached(self):
+        backend = CountingBackend(fail=True)
+        plans = service(backend)
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                await plans.generate(QUESTIONNAIRE)
+        self.assertEqual(backend.calls, 2)
+        self.assertEqual(plans.stats()['failed'], 2)
+        self.assertEqual(plans.stats()['in_flight'], 0)
+
+    async def test_stream_message_edits_in_place_and_splits_long_text(self):
+        bot = FakeBot()
+        plans = service(CountingBackend(delay=0.02))
+        text = await stream_message(bot, 1, plans.stream(QUESTIONNAIRE), "...", interval=0.05)
+        self.assertEqual(bot.messages[1], text.rstrip())
+        self.assertGreater(bot.edits, 1)
+
+        self.assertEqual(split_message("a\nbb\ncc", limit=4), ["a\n", "bb\n", "cc"])
+        self.assertEqual(split_message("abcdef", limit=4), ["abcd", "ef"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import contextvars
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from db import connection
+from db.cache import TTLCache
+from db.pool import BoundedConnectionPool, PoolTimeoutError, PoolClosedError
+
+
+class FakeConnection:
+    def __init__(self, name=None):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        pass
+
+
+class FakeCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+
+class TestBoundedConnectionPool(unittest.TestCase):
+    def test_reuses_returned_connection(self):
+        pool = BoundedConnectionPool(FakeConnection, minconn=1, maxconn=2)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        self.assertIs(pool.getconn(), conn)
+        self.assertEqual(pool.stats()['connections_opened'], 1)
+
+    def test_times_out_when_exhausted(self):
+        pool = BoundedConnectionPool(FakeConnection, minconn=0, maxconn=1, timeout=0.05)
+        pool.getconn()
+        with self.assertRaises(PoolTimeoutError):
+            pool.getconn()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+    def test_waiter_gets_connection_when_returned(self):
+        pool = BoundedConnectionPool(FakeConnection, minconn=0, maxconn=1, timeout=2)
+        conn = pool.getconn()
+        result = {}
+
+        def waiter():
+            result['conn'] = pool.getconn()
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        time.sleep(0.05)
+        pool.putconn(conn)
+        thread.join(1)
+        self.assertIs(result['conn'], conn)
+        self.assertGreater(pool.stats()['wait_time_max'], 0)
+
+    def test_rejects_when_wait_queue_full(self):
+        pool = BoundedConnectionPool(FakeConnection, minconn=0, maxconn=1, timeout=0.5, max_waiters=0)
+        pool.getconn()
+        with self.assertRaises(PoolTimeoutError):
+            pool.getconn()
+        self.assertEqual(pool.stats()['rejected'], 1)
+
+    def test_stale_connection_is_replaced(self):
+        pool = BoundedConnectionPool(FakeConnection, minconn=0, maxconn=1, validate_after=0,
+                                     check=lambda conn: False)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        replacement = pool.getconn()
+        self.assertIsNot(replacement, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()['validation_failures'], 1)
+
+    def test_expired_connection_is_recycled(self):
+        pool = BoundedConnectionPool(FakeConnection, minconn=0, maxconn=1, max_lifetime=0)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        self.assertIsNot(pool.getconn(), conn)
+        self.assertEqual(pool.stats()['connections_recycled'], 1)
+
+    def test_failed_reset_discards_connection(self):
+        pool = BoundedConnectionPool(FakeConnection, minconn=0, maxconn=1, reset=lambda conn: False)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+
+    def test_closed_pool_refuses_checkout(self):
+        pool = BoundedConnectionPool(FakeConnection, minconn=1, maxconn=1)
+        pool.closeall()
+        with self.assertRaises(PoolClosedError):
+            pool.getconn()
+
+
+
+class TestReadRouting(unittest.TestCase):
+    def setUp(self):
+        self.down = set()
+
+        def create_pool(name):
+            if name in self.down:
+                raise ConnectionError(f"could not connect to {name}")
+            return BoundedConnectionPool(lambda: FakeConnection(name), minconn=0, maxconn=2)
+
+        for target, value in [('REPLICAS', ['replica0', 'replica1']), ('_create_pool', create_pool),
+                              ('_pools', {}), ('_replica_down_until', {}),
+                              ('_recent_writes', TTLCache('test-recent-write', ttl=60))]:
+            patcher = patch.object(connection, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def used(self, **kwargs):
+        with connection.get_db_connection(**kwargs) as conn:
+            return conn.name
+
+    def test_reads_spread_over_replicas_and_writes_go_to_primary(self):
+        self.assertEqual({self.used(readonly=True) for _ in range(4)}, {'replica0', 'replica1'})
+        self.assertEqual(self.used(), 'primary')
+
+    def test_unreachable_replica_is_skipped(self):
+        self.down = {'replica0', 'replica1'}
+        self.assertEqual(self.used(readonly=True), 'primary')
+        self.down = {'replica0'}
+        self.assertEqual({self.used(readonly=True) for _ in range(4)}, {'primary'})  # still marked down
+
+        connection._replica_down_until.clear()
+        self.assertEqual({self.used(readonly=True) for _ in range(4)}, {'replica1'})
+        self.assertIn('replica0', connection._replica_down_until)
+
+    def test_busy_replica_is_not_marked_down(self):
+        replica = connection.get_pool('replica0')
+        held = [replica.getconn(timeout=0.01) for _ in range(2)]
+        with patch.object(connection, 'REPLICAS', ['replica0']):
+            with self.assertRaises(PoolTimeoutError):
+                self.used(readonly=True, timeout=0.01)
+        self.assertEqual(connection._replica_down_until, {})
+        for conn in held:
+            replica.putconn(conn)
+
+    def test_reads_after_own_writes_stay_on_primary(self):
+        def write_then_read():
+            with connection.get_db_cursor(commit=True, user_id=7):
+                pass
+            return self.used(readonly=True)
+
+        # The writing context is pinned to the primary...
+        self.assertEqual(contextvars.copy_context().run(write_then_read), 'primary')
+        # ...and so are reads about the user from anywhere else, while other reads are not.
+        self.assertEqual(self.used(readonly=True, user_id=7), 'primary')
+        self.assertTrue(self.used(readonly=True, user_id=8).startswith('replica'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import asyncio
+import datetime
+import json
+import unittest
+from bot.reminders import ReminderScheduler, format_reminder
+from bot.sender import BROADCAST
+
+T0 = datetime.datetime(2024, 5, 1, 9, 0)
+LEAD = datetime.timedelta(minutes=30)
+
+
+class FakeSender:
+    def __init__(self):
+        self.queued = []
+
+    def enqueue(self, chat_id, text, priority):
+        self.queued.append((chat_id, text, priority))
+
+
+class FakeStore:
+    """Events and deliveries in memory, behaving like db.reminder_queries."""
+
+    def __init__(self, events=()):
+        self.events = dict(events)  # event_id -> start_time
+        self.delivered = set()
+        self.loads = []
+
+    async def load(self, after, until, limit):
+        self.loads.append((after, until, limit))
+        rows = sorted((start, event_id) for event_id, start in self.events.items()
+                      if (start, event_id) > after and start <= until and (event_id, start) not in self.delivered)
+        return [(event_id, start) for start, event_id in rows[:limit]]
+
+    async def claim(self, reminders, now):
+        claimed = []
+        for event_id, start in reminders:
+            if self.events.get(event_id) == start and start > now and (event_id, start) not in self.delivered:
+                self.delivered.add((event_id, start))
+                claimed.append((event_id, 100 + event_id, f"Event {event_id}", start, None))
+        return claimed
+
+
+class TestReminderScheduler(unittest.TestCase):
+    def setUp(self):
+        self.now = T0
+        self.sender = FakeSender()
+
+    def scheduler(self, store, **kwargs):
+        kwargs.setdefault('lead', LEAD)
+        kwargs.setdefault('horizon', datetime.timedelta(hours=2))
+        return ReminderScheduler(self.sender, store.load, store.claim, clock=lambda: self.now, **kwargs)
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def test_fires_lead_before_start_once(self):
+        store = FakeStore({1: T0 + datetime.timedelta(hours=1)})
+        scheduler = self.scheduler(store)
+        self.run_async(scheduler.refill())
+        self.assertEqual(self.run_async(scheduler.fire_due()), 0)
+
+        self.now = T0 + datetime.timedelta(minutes=30)
+        self.assertEqual(self.run_async(scheduler.fire_due()), 1)
+        self.assertEqual(self.sender.queued, [(101, "Reminder: Event 1 at 10:00", BROADCAST)])
+        self.assertEqual(self.run_async(scheduler.fire_due()), 0)
+
+    def test_restart_does_not_send_twice(self):
+        store = FakeStore({1: T0 + datetime.timedelta(minutes=20)})
+        for _ in range(2):
+            scheduler = self.scheduler(store)
+            self.run_async(scheduler.refill())
+            self.run_async(scheduler.fire_due())
+        self.assertEqual(len(self.sender.queued), 1)
+
+    def test_window_is_bounded(self):
+        store = FakeStore((i, T0 + datetime.timedelta(minutes=40, seconds=i)) for i in range(1, 51))
+        scheduler = self.scheduler(store, max_pending=10, batch_size=1)
+        self.run_async(scheduler.refill())
+        self.assertEqual(scheduler.stats()['pending'], 10)
+
+        # As reminders fire, later events are loaded into the freed space.
+        self.now = T0 + datetime.timedelta(minutes=30)
+        sent = 0
+        for _ in range(10):
+            sent += self.run_async(scheduler.fire_due())
+            self.run_async(scheduler.refill())
+            self.assertLessEqual(scheduler.stats()['pending'], 10)
+        self.assertEqual(sent, 50)
+
+    def test_changes_are_applied_incrementally(self):
+        store = FakeStore({1: T0 + datetime.timedelta(minutes=40), 2: T0 + datetime.timedelta(minutes=50)})
+        scheduler = self.scheduler(store)
+        self.run_async(scheduler.refill())
+        loads = len(store.loads)
+
+        # Event 1 is moved later, event 2 deleted and event 3 added, all inside the window.
+        store.events[1] = T0 + datetime.timedelta(minutes=90)
+        scheduler.on_change(json.dumps({'op': 'UPDATE', 'event_id': 1, 'start_time': store.events[1].isoformat()}))
+        del store.events[2]
+        scheduler.on_change(json.dumps({'op': 'DELETE', 'event_id': 2}))
+        store.events[3] = T0 + datetime.timedelta(minutes=45)
+        scheduler.on_change(json.dumps({'op': 'INSERT', 'event_id': 3, 'start_time': store.events[3].isoformat()}))
+        self.assertEqual(len(store.loads), loads)
+
+        self.now = T0 + datetime.timedelta(minutes=30)
+        self.run_async(scheduler.fire_due())
+        self.assertEqual([chat_id for chat_id, _, _ in self.sender.queued], [103])
+        self.now = T0 + datetime.timedelta(minutes=60)
+        self.run_async(scheduler.fire_due())
+        self.assertEqual([chat_id for chat_id, _, _ in self.sender.queued], [103, 101])
+
+    def test_events_beyond_the_window_wait_for_refill(self):
+        store = FakeStore()
+        scheduler = self.scheduler(store)
+        self.run_async(scheduler.refill())
+        store.events[1] = T0 + datetime.timedelta(hours=5)
+        scheduler.on_change(json.dumps({'op': 'INSERT', 'event_id': 1, 'start_time': store.events[1].isoformat()}))
+        self.assertEqual(scheduler.stats()['pending'], 0)
+
+        self.now = T0 + datetime.timedelta(hours=4)
+        self.run_async(scheduler.refill())
+        self.assertEqual(scheduler.stats()['pending'], 1)
+
+    def test_format_reminder(self):
+        self.assertEqual(format_reminder("Run", T0, "Park"), "Reminder: Run at 09:00 (Park)")
+
+
+if __name__ == '__main__':
+    unittest.main()
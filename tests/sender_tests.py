@@ -0,0 +1,108 @@
+import asyncio
+import time
+import unittest
+from bot.sender import SendScheduler, TokenBucket, BROADCAST, INTERACTIVE
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Too Many Requests")
+        self.retry_after = retry_after
+
+
+class FakeAPI:
+    def __init__(self, fail_first=None):
+        self.sent = []
+        self.fail_first = fail_first
+
+    async def send_message(self, chat_id, text, **params):
+        if self.fail_first is not None:
+            error, self.fail_first = self.fail_first, None
+            raise error
+        self.sent.append((chat_id, text, time.monotonic()))
+        return {'chat_id': chat_id, 'text': text}
+
+    async def edit_message_text(self, chat_id, text, message_id, **params):
+        self.sent.append((chat_id, text, time.monotonic()))
+        return {'chat_id': chat_id, 'text': text, 'edited': message_id}
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_refills_at_rate(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+        bucket.take()
+        bucket.take()
+        self.assertAlmostEqual(bucket.delay(), 0.5)
+        now[0] = 0.5
+        self.assertEqual(bucket.delay(), 0)
+
+    def test_pause(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=1, capacity=3, clock=lambda: now[0])
+        bucket.pause(5)
+        self.assertAlmostEqual(bucket.delay(), 5)
+
+
+class TestSendScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_interactive_goes_before_broadcast(self):
+        api = FakeAPI()
+        scheduler = SendScheduler(api, global_rate=1)
+        futures = [scheduler.enqueue(chat, 'news', BROADCAST) for chat in range(1, 4)]
+        futures.append(scheduler.enqueue(99, 'reply', INTERACTIVE))
+        await asyncio.wait_for(futures[-1], 2)
+        await scheduler.stop(drain=False)
+        self.assertEqual(api.sent[0][:2], (99, 'reply'))
+
+    async def test_reply_promotes_a_chat_waiting_on_broadcast(self):
+        api = FakeAPI()
+        scheduler = SendScheduler(api, global_rate=20)
+        futures = [scheduler.enqueue(chat, 'news', BROADCAST) for chat in range(1, 4)]
+        futures.append(scheduler.enqueue(3, 'reply', INTERACTIVE))
+        await asyncio.wait_for(asyncio.gather(*futures), 2)
+        await scheduler.stop()
+        self.assertEqual(api.sent[0][:2], (3, 'reply'))
+        # The chat's old broadcast entry is skipped, not sent from twice.
+        self.assertEqual(sorted(chat for chat, _, _ in api.sent), [1, 2, 3, 3])
+
+    async def test_per_chat_rate_and_order(self):
+        api = FakeAPI()
+        scheduler = SendScheduler(api, global_rate=100, chat_rate=20, chat_burst=1)
+        futures = [scheduler.enqueue(1, str(n)) for n in range(3)]
+        await asyncio.wait_for(asyncio.gather(*futures), 2)
+        await scheduler.stop()
+        self.assertEqual([text for _, text, _ in api.sent], ['0', '1', '2'])
+        gaps = [b[2] - a[2] for a, b in zip(api.sent, api.sent[1:])]
+        self.assertTrue(all(gap >= 0.045 for gap in gaps), gaps)
+
+    async def test_retry_after_is_honored(self):
+        api = FakeAPI(fail_first=RateLimited(0.1))
+        scheduler = SendScheduler(api, global_rate=100)
+        started = time.monotonic()
+        await asyncio.wait_for(scheduler.send(1, 'hello'), 2)
+        await scheduler.stop()
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+        self.assertEqual(scheduler.stats()['rate_limited'], 1)
+        self.assertEqual(scheduler.stats()['interactive']['sent'], 1)
+
+    async def test_other_errors_fail_the_message(self):
+        api = FakeAPI(fail_first=RuntimeError("chat not found"))
+        scheduler = SendScheduler(api, global_rate=100)
+        with self.assertRaises(RuntimeError):
+            await asyncio.wait_for(scheduler.send(1, 'hello'), 2)
+        await scheduler.stop()
+        self.assertEqual(scheduler.stats()['failed'], 1)
+
+    async def test_edits_share_the_chat_queue(self):
+        api = FakeAPI()
+        scheduler = SendScheduler(api, global_rate=100)
+        sent = await asyncio.wait_for(scheduler.send(1, 'draft'), 2)
+        edited = await asyncio.wait_for(scheduler.edit(1, 42, 'final'), 2)
+        await scheduler.stop()
+        self.assertNotIn('edited', sent)
+        self.assertEqual(edited['edited'], 42)
+        self.assertEqual([text for _, text, _ in api.sent], ['draft', 'final'])
+
+
+if __name__ == '__main__':
+    unittest.main()
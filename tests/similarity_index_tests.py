@@ -0,0 +1,51 @@
+import tempfile
+import unittest
+from db.similarity_index import SimilarityIndex, features
+
+
+class TestSimilarityIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SimilarityIndex(dim=512, capacity=2)
+        self.index.add(1, "Run a marathon and improve my endurance")
+        self.index.add(2, "Lose weight and eat healthier")
+        self.index.add(3, "Endurance running, maybe a marathon next year")
+        self.index.add(4, "Build muscle and get stronger on the bench press")
+
+    def test_features_drop_stop_words_and_add_pairs(self):
+        self.assertEqual(features("I want to run a Marathon"), ['run', 'marathon', 'run marathon'])
+
+    def test_similar_users_best_first(self):
+        similar = self.index.similar_to(1, 2)
+        self.assertEqual(similar[0][0], 3)
+        self.assertNotIn(1, [key for key, _ in similar])
+        self.assertIsNone(self.index.similar_to(99))
+
+    def test_query_by_text(self):
+        self.assertEqual(self.index.query("bench press for muscle", 1)[0][0], 4)
+        self.assertEqual(self.index.query("", 3), [])
+
+    def test_add_replaces_and_remove_keeps_positions(self):
+        self.index.add(3, "Lose weight with a healthier diet")
+        self.assertEqual(self.index.similar_to(2, 1)[0][0], 3)
+
+        self.assertEqual(self.index.remove(1, 99), 1)
+        self.assertEqual(len(self.index), 3)
+        self.assertNotIn(1, self.index)
+        self.assertEqual(self.index.query("bench press muscle", 1)[0][0], 4)
+
+    def test_memory_mapped_files_are_shared_and_reloaded(self):
+        with tempfile.TemporaryDirectory() as path:
+            first = SimilarityIndex(path, dim=256, capacity=2)
+            first.rebuild([(1, "marathon endurance"), (2, "weight loss"), (3, "marathon training")])
+
+            second = SimilarityIndex(path, dim=256)  # e.g. after a restart, or another worker
+            self.assertEqual(len(second), 3)
+            self.assertEqual(second.similar_to(1, 1)[0][0], 3)
+
+            second.add(4, "endurance for a marathon")
+            second.remove(3)
+            self.assertEqual(sorted(key for key, _ in first.similar_to(1, 3)), [4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+import numpy as np
+from db.sleep_summaries import summarize_sleep
+
+
+class TestSummarizeSleep(unittest.TestCase):
+    def test_matches_per_user_computation(self):
+        user_ids = [1, 2, 1, 1, 2]
+        minutes = [420, 360, 480, 450, 400]
+        quality_sum = [4, 0, 5, 3, 0]
+        quality_count = [1, 0, 1, 1, 0]
+        bedtime = [660, np.nan, 690, 720, 700]
+
+        summaries = summarize_sleep(user_ids, minutes, quality_sum, quality_count, bedtime)
+
+        self.assertEqual(summaries[1]['nights'], 3)
+        self.assertAlmostEqual(summaries[1]['avg_duration_minutes'], 450)
+        self.assertAlmostEqual(summaries[1]['duration_stddev_minutes'], round(float(np.std([420, 480, 450])), 2))
+        self.assertAlmostEqual(summaries[1]['bedtime_stddev_minutes'], round(float(np.std([660, 690, 720])), 2))
+        self.assertAlmostEqual(summaries[1]['avg_quality'], 4)
+
+        self.assertEqual(summaries[2]['nights'], 2)
+        self.assertIsNone(summaries[2]['avg_quality'])
+        self.assertEqual(summaries[2]['bedtime_stddev_minutes'], 0)
+
+    def test_empty_input(self):
+        self.assertEqual(summarize_sleep([], [], [], [], []), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import datetime
+import unittest
+import numpy as np
+from db.workout_backfill import exercise_aggregates, exercise_volume, weekly_aggregates
+from db.workout_queries import validate_exercises
+
+
+def day(value):
+    return datetime.date.fromisoformat(value).toordinal()
+
+
+class TestExerciseAggregates(unittest.TestCase):
+    def test_matches_per_exercise_computation(self):
+        rows = exercise_aggregates(
+            user_ids=[1, 1, 2, 1, 1],
+            exercises=np.array(['squat', 'squat', 'squat', 'row', 'squat'], dtype=object),
+            days=[day('2024-01-01'), day('2024-01-03'), day('2024-01-02'), day('2024-01-01'), day('2024-01-05')],
+            sets=[3, 1, 5, np.nan, 2],
+            reps=[5, 1, 5, 10, 5],
+            weights=[100, 120, 60, np.nan, 100])
+
+        self.assertEqual([row[:2] for row in rows], [(1, 'row'), (1, 'squat'), (2, 'squat')])
+        row, squat, other = rows
+        self.assertEqual(row[2:6], (1, 1, 10, 0.0))  # missing sets count as one, missing weight as zero
+        self.assertEqual(squat[2:5], (3, 6, 26))
+        self.assertAlmostEqual(squat[5], 1500 + 120 + 1000)
+        self.assertEqual(squat[6], 120)
+        self.assertAlmostEqual(squat[7], 120)  # 120x1 beats 100x5 (Epley 116.67)
+        self.assertEqual(squat[8], day('2024-01-03'))
+        self.assertEqual(squat[9], day('2024-01-05'))
+        self.assertAlmostEqual(other[7], 70)
+
+    def test_equal_records_keep_the_earliest_day(self):
+        rows = exercise_aggregates([1, 1], np.array(['bench', 'bench'], dtype=object),
+                                   [day('2024-02-10'), day('2024-02-01')], [1, 1], [5, 5], [80, 80])
+        self.assertEqual(rows[0][8], day('2024-02-01'))
+
+    def test_empty_input(self):
+        self.assertEqual(exercise_aggregates([], [], [], [], [], []), [])
+
+
+class TestWeeklyAggregates(unittest.TestCase):
+    def test_groups_by_monday_week(self):
+        volume = exercise_volume([3, 2], [5, 10], [100, np.nan])
+        rows = weekly_aggregates(
+            workout_user_ids=[1, 1, 1], workout_days=[day('2024-01-01'), day('2024-01-07'), day('2024-01-08')],
+            minutes=[30, np.nan, 45],
+            exercise_user_ids=[1, 1], exercise_days=[day('2024-01-07'), day('2024-01-08')], volume=volume)
+
+        self.assertEqual(rows, [(1, day('2024-01-01'), 2, 30, 1500.0), (1, day('2024-01-08'), 1, 45, 0.0)])
+
+    def test_empty_input(self):
+        self.assertEqual(weekly_aggregates([], [], [], [], [], []), [])
+
+
+
+class TestValidateExercises(unittest.TestCase):
+    def test_rejects_non_finite_and_boolean_values(self):
+        for exercise in ({'name': 'squat', 'weight': float('nan')}, {'name': 'squat', 'weight': float('inf')},
+                         {'name': 'squat', 'weight': True}, {'name': 'squat', 'reps': False},
+                         {'name': 'squat', 'sets': -1}):
+            with self.assertRaises(ValueError, msg=exercise):
+                validate_exercises([exercise])
+        self.assertEqual(len(validate_exercises([{'name': 'squat', 'sets': 3, 'reps': 5, 'weight': 100.5}])), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
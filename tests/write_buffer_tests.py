@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import patch
+from uuid import uuid4
+import psycopg2
+from db.connection import get_db_cursor
+from db.queries import add_user, delete_user
+from db.write_buffer import WriteBuffer
+
+
+class TestWriteBuffer(unittest.TestCase):
+    def setUp(self):
+        self.user_id = add_user("Buffer", "Test", f"buffer_{uuid4()}@example.com", "password123")
+        self.buffer = WriteBuffer(max_batch=50, max_delay=0.05)
+
+    def tearDown(self):
+        self.buffer.close()
+        delete_user(self.user_id)
+
+    def test_writes_are_acknowledged_after_one_batched_commit(self):
+        sleep = [self.buffer.add_sleep_record(self.user_id, f'2024-01-{day:02d}T23:00', f'2024-01-{day + 1:02d}T07:00', 'good')
+                 for day in range(1, 21)]
+        workout = self.buffer.add_workout(self.user_id, '2024-01-05', 40, exercises=[{'name': 'Squat', 'sets': 3, 'reps': 5}])
+        sleep_ids = [future.result(timeout=5) for future in sleep]
+        workout_id = workout.result(timeout=5)
+        exercise_ids = self.buffer.add_exercises(workout_id, [{'name': 'Row'}, {'name': 'Press'}]).result(timeout=5)
+
+        self.assertEqual(len(set(sleep_ids)), 20)
+        self.assertEqual(len(exercise_ids), 2)
+        self.assertLessEqual(self.buffer.stats()['batches'], 3)
+        with get_db_cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM Exercises WHERE workout_id = %s", (workout_id,))
+            self.assertEqual(cursor.fetchone()[0], 3)
+            cursor.execute("SELECT sum(records) FROM sleep_daily WHERE user_id = %s", (self.user_id,))
+            self.assertEqual(cursor.fetchone()[0], 20)
+
+    def test_bad_write_does_not_fail_its_batch(self):
+        good = self.buffer.add_workout(self.user_id, '2024-01-05')
+        bad = self.buffer.add_workout(0, '2024-01-05')
+        self.assertTrue(self.buffer.flush(timeout=5))
+        self.assertIsInstance(good.result(), int)
+        with self.assertRaises(ValueError):
+            bad.result()
+
+    def test_validation_errors_are_raised_immediately(self):
+        with self.assertRaises(ValueError):
+            self.buffer.add_sleep_record(self.user_id, '2024-01-02T07:00', '2024-01-01T23:00')
+
+
+class TestWriteBufferUnavailableDatabase(unittest.TestCase):
+    def test_connection_errors_fail_the_batch_without_replaying(self):
+        buffer = WriteBuffer(max_batch=50, max_delay=0.05)
+        with patch('db.write_buffer.get_db_cursor', side_effect=psycopg2.OperationalError("server closed")) as cursor:
+            futures = [buffer.add_workout(7, '2024-01-05') for _ in range(5)]
+            self.assertTrue(buffer.flush(timeout=5))
+            buffer.close()
+        self.assertEqual(cursor.call_count, 1)
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result()
+        self.assertEqual(buffer.stats()['failures'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()